@@ -1,16 +1,35 @@
 import streamlit as st
 import pandas as pd
 from datetime import date, datetime
-from PIL import Image
-from fpdf import FPDF
+from PIL import Image, ImageOps
 import requests
 from io import BytesIO
 import firebase_admin
-from firebase_admin import credentials, firestore, exceptions
+from firebase_admin import credentials, firestore, exceptions, storage
 import os
 import json
 from google.cloud.exceptions import NotFound
+from google.api_core.exceptions import FailedPrecondition
 import base64
+from exportar_cotizaciones import export_quotes_zip
+from pdf_cotizaciones import format_currency, generate_pdf_content, get_pdf_assets
+from rendimiento import PERF_SLOW_RERUN_MS, PerfRecorder, PerfTrace, percentile, perf_logger
+import copy
+import time
+import logging
+import threading
+import pyarrow as pa
+import re
+import bisect
+import heapq
+import hashlib
+import math
+import random
+import unicodedata
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(
@@ -45,108 +64,433 @@ def init_firebase():
         return None
 
 db = init_firebase()
+logger = logging.getLogger(__name__)
 
-# --- FUNCIONES DE WIX API ---
-@st.cache_data(ttl=3600, show_spinner=False)
-def fetch_and_process_wix_data():
-    """Descarga TODOS los productos de Wix (paginados) usando Secrets."""
-    
-    # Verificar si existen los secrets
-    if 'wix_api' not in st.secrets:
-        st.error("❌ No se encontraron las credenciales de Wix en st.secrets.")
+# --- MEDICIÓN DE TIEMPOS ---
+# Tramos medidos en los caminos lentos (páginas de Wix, lecturas de Firestore,
+# descargas de imágenes, armado del PDF), por rerun, por sesión y por proceso.
+# Se activa con st.secrets["perf"]["enabled"]; apagado, `perf_span` devuelve
+# un tramo vacío y el costo es una llamada a función.
+@st.cache_resource
+def get_perf_recorder():
+    """Medidor compartido por todas las sesiones del proceso."""
+    try:
+        config = dict(st.secrets.get("perf", {}))
+    except Exception:  # Sin secrets.toml (scripts de línea de comandos)
+        config = {}
+    log = bool(config.get("log", False))
+    if log and not perf_logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s perf %(message)s"))
+        perf_logger.addHandler(handler)
+        perf_logger.setLevel(logging.INFO)
+    return PerfRecorder(
+        enabled=bool(config.get("enabled", False)),
+        slow_rerun_ms=float(config.get("slow_rerun_ms", PERF_SLOW_RERUN_MS)),
+        log=log,
+    )
+
+perf_recorder = get_perf_recorder()
+
+def perf_span(stage):
+    """`with perf_span('wix.pagina') as span: ...; span.add(bytes=n)`."""
+    return perf_recorder.span(stage)
+
+# --- CLIENTE HTTP ---
+HTTP_POOL_SIZE = 16  # Conexiones abiertas por host: alcanza para las páginas de Wix y el prefetch de imágenes
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_RETRIES = 3  # Intentos totales en llamadas idempotentes
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8
+HTTP_RETRY_AFTER_MAX = 30  # Si Wix pide esperar más que esto, no se espera y se devuelve la respuesta
+HTTP_RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+HTTP_IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+HTTP_BREAKER_FAILURES = 5
+HTTP_BREAKER_COOLDOWN = 30  # Segundos que un host caído queda sin llamadas
+
+class HostUnavailableError(requests.ConnectionError):
+    """El circuito del host está abierto: la llamada ni se intenta."""
+
+class CircuitBreaker:
+    """Corta las llamadas a un host después de `failures` fallas de red seguidas.
+
+    Abierto, rechaza todo durante `cooldown` segundos; después deja pasar
+    una sola llamada de prueba y se cierra si esa responde.
+    """
+    def __init__(self, failures=HTTP_BREAKER_FAILURES, cooldown=HTTP_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'cerrado'
+            if self._probing or self._clock() - self._opened_at < self.cooldown:
+                return 'abierto'
+            return 'semiabierto'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or self._clock() - self._opened_at < self.cooldown:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or self._consecutive >= self.failures:
+                self._opened_at = self._clock()
+            self._probing = False
+
+    def release(self):
+        """Libera la llamada de prueba sin juzgar al host (p. ej. la URL era inválida)."""
+        with self._lock:
+            self._probing = False
+
+def parse_retry_after(value):
+    """Segundos de un header Retry-After (número o fecha HTTP); None si no se entiende."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
         return None
+    if when.tzinfo is None:
+        return None
+    return max(0.0, (when - datetime.now(when.tzinfo)).total_seconds())
+
+class HttpClient:
+    """Sesión de `requests` compartida, con reintentos y un circuit breaker por host.
+
+    La sesión mantiene las conexiones abiertas (keep-alive) y pide las
+    respuestas comprimidas. Solo se reintentan las llamadas idempotentes,
+    ante errores de red o estados de HTTP_RETRY_STATUS, con espera
+    exponencial con jitter o la que indique Retry-After.
+    """
+    def __init__(self, pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF_BASE,
+                 backoff_max=HTTP_BACKOFF_MAX, retry_after_max=HTTP_RETRY_AFTER_MAX,
+                 breaker_failures=HTTP_BREAKER_FAILURES, breaker_cooldown=HTTP_BREAKER_COOLDOWN,
+                 sleep=time.sleep):
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self.session = requests.Session()
+        # requests ya envía Accept-Encoding: gzip, deflate y descomprime solo
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def breaker(self, host):
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.breaker_failures, self.breaker_cooldown)
+            return self._breakers[host]
+
+    def retry_delay(self, attempt, response=None):
+        """Segundos antes del reintento `attempt` + 1; None si Retry-After pide esperar demasiado."""
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after if retry_after <= self.retry_after_max else None
+        # "Full jitter": los hilos que fallaron juntos no reintentan juntos
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def request(self, method, url, retries=None, idempotent=None, **kwargs):
+        """Como `session.request`, pero con reintentos y circuit breaker.
+
+        Devuelve la última respuesta aunque sea un error HTTP; lanza
+        `requests.RequestException` si no hubo respuesta (o
+        `HostUnavailableError` si el host está cortado).
+        """
+        if idempotent is None:
+            idempotent = method.upper() in HTTP_IDEMPOTENT_METHODS
+        attempts = max(1, self.retries if retries is None else retries) if idempotent else 1
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise HostUnavailableError(f"{host} no responde; se vuelve a intentar en {self.breaker_cooldown} s")
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            except requests.RequestException:
+                breaker.release()
+                raise
+            else:
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if response.status_code not in HTTP_RETRY_STATUS or attempt == attempts - 1:
+                    return response
+            delay = self.retry_delay(attempt, response)
+            if delay is None:
+                return response
+            status = response.status_code if response is not None else 'sin respuesta'
+            logger.warning("HTTP %s de %s; reintento %d en %.1f s", status, host, attempt + 1, delay)
+            with perf_span('http.espera'):
+                self._sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+@st.cache_resource
+def get_http_client():
+    """Cliente HTTP del proceso. Se ajusta con st.secrets["http"] (retries, pool_size, breaker_cooldown)."""
+    try:
+        config = dict(st.secrets.get("http", {}))
+    except Exception:  # Sin secrets.toml (p. ej. exportación por línea de comandos)
+        config = {}
+    return HttpClient(
+        pool_size=int(config.get("pool_size", HTTP_POOL_SIZE)),
+        retries=int(config.get("retries", HTTP_RETRIES)),
+        breaker_cooldown=float(config.get("breaker_cooldown", HTTP_BREAKER_COOLDOWN)),
+    )
 
-    api_key = st.secrets["wix_api"]["api_key"]
-    site_id = st.secrets["wix_api"]["site_id"]
-    url = "https://www.wixapis.com/stores/v1/products/query"
+http_client = get_http_client()
 
-    headers = {
-        'Authorization': api_key,
-        'wix-site-id': site_id,
+# --- FUNCIONES DE WIX API ---
+WIX_PRODUCTS_URL = "https://www.wixapis.com/stores/v1/products/query"
+WIX_PAGE_LIMIT = 100
+WIX_MAX_WORKERS = 4  # Se puede sobreescribir con st.secrets["wix_api"]["concurrency"]
+WIX_PAGE_RETRIES = HTTP_RETRIES
+WIX_PAGE_TIMEOUT = 20
+CATALOG_DELTA_INTERVAL = 300  # Segundos entre sincronizaciones incrementales del catálogo
+PLACEHOLDER_IMAGE_URL = "https://placehold.co/100x100/EEE/333?text=S/I"
+
+def get_wix_headers():
+    """Arma los headers de la API de Wix desde st.secrets (None si no hay credenciales)."""
+    if 'wix_api' not in st.secrets:
+        return None
+    return {
+        'Authorization': st.secrets["wix_api"]["api_key"],
+        'wix-site-id': st.secrets["wix_api"]["site_id"],
         'Content-Type': 'application/json'
     }
-    
-    products = []
-    offset = 0
-    limit = 100
-    total_leidos = 0
-    
-    progress_text = "Conectando con Wix..."
-    my_bar = st.progress(0, text=progress_text)
 
-    try:
-        while True:
-            payload = {
-                "includeHiddenProducts": True, 
-                "query": {
-                    "paging": {
-                        "limit": limit,
-                        "offset": offset
-                    }
-                }
+def fetch_wix_page(headers, offset, limit=WIX_PAGE_LIMIT, retries=WIX_PAGE_RETRIES, query_filter=None):
+    """Descarga una página del catálogo de Wix, reintentando si falla."""
+    payload = {
+        "includeHiddenProducts": True,
+        "query": {
+            "paging": {
+                "limit": limit,
+                "offset": offset
             }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=20)
-            
-            if response.status_code != 200:
-                st.error(f"Error comunicando con Wix: {response.status_code} - {response.text}")
-                break
-                
-            data = response.json()
-            items = data.get('products', [])
-            total_results = data.get('totalResults', 0)
-            
+        }
+    }
+    if query_filter:
+        # Wix espera el filtro y el orden como strings JSON
+        payload["query"]["filter"] = json.dumps(query_filter)
+        payload["query"]["sort"] = json.dumps([{"lastUpdated": "asc"}])
+    with perf_span('wix.pagina') as span:
+        try:
+            # La consulta es un POST pero solo lee: se puede reintentar
+            response = http_client.post(WIX_PRODUCTS_URL, headers=headers, json=payload, retries=retries,
+                                        idempotent=True, timeout=(HTTP_CONNECT_TIMEOUT, WIX_PAGE_TIMEOUT))
+        except requests.RequestException as e:
+            raise RuntimeError(f"Error comunicando con Wix (offset {offset}): {e}")
+        span.add(bytes=len(response.content), peticiones=1)
+        if response.status_code != 200:
+            raise RuntimeError(f"Error comunicando con Wix (offset {offset}): {response.status_code} - {response.text}")
+        return response.json()
+
+def process_wix_product(p):
+    """Normaliza un producto crudo de Wix al formato del catálogo."""
+    sku = p.get('sku', '')
+    name = p.get('name', 'Sin Nombre')
+
+    # Obtener precio estándar
+    price = p.get('price', {}).get('price', 0)
+
+    # Inventario
+    stock_info = p.get('stock', {})
+    inventory = stock_info.get('quantity', 0)
+    # Si es un producto "In Stock" pero sin tracking numérico, asumimos stock alto
+    if inventory is None and stock_info.get('inStock', False):
+        inventory = 999
+
+    # Imagen
+    image_url = PLACEHOLDER_IMAGE_URL
+    media = p.get('media', {})
+    if media and media.get('mainMedia'):
+        full_url = media['mainMedia'].get('image', {}).get('url', '')
+        if full_url:
+            image_url = full_url
+
+    return {
+        'sku': str(sku),
+        'nombre': name,
+        'precio_iva_incluido': float(price),
+        'imagen_url': image_url,
+        'inventory': int(inventory or 0),
+        'wix_id': p.get('id', ''),
+        'last_updated': p.get('lastUpdated', '')
+    }
+
+CATALOG_STRING_COLUMNS = ['sku', 'nombre', 'imagen_url', 'wix_id', 'last_updated']
+CATALOG_STRING_DTYPE = pd.StringDtype('pyarrow')
+
+def compact_catalog(df):
+    """Catálogo con tipos compactos: textos en Arrow, inventario int32 y precios en centavos (int64).
+
+    Recibe filas de `process_wix_product` (precio en pesos, `precio_iva_incluido`)
+    o un catálogo ya compacto, y devuelve un DataFrame nuevo con índice 0..n-1.
+    """
+    df = df.reset_index(drop=True)
+    if 'precio_centavos' in df.columns:
+        prices = df['precio_centavos'].fillna(0).astype('int64')
+    else:
+        prices = (df['precio_iva_incluido'].fillna(0).astype(float) * 100).round().astype('int64')
+    compact = {}
+    for column in CATALOG_STRING_COLUMNS:
+        values = df[column]
+        if values.dtype != CATALOG_STRING_DTYPE:
+            values = values.fillna('').astype(str).astype(CATALOG_STRING_DTYPE)
+        compact[column] = values
+    compact['precio_centavos'] = prices
+    compact['inventory'] = df['inventory'].fillna(0).astype('int32')
+    return pd.DataFrame(compact)[['sku', 'nombre', 'precio_centavos', 'imagen_url', 'inventory', 'wix_id', 'last_updated']]
+
+def catalog_price(row):
+    """Precio con IVA en pesos de una fila del catálogo compacto."""
+    return int(row['precio_centavos']) / 100
+
+def catalog_display(df):
+    """Filas del catálogo para mostrar en pantalla, con el precio en pesos."""
+    return df.assign(precio_iva_incluido=df['precio_centavos'] / 100).drop(columns=['precio_centavos'])
+
+def download_wix_catalog(headers, max_workers=WIX_MAX_WORKERS, on_progress=None):
+    """Descarga y normaliza TODO el catálogo de Wix.
+
+    La primera página se pide sola para conocer `totalResults`; el resto de
+    offsets se descargan en paralelo y se reensamblan en orden. Si una página
+    falla (ya con reintentos) o llegan menos productos que `totalResults`,
+    lanza RuntimeError: nunca devuelve un catálogo incompleto. No usa
+    Streamlit directamente, así que también sirve para refrescos en segundo plano.
+    """
+    limit = WIX_PAGE_LIMIT
+    pages = {}
+
+    data = fetch_wix_page(headers, 0, limit)
+    items = data.get('products', [])
+    total_results = data.get('totalResults', 0)
+    pages[0] = items
+    total_leidos = len(items)
+
+    if on_progress and total_results > 0:
+        on_progress(total_leidos, total_results)
+
+    if len(items) == limit and total_results > limit:
+        # Resto de páginas en paralelo, con reintento individual por página
+        offsets = range(limit, total_results, limit)
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            fetch_page = perf_recorder.bind(fetch_wix_page)
+            futures = {executor.submit(fetch_page, headers, offset, limit): offset for offset in offsets}
+            for future in as_completed(futures):
+                offset = futures[future]
+                try:
+                    pages[offset] = future.result().get('products', [])
+                except RuntimeError:
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                total_leidos += len(pages[offset])
+                if on_progress:
+                    on_progress(total_leidos, total_results)
+    elif len(items) == limit:
+        # Wix no informó el total: se recorre secuencialmente como antes
+        offset = limit
+        while True:
+            items = fetch_wix_page(headers, offset, limit).get('products', [])
             if not items:
                 break
-                
-            for p in items:
-                sku = p.get('sku', '')
-                name = p.get('name', 'Sin Nombre')
-                
-                # Obtener precio estándar
-                price = p.get('price', {}).get('price', 0)
-                
-                # Inventario
-                stock_info = p.get('stock', {})
-                inventory = stock_info.get('quantity', 0)
-                # Si es un producto "In Stock" pero sin tracking numérico, asumimos stock alto
-                if inventory is None and stock_info.get('inStock', False):
-                    inventory = 999 
-                
-                # Imagen
-                image_url = "https://placehold.co/100x100/EEE/333?text=S/I"
-                media = p.get('media', {})
-                if media and media.get('mainMedia'):
-                    full_url = media['mainMedia'].get('image', {}).get('url', '')
-                    if full_url:
-                        image_url = full_url
-
-                products.append({
-                    'sku': str(sku),
-                    'nombre': name,
-                    'precio_iva_incluido': float(price),
-                    'imagen_url': image_url,
-                    'inventory': int(inventory or 0)
-                })
-
+            pages[offset] = items
             total_leidos += len(items)
-            
-            if total_results > 0:
-                percent = min(total_leidos / total_results, 1.0)
-                my_bar.progress(percent, text=f"Descargando productos: {total_leidos} de {total_results}")
-
+            if on_progress:
+                on_progress(total_leidos, 0)
             if len(items) < limit:
-                break 
-            
+                break
             offset += limit
-            
-        my_bar.empty()
-        
+
+    if total_leidos < total_results:
+        raise RuntimeError(f"Wix informó {total_results} productos pero se descargaron {total_leidos}")
+
+    with perf_span('wix.procesar') as span:
+        products = [process_wix_product(p) for offset in sorted(pages) for p in pages[offset]]
+        span.add(productos=len(products))
         if not products:
             return None
 
         df = pd.DataFrame(products)
         df.dropna(subset=['sku', 'nombre'], inplace=True)
+        df = compact_catalog(df)
+    return df
+
+def fetch_and_process_wix_data():
+    """Descarga TODOS los productos de Wix (paginados) usando Secrets.
+
+    Sin caché propia: el resultado se publica en el catálogo compartido del proceso.
+    """
+
+    # Verificar si existen los secrets
+    headers = get_wix_headers()
+    if headers is None:
+        st.error("❌ No se encontraron las credenciales de Wix en st.secrets.")
+        return None
+
+    max_workers = int(st.secrets["wix_api"].get("concurrency", WIX_MAX_WORKERS))
+
+    progress_text = "Conectando con Wix..."
+    my_bar = st.progress(0, text=progress_text)
+
+    def on_progress(total_leidos, total_results):
+        if total_results > 0:
+            percent = min(total_leidos / total_results, 1.0)
+            my_bar.progress(percent, text=f"Descargando productos: {total_leidos} de {total_results}")
+        else:
+            my_bar.progress(0, text=f"Descargando productos: {total_leidos}")
+
+    try:
+        df = download_wix_catalog(headers, max_workers, on_progress=on_progress)
+        my_bar.empty()
+        if df is not None:
+            duplicates, blank_count = find_sku_issues(df)
+            if duplicates or blank_count:
+                st.warning(f"⚠️ Catálogo de Wix con {len(duplicates)} SKU duplicados y {blank_count} productos sin SKU.")
+            save_catalog_snapshot(df)
         return df
 
     except Exception as e:
@@ -154,268 +498,1262 @@ def fetch_and_process_wix_data():
         my_bar.empty()
         return None
 
-# --- FUNCIONES AUXILIARES ---
-def format_currency(value):
+def fetch_wix_changes(headers, since):
+    """Descarga solo los productos modificados en Wix después de `since` (ISO 8601)."""
+    query_filter = {"lastUpdated": {"$gt": since}}
+    changed = []
+    offset = 0
+    while True:
+        items = fetch_wix_page(headers, offset, query_filter=query_filter).get('products', [])
+        changed.extend(items)
+        if len(items) < WIX_PAGE_LIMIT:
+            break
+        offset += WIX_PAGE_LIMIT
+    return changed
+
+def get_catalog_high_water_mark(df):
+    """Fecha `lastUpdated` más reciente del catálogo, usada como marca de sincronización."""
+    if df is None or df.empty or 'last_updated' not in df.columns:
+        return None
+    hwm = df['last_updated'].max()
+    return hwm or None
+
+def merge_catalog_changes(df, changed_products):
+    """Aplica los productos modificados sobre el catálogo existente, por producto de Wix (`wix_id`).
+
+    No se empareja por `sku`: Wix admite SKU repetidos y cada producto es una
+    fila, así el catálogo fusionado sigue cuadrando con `totalResults`.
+    """
+    if not changed_products:
+        return df
+    updates = compact_catalog(pd.DataFrame([process_wix_product(p) for p in changed_products]))
+    updates = updates.drop_duplicates(subset=['wix_id'], keep='last')
+    stale = df['wix_id'].isin(updates['wix_id'])
+    return pd.concat([df[~stale], updates], ignore_index=True)
+
+def sync_wix_catalog(headers, df):
+    """Sincronización incremental del catálogo contra Wix.
+
+    Trae solo los productos cambiados desde la marca de agua y los fusiona.
+    Como Wix no informa eliminaciones, se compara el `totalResults` (consulta
+    de un solo producto) con el tamaño del catálogo fusionado: si no cuadra o
+    Wix no lo informa, devuelve None para que se haga una descarga completa.
+    """
+    since = get_catalog_high_water_mark(df)
+    if since is None:
+        return None
+
+    merged = merge_catalog_changes(df, fetch_wix_changes(headers, since))
+    total_results = fetch_wix_page(headers, 0, limit=1).get('totalResults')
+    if total_results != len(merged):
+        return None
+    return merged
+
+# --- SNAPSHOT LOCAL DEL CATÁLOGO ---
+CACHE_DIR = ".cache"
+CATALOG_SNAPSHOT_PATH = os.path.join(CACHE_DIR, "catalogo_wix.arrow")
+CATALOG_SCHEMA_VERSION = "2"  # 2: catálogo compacto (precios en centavos, inventario int32)
+
+def save_catalog_snapshot(df, path=CATALOG_SNAPSHOT_PATH):
+    """Guarda el catálogo normalizado en disco (Arrow IPC) con versión de esquema y fecha de descarga.
+
+    Devuelve la fecha de descarga registrada, o None si no se pudo escribir.
+    """
+    fetched_at = time.time()
+    metadata = {
+        'schema_version': CATALOG_SCHEMA_VERSION,
+        'fetched_at': repr(fetched_at),
+        'high_water_mark': get_catalog_high_water_mark(df) or '',
+    }
     try:
-        v = float(value)
-    except (TypeError, ValueError):
-        return "$0"
-    return f"${v:,.0f}".replace(",", ".")
+        table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Se escribe a un temporal y se reemplaza, para que nadie lea un archivo a medias
+        tmp_path = f"{path}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        return fetched_at
+    except (OSError, pa.ArrowException) as e:
+        logger.warning("No se pudo guardar el snapshot del catálogo: %s", e)
+        return None
+
+def _read_catalog_snapshot_schema(source):
+    metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if metadata.get(b'schema_version', b'').decode() != CATALOG_SCHEMA_VERSION:
+        return None
+    return float(metadata[b'fetched_at'])
+
+def get_catalog_snapshot_fetched_at(path=CATALOG_SNAPSHOT_PATH):
+    """Fecha de descarga del snapshot en disco leyendo solo su esquema (None si no hay uno válido)."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with pa.memory_map(path, 'r') as source:
+            return _read_catalog_snapshot_schema(source)
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return None
+
+def load_catalog_snapshot(path=CATALOG_SNAPSHOT_PATH):
+    """Carga el snapshot del catálogo mapeándolo en memoria. Devuelve (df, fetched_at) o (None, None)."""
+    if not os.path.exists(path):
+        return None, None
+    try:
+        with pa.memory_map(path, 'r') as source:
+            fetched_at = _read_catalog_snapshot_schema(source)
+            if fetched_at is None:
+                return None, None
+            table = pa.ipc.open_file(source).read_all()
+            df = compact_catalog(table.to_pandas(types_mapper={pa.string(): CATALOG_STRING_DTYPE}.get))
+        return df, fetched_at
+    except (OSError, KeyError, ValueError, pa.ArrowException) as e:
+        logger.warning("Snapshot del catálogo ilegible, se ignora: %s", e)
+        return None, None
+
+@st.cache_resource
+def get_catalog_refresh_state():
+    """Estado compartido por todas las sesiones del refresco en segundo plano."""
+    return {'lock': threading.Lock(), 'thread': None}
+
+def _refresh_catalog_snapshot(headers, max_workers):
+    # Una descarga incompleta lanza error: el snapshot anterior queda intacto
+    try:
+        df = download_wix_catalog(headers, max_workers)
+        if df is not None:
+            save_catalog_snapshot(df)
+    except Exception as e:
+        logger.warning("Falló el refresco del catálogo en segundo plano, se mantiene el snapshot anterior: %s", e)
+
+def _sync_catalog(store, catalog, headers, max_workers):
+    try:
+        df_sync = sync_wix_catalog(headers, catalog.df)
+    except Exception as e:
+        logger.warning("No se pudo sincronizar el catálogo, se mantiene la versión cargada: %s", e)
+        return
+    if df_sync is None:
+        # Hubo eliminaciones o no hay marca de sincronización: descarga completa,
+        # que las sesiones toman del snapshot en su próximo rerun
+        _refresh_catalog_snapshot(headers, max_workers)
+    elif df_sync is not catalog.df:
+        synced_at = save_catalog_snapshot(df_sync) or time.time()
+        with store.lock:
+            # Si mientras tanto se publicó otra versión (p. ej. una actualización forzada), gana esa
+            if store.current() is catalog:
+                store.publish(df_sync, synced_at)
+
+def _start_catalog_job(target, *args):
+    """Corre `target` en un hilo aparte; un solo trabajo de catálogo a la vez por proceso."""
+    headers = get_wix_headers()
+    if headers is None:
+        return
+    max_workers = int(st.secrets["wix_api"].get("concurrency", WIX_MAX_WORKERS))
+    state = get_catalog_refresh_state()
+    with state['lock']:
+        if state['thread'] is not None and state['thread'].is_alive():
+            return
+        state['thread'] = threading.Thread(target=target, args=(*args, headers, max_workers), daemon=True)
+        state['thread'].start()
+
+def sync_catalog_in_background(store, catalog):
+    """Lanza la sincronización incremental de `catalog` en un hilo aparte; el resultado se publica en `store`."""
+    _start_catalog_job(_sync_catalog, store, catalog)
+
+# --- ÍNDICE DE SKU ---
+def find_sku_issues(df):
+    """Devuelve (SKU duplicados, cantidad de productos sin SKU) del catálogo."""
+    skus = df['sku'].astype(str).str.strip()
+    blank = skus == ''
+    valid = skus[~blank]
+    duplicates = sorted(valid[valid.duplicated(keep=False)].unique())
+    return duplicates, int(blank.sum())
+
+class SkuIndex:
+    """Índice hash SKU -> fila del catálogo, construido una vez por versión del catálogo.
+
+    Si un SKU está duplicado en Wix gana la primera fila (como el filtro
+    anterior), pero queda reportado en `duplicates`.
+    """
+    def __init__(self, df):
+        self.df = df
+        skus = df['sku'].astype(str).str.strip().to_numpy()
+        self._positions = {}
+        for position, sku in enumerate(skus):
+            if sku:
+                self._positions.setdefault(sku, position)
+        self.duplicates, self.blank_count = find_sku_issues(df)
+        self._duplicates = set(self.duplicates)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, sku):
+        return str(sku).strip() in self._positions
+
+    def is_duplicate(self, sku):
+        return str(sku).strip() in self._duplicates
+
+    def position(self, sku):
+        """Posición en el catálogo de un SKU exacto, o None si no existe."""
+        return self._positions.get(str(sku).strip())
+
+    def lookup(self, sku):
+        """Fila del catálogo para un SKU exacto, o None si no existe."""
+        position = self.position(sku)
+        return None if position is None else self.df.iloc[position]
+
+    def lookup_many(self, skus):
+        """Busca varios SKU a la vez.
+
+        Devuelve (DataFrame con una fila por SKU encontrado, sin repetir y en el
+        orden pedido, indexado por su posición en el catálogo; lista de los SKU
+        no encontrados, uno por cada vez que se pidieron).
+        """
+        positions, seen, missing = [], set(), []
+        for sku in skus:
+            key = str(sku).strip()
+            position = self._positions.get(key) if key else None
+            if position is None:
+                missing.append(sku)
+            elif position not in seen:
+                seen.add(position)
+                positions.append(position)
+        return self.df.iloc[positions], missing
+
+# --- BÚSQUEDA DE PRODUCTOS ---
+SEARCH_RESULTS_LIMIT = 10
+
+def normalize_text(text):
+    """Minúsculas y sin tildes, para comparar nombres en español."""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', normalize_text(text))
+
+class ProductSearchIndex:
+    """Índice invertido sobre `nombre` y `sku`, construido una vez por versión del catálogo.
+
+    Cada palabra de la búsqueda debe coincidir completa o como prefijo de
+    alguna palabra del nombre o del SKU. Los resultados se ordenan por
+    relevancia: SKU exacto, luego coincidencias completas sobre prefijos,
+    luego nombres más cortos.
+    """
+    def __init__(self, df):
+        self.df = df
+        self._postings = defaultdict(set)
+        self._skus = [normalize_text(sku).strip() for sku in df['sku'].astype(str)]
+        self._name_lengths = [len(str(name)) for name in df['nombre']]
+        for position, (name, sku) in enumerate(zip(df['nombre'], self._skus)):
+            for token in tokenize(name):
+                self._postings[token].add(position)
+            for token in tokenize(sku):
+                self._postings[token].add(position)
+        # Lista ordenada de palabras: los prefijos se resuelven con búsqueda binaria
+        self._tokens = sorted(self._postings)
+
+    def _prefix_tokens(self, prefix):
+        start = bisect.bisect_left(self._tokens, prefix)
+        end = bisect.bisect_left(self._tokens, prefix + '\uffff')
+        return self._tokens[start:end]
+
+    def search_positions(self, query, limit=SEARCH_RESULTS_LIMIT):
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return []
+        scores = None
+        for token in query_tokens:
+            token_scores = {}
+            for match in self._prefix_tokens(token):
+                weight = 2 if match == token else 1
+                for position in self._postings[match]:
+                    if token_scores.get(position, 0) < weight:
+                        token_scores[position] = weight
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {position: score + token_scores[position] for position, score in scores.items() if position in token_scores}
+            if not scores:
+                return []
+
+        query_sku = normalize_text(query).strip()
+        for position in scores:
+            sku = self._skus[position]
+            if sku == query_sku:
+                scores[position] += 10
+            elif sku.startswith(query_sku):
+                scores[position] += 5
+        return heapq.nsmallest(limit, scores, key=lambda position: (-scores[position], self._name_lengths[position], position))
+
+    def search(self, query, limit=SEARCH_RESULTS_LIMIT):
+        """Productos que coinciden con la búsqueda, ordenados por relevancia."""
+        return self.df.iloc[self.search_positions(query, limit)]
+
+# Palabras que no distinguen productos en las descripciones de los clientes
+NAME_MATCH_STOPWORDS = frozenset(
+    "a al c cm con de del e el en g kg la las los m mm o para por u un una und unid unidad unidades x y".split()
+)
+NAME_MATCH_COMMON_RATIO = 0.05  # Palabras en más de este % del catálogo no generan candidatos
+NAME_MATCH_CANDIDATES = 20
+NAME_MATCH_CONTAINED_WEIGHT = 0.85
+
+def name_stem(token):
+    """Raíz simple para comparar singular y plural ("bloques" ~ "bloque", "lápices" ~ "lápiz")."""
+    if len(token) > 4 and token.endswith('es') and token[-3] in 'lrndzcjy':
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith('s'):
+        token = token[:-1]
+    return token[:-1] + 'c' if token.endswith('z') else token
+
+def name_stems(text):
+    return {name_stem(token) for token in tokenize(text) if token not in NAME_MATCH_STOPWORDS}
+
+def request_line_title(text):
+    """Nombre del producto dentro de una descripción larga: lo que va antes de ':' o del salto de línea."""
+    return re.split(r'[\n:]', str(text).strip(), maxsplit=1)[0]
+
+class ProductNameMatcher:
+    """Empareja descripciones libres (solicitudes de clientes) con nombres del catálogo.
+
+    Índice invertido de raíces de palabras con peso IDF. Solo las palabras
+    poco comunes (y no los números) generan candidatos; a los mejores se les
+    calcula el puntaje completo: el mayor entre el Dice ponderado contra el
+    título de la línea y la fracción del nombre del producto contenida en la
+    descripción. Coincidir solo en números no cuenta.
+    """
+    def __init__(self, df):
+        self.df = df
+        self._stems = [name_stems(name) for name in df['nombre']]
+        self._postings = defaultdict(list)
+        for position, stems in enumerate(self._stems):
+            for stem in stems:
+                self._postings[stem].append(position)
+        total = max(len(self._stems), 1)
+        self._idf = {stem: math.log(1 + total / len(positions)) for stem, positions in self._postings.items()}
+        self._unknown_idf = math.log(1 + total)
+        self._common = max(1, int(total * NAME_MATCH_COMMON_RATIO))
+        self._weights = [sum(self._idf[stem] for stem in stems) for stems in self._stems]
+
+    def _weight(self, stems):
+        return sum(self._idf.get(stem, self._unknown_idf) for stem in stems)
+
+    def match(self, text, limit=3):
+        """[(puntaje 0-1, posición)] de los mejores productos para `text`, de mayor a menor."""
+        title_stems = name_stems(request_line_title(text))
+        text_stems = name_stems(text) | title_stems
+        partial = defaultdict(float)
+        for stem in text_stems:
+            positions = self._postings.get(stem)
+            if positions is None or len(positions) > self._common or stem.isdigit():
+                continue
+            weight = self._idf[stem]
+            for position in positions:
+                partial[position] += weight
+        if not partial:
+            # Solo palabras comunes: se buscan candidatos con las del título
+            for stem in title_stems:
+                for position in self._postings.get(stem, ()):
+                    partial[position] += self._idf[stem]
+
+        title_weight = self._weight(title_stems)
+        scored = []
+        for position in heapq.nlargest(NAME_MATCH_CANDIDATES, partial, key=partial.get):
+            stems, name_weight = self._stems[position], self._weights[position]
+            if not name_weight or all(stem.isdigit() for stem in text_stems & stems):
+                continue
+            dice = 2 * self._weight(title_stems & stems) / (title_weight + name_weight)
+            contained = self._weight(text_stems & stems) / name_weight
+            scored.append((max(dice, NAME_MATCH_CONTAINED_WEIGHT * contained), position))
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored[:limit]
+
+# --- CATÁLOGO COMPARTIDO ---
+# Un solo catálogo de solo lectura por proceso, con sus índices, para todas las
+# sesiones; cada sesión guarda únicamente la versión que vio (`catalog_version`).
+class SharedCatalog:
+    """Una versión del catálogo: datos compactos (no se deben modificar) e índices."""
+    def __init__(self, df, synced_at, version):
+        self.df = df
+        self.synced_at = synced_at
+        self.version = version
+        self.sku_index = SkuIndex(df)
+        self.search_index = ProductSearchIndex(df)
+        self._lock = threading.Lock()
+        self._name_matcher = None
+
+    @property
+    def name_matcher(self):
+        """Índice para emparejar por nombre; se construye la primera vez que se importa una solicitud."""
+        with self._lock:
+            if self._name_matcher is None:
+                self._name_matcher = ProductNameMatcher(self.df)
+            return self._name_matcher
+
+class CatalogStore:
+    """Versión vigente del catálogo del proceso.
+
+    `lock` serializa la primera carga y las publicaciones: mientras una sesión
+    hace la primera descarga, las demás esperan y usan ese resultado en vez
+    de repetirla. Ya cargado, nadie espera a Wix con el lock tomado.
+    Las versiones anteriores se liberan cuando ningún rerun las usa.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._current = None
+        self._version = 0
+
+    def current(self):
+        return self._current
+
+    def publish(self, df, synced_at):
+        catalog = SharedCatalog(df, synced_at, self._version + 1)
+        self._version = catalog.version
+        self._current = catalog
+        return catalog
+
+    def mark_synced(self, synced_at):
+        if self._current is not None:
+            self._current.synced_at = synced_at
 
+@st.cache_resource
+def get_catalog_store():
+    """Catálogo compartido por todas las sesiones del proceso."""
+    return CatalogStore()
+
+def load_shared_catalog(force_refresh=False):
+    """Catálogo vigente, cargándolo o poniéndolo al día si hace falta.
+
+    Primero el snapshot local (milisegundos) y solo si no hay uno, la descarga
+    completa desde Wix. Ya cargado, se sirve de inmediato: toma el snapshot más
+    nuevo que haya dejado otro proceso o el refresco en segundo plano, y cada
+    `CATALOG_DELTA_INTERVAL` lanza en un hilo aparte la sincronización con Wix.
+    `force_refresh` descarga todo de nuevo; si falla, sigue la versión vigente.
+    """
+    store = get_catalog_store()
+    catalog = store.current()
+    if catalog is not None:
+        if force_refresh:
+            return _force_refresh_shared_catalog(store, catalog)
+        return _refresh_shared_catalog(store, catalog)
+
+    with store.lock:
+        catalog = store.current()
+        if catalog is not None:
+            return catalog  # Otra sesión lo cargó mientras se esperaba el lock
+        snapshot_df, fetched_at = load_catalog_snapshot()
+        if snapshot_df is not None and not force_refresh:
+            return store.publish(snapshot_df, fetched_at)
+        df_wix = fetch_and_process_wix_data()
+        if df_wix is not None:
+            return store.publish(df_wix, time.time())
+        if snapshot_df is not None:
+            st.warning("⚠️ Se usa el último catálogo guardado mientras Wix no responda.")
+            return store.publish(snapshot_df, fetched_at)
+        return None
+
+def _force_refresh_shared_catalog(store, catalog):
+    # La descarga va fuera del lock: las demás sesiones siguen con la versión vigente
+    df_wix = fetch_and_process_wix_data()
+    if df_wix is None:
+        return catalog  # `fetch_and_process_wix_data` ya mostró el error
+    with store.lock:
+        return store.publish(df_wix, time.time())
+
+def _refresh_shared_catalog(store, catalog):
+    fetched_at = get_catalog_snapshot_fetched_at()
+    if fetched_at and fetched_at > catalog.synced_at:
+        with store.lock:
+            current = store.current()
+            if current is not None:
+                catalog = current
+            if fetched_at > catalog.synced_at:
+                snapshot_df, fetched_at = load_catalog_snapshot()
+                if snapshot_df is not None:
+                    catalog = store.publish(snapshot_df, fetched_at)
+
+    # Sincronización incremental en segundo plano: solo trae los productos cambiados en Wix
+    if time.time() - catalog.synced_at > CATALOG_DELTA_INTERVAL:
+        store.mark_synced(time.time())
+        sync_catalog_in_background(store, catalog)
+    return catalog
+
+# --- IMPORTACIÓN DE SOLICITUDES ---
+# Las solicitudes de los clientes (Excel o CSV, ver ejemplo_solicitudes/) se
+# leen como una grilla, se detectan las columnas y cada línea se empareja con
+# el catálogo: primero por SKU y si no, por nombre. Lo dudoso va a revisión.
+REQUEST_HEADER_SCAN_ROWS = 10
+REQUEST_COLUMN_KEYWORDS = {
+    'descripcion': ('descripcion', 'producto', 'nombre', 'articulo', 'elemento', 'detalle', 'item'),
+    'sku': ('sku', 'codigo', 'referencia', 'ref', 'cod'),
+    'cantidad': ('cantidad', 'cant', 'unidades solicitadas', 'qty'),
+}
+MATCH_AUTO_SCORE = 0.7    # Desde este puntaje (y con margen sobre el segundo) se acepta sin revisar
+MATCH_AUTO_MARGIN = 0.1
+MATCH_MIN_SCORE = 0.4     # Por debajo, la línea queda sin producto sugerido
+MATCH_STATUS_LABELS = {
+    'sku': "✅ SKU", 'nombre': "✅ Nombre", 'revisar': "⚠️ Revisar", 'sin_coincidencia': "❌ Sin coincidencia",
+}
+
+def read_request_grid(content, file_name):
+    """Grilla de la solicitud (DataFrame sin encabezados, todo como texto u objeto) desde xlsx o csv."""
+    if file_name.lower().endswith('.csv'):
+        for encoding in ('utf-8-sig', 'latin-1'):
+            try:
+                grid = pd.read_csv(BytesIO(content), header=None, dtype=object, sep=None, engine='python', encoding=encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+    else:
+        grid = pd.read_excel(BytesIO(content), header=None, dtype=object)
+    # Se conservan los números de fila y columna de la hoja para mostrárselos al usuario
+    return grid.dropna(how='all').dropna(axis=1, how='all')
+
+def column_letter(column):
+    """Letra de la columna como en Excel (0 -> A, 26 -> AA)."""
+    letters = ''
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _is_header_cell(value, field):
+    text = normalize_text(value).strip() if isinstance(value, str) else ''
+    return any(text.startswith(keyword) for keyword in REQUEST_COLUMN_KEYWORDS[field])
+
+def _parse_quantity(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (int, float)):
+        return int(value) if value > 0 else None
+    return parse_int_from_text(str(value).split()[0] if str(value).split() else '') or None
+
+def detect_request_columns(grid, sku_index=None):
+    """Detecta la fila de encabezados y las columnas. Devuelve (fila de encabezados o None, {campo: columna o None}).
+
+    Con encabezados se usan sus nombres; sin ellos, la descripción es la
+    columna de textos más largos, la cantidad la de números positivos y el
+    SKU la que más valores tiene en el catálogo.
+    """
+    columns = {'descripcion': None, 'sku': None, 'cantidad': None}
+    header_row = None
+    for row in grid.index[:REQUEST_HEADER_SCAN_ROWS]:
+        found = {field: column for field in columns for column, value in grid.loc[row].items() if _is_header_cell(value, field)}
+        if 'descripcion' in found or len(found) >= 2:
+            header_row = row
+            columns.update(found)
+            break
+
+    body = grid.loc[grid.index > header_row] if header_row is not None else grid
+    free = [column for column in grid.columns if column not in columns.values()]
+    if columns['descripcion'] is None and free:
+        lengths = {column: body[column].map(lambda v: len(v) if isinstance(v, str) else 0).mean() for column in free}
+        columns['descripcion'] = max(lengths, key=lengths.get)
+        free.remove(columns['descripcion'])
+    if columns['cantidad'] is None and free:
+        # En un CSV todo llega como texto: se convierte antes de contar los números
+        counts = {column: int((pd.to_numeric(body[column], errors='coerce') > 0).sum()) for column in free}
+        best = max(counts, key=counts.get)
+        if counts[best] >= len(body) / 2:
+            columns['cantidad'] = best
+            free.remove(best)
+    if columns['sku'] is None and free and sku_index is not None:
+        hits = {}
+        for column in free:
+            values = [v for v in body[column] if isinstance(v, (str, int))]
+            _, missing = sku_index.lookup_many(values)
+            hits[column] = len(values) - len(missing)
+        best = max(hits, key=hits.get)
+        if hits[best]:
+            columns['sku'] = best
+    return header_row, columns
+
+def build_request_lines(grid, header_row, columns):
+    """Líneas de la solicitud: DataFrame con fila (de la hoja, desde 1), descripcion, sku y cantidad (1 si no viene)."""
+    body = grid.loc[grid.index > header_row] if header_row is not None else grid
+    lines = []
+    for row, values in body.iterrows():
+        description = values[columns['descripcion']] if columns['descripcion'] is not None else None
+        description = str(description).strip() if isinstance(description, (str, int, float)) and pd.notna(description) else ''
+        sku = values[columns['sku']] if columns['sku'] is not None else None
+        sku = str(sku).strip() if sku is not None and pd.notna(sku) else ''
+        if sku.upper() in ('N/A', 'NA', '-'):
+            sku = ''
+        if not description and not sku:
+            continue
+        quantity = _parse_quantity(values[columns['cantidad']]) if columns['cantidad'] is not None else None
+        lines.append({'fila': row + 1, 'descripcion': description, 'sku': sku, 'cantidad': quantity or 1})
+    return pd.DataFrame(lines, columns=['fila', 'descripcion', 'sku', 'cantidad'])
+
+def match_request_lines(lines, catalog):
+    """Empareja cada línea con el catálogo compartido.
+
+    Agrega a `lines` las columnas estado (ver `MATCH_STATUS_LABELS`), posicion
+    (fila del catálogo o -1), puntaje y candidatos ([posiciones], mejor primero).
+    """
+    statuses, positions, scores, candidates = [], [], [], []
+    with perf_span('importacion.emparejar') as span:
+        span.add(lineas=len(lines))
+        # Todos los SKU de la solicitud de una vez; el índice del catálogo compacto es la posición
+        found, _ = catalog.sku_index.lookup_many(lines['sku'])
+        sku_positions = dict(zip(found['sku'].str.strip(), found.index))
+        for sku, description in zip(lines['sku'], lines['descripcion']):
+            position = sku_positions.get(sku) if sku else None
+            if position is not None:
+                statuses.append('sku'); positions.append(position); scores.append(1.0); candidates.append([position])
+                continue
+            matches = catalog.name_matcher.match(description) if description else []
+            matches = [(score, position) for score, position in matches if score >= MATCH_MIN_SCORE]
+            if not matches:
+                statuses.append('sin_coincidencia'); positions.append(-1); scores.append(0.0); candidates.append([])
+                continue
+            best_score, best_position = matches[0]
+            runner_up = matches[1][0] if len(matches) > 1 else 0
+            confident = best_score >= MATCH_AUTO_SCORE and best_score - runner_up >= MATCH_AUTO_MARGIN
+            statuses.append('nombre' if confident else 'revisar')
+            positions.append(best_position)
+            scores.append(round(best_score, 2))
+            candidates.append([position for _, position in matches])
+    return lines.assign(estado=statuses, posicion=positions, puntaje=scores, candidatos=candidates)
+
+def add_catalog_product(quote_items, product, quantity):
+    """Añade `quantity` unidades de una fila del catálogo a la cotización (suma si el SKU ya está)."""
+    sku = product['sku']
+    if sku in quote_items:
+        quote_items[sku]['cantidad'] += quantity
+    else:
+        quote_items[sku] = {
+            'imagen_url': product['imagen_url'],
+            'nombre': product['nombre'],
+            'sku': sku,
+            'cantidad': quantity,
+            'precio_unitario': catalog_price(product)
+        }
+    item = quote_items[sku]
+    item['valor_total'] = item['precio_unitario'] * item['cantidad']
+    return item
+
+# --- FUNCIONES AUXILIARES ---
 def parse_int_from_text(txt: str) -> int:
     if txt is None:
         return 0
     s = ''.join(ch for ch in str(txt) if ch.isdigit())
     return int(s) if s else 0
 
+def use_search_result():
+    """Pasa el producto elegido en el buscador al campo de SKU."""
+    if st.session_state.get('search_pick'):
+        st.session_state.sku_input = st.session_state.search_pick
+
 def remove_item(sku):
     if sku in st.session_state.quote_items:
         del st.session_state.quote_items[sku]
 
-# --- CLASE PDF PERSONALIZADA ---
-class PDF(FPDF):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.color_primary = (4, 76, 125)
-        self.color_secondary = (240, 240, 240)
-        self.color_text = (50, 50, 50)
-        self.color_border = (220, 220, 220)
-        self.table_col_widths = None
-        self.is_table_page = False
-        self.current_font_family = 'Arial'
-
-    def header(self):
+# --- CACHÉ DE IMÁGENES ---
+IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, "imagenes")
+IMAGE_MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+IMAGE_DISK_CACHE_BYTES = 512 * 1024 * 1024
+IMAGE_CACHE_TTL = 7 * 24 * 3600  # Segundos; None para no expirar nunca
+IMAGE_DOWNLOAD_TIMEOUT = 5
+IMAGE_DOWNLOAD_RETRIES = 2
+IMAGE_PREFETCH_WORKERS = 8
+THUMBNAIL_DPI = 150
+THUMBNAIL_MAX_PX = round(30 / 25.4 * THUMBNAIL_DPI)  # Columna de imagen del PDF: 30 mm
+THUMBNAIL_JPEG_QUALITY = 80
+WIX_MEDIA_URL_RE = re.compile(r'^(https://static\.wixstatic\.com/media/([^/]+))(/v1/.*)?$')
+
+def is_real_image_url(url):
+    """True si la URL apunta a una imagen real (no al placeholder "S/I")."""
+    return bool(url) and "placehold.co" not in url
+
+def download_image(url):
+    """Descarga una imagen; devuelve los bytes o None si falla."""
+    # Añadimos header para simular navegador si es necesario,
+    # aunque Wix suele servir imágenes estáticas sin problemas
+    headers_img = {'User-Agent': 'Mozilla/5.0'}
+    with perf_span('imagen.descarga') as span:
         try:
-            self.add_font('Lato', '', 'Lato-Regular.ttf', uni=True)
-            self.add_font('Lato', 'B', 'Lato-Bold.ttf', uni=True)
-            self.add_font('Lato', 'I', 'Lato-Italic.ttf', uni=True)
-            self.current_font_family = 'Lato'
-        except RuntimeError:
-            self.current_font_family = 'Arial'
+            response = http_client.get(url, headers=headers_img, retries=IMAGE_DOWNLOAD_RETRIES,
+                                       timeout=(HTTP_CONNECT_TIMEOUT, IMAGE_DOWNLOAD_TIMEOUT))
+        except requests.RequestException:
+            return None
+        span.add(bytes=len(response.content))
+    return response.content if response.status_code == 200 else None
+
+def wix_thumbnail_url(url, max_px=THUMBNAIL_MAX_PX, quality=THUMBNAIL_JPEG_QUALITY):
+    """URL de Wix que entrega la imagen ya reducida (las demás URLs se devuelven igual)."""
+    match = WIX_MEDIA_URL_RE.match(url)
+    if not match:
+        return url
+    # Se conserva la extensión original para no perder la transparencia de los PNG
+    extension = os.path.splitext(match.group(2))[1] or '.jpg'
+    return f"{match.group(1)}/v1/fit/w_{max_px},h_{max_px},q_{quality}/file{extension}"
+
+def make_thumbnail(image_bytes, max_px=THUMBNAIL_MAX_PX, quality=THUMBNAIL_JPEG_QUALITY):
+    """Reduce la imagen a `max_px` de lado mayor.
+
+    Se guarda como JPEG con la calidad indicada, salvo que tenga
+    transparencia real, en cuyo caso queda en PNG. Devuelve None si los
+    bytes no son una imagen.
+    """
+    if not image_bytes:
+        return None
+    try:
+        img = Image.open(BytesIO(image_bytes))
+        if img.format == 'JPEG' and max(img.size) <= max_px:
+            return image_bytes
+        img = ImageOps.exif_transpose(img)
+        if img.mode == 'P' and 'transparency' in img.info:
+            img = img.convert('RGBA')
+        has_alpha = img.mode in ('RGBA', 'LA') and img.getchannel('A').getextrema()[0] < 255
+        img.thumbnail((max_px, max_px), Image.LANCZOS)
+        out = BytesIO()
+        if has_alpha:
+            img.convert('RGBA').save(out, format='PNG', optimize=True)
+        else:
+            img.convert('RGB').save(out, format='JPEG', quality=quality, optimize=True)
+        return out.getvalue()
+    except Exception:
+        return None
 
+class ImageCache:
+    """Caché de imágenes en dos niveles: LRU en memoria y almacén en disco.
+
+    En disco cada URL apunta (por su sha256) a un archivo con el hash del
+    contenido, y los bytes se guardan una sola vez por contenido. Ambos
+    niveles tienen tope de tamaño y desalojan lo menos usado; las entradas
+    más viejas que `ttl` se vuelven a descargar.
+    """
+    def __init__(self, directory=IMAGE_CACHE_DIR, memory_limit=IMAGE_MEMORY_CACHE_BYTES,
+                 disk_limit=IMAGE_DISK_CACHE_BYTES, ttl=IMAGE_CACHE_TTL, fetch=download_image):
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.ttl = ttl
+        self.fetch = fetch
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # url -> (guardado_en, bytes)
+        self._memory_bytes = 0
+        self._urls_dir = os.path.join(directory, "urls")
+        self._blobs_dir = os.path.join(directory, "blobs")
+        os.makedirs(self._urls_dir, exist_ok=True)
+        os.makedirs(self._blobs_dir, exist_ok=True)
+        self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self._blobs_dir))
+
+    def _is_expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _url_path(self, key):
+        return os.path.join(self._urls_dir, hashlib.sha256(key.encode()).hexdigest())
+
+    def _remember(self, key, stored_at, content):
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous:
+                self._memory_bytes -= len(previous[1])
+            if len(content) > self.memory_limit:
+                return
+            self._memory[key] = (stored_at, content)
+            self._memory_bytes += len(content)
+            while self._memory_bytes > self.memory_limit:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key):
+        url_path = self._url_path(key)
         try:
-            self.image("logo_transparente.png", 10, 8, 45)
-        except FileNotFoundError:
-            self.set_font(self.current_font_family, "B", 14)
-            self.set_xy(10, 15)
-            self.cell(0, 10, "JUGANDO Y EDUCANDO")
-
-        self.set_font(self.current_font_family, "B", 9)
-        self.set_text_color(*self.color_text)
-        info_x = 120
-        self.set_xy(info_x, 10)
-        self.cell(0, 5, "DIDACTICOS JUGANDO Y EDUCANDO SAS", 0, 1, 'R')
-        self.set_font(self.current_font_family, "", 9)
-        self.set_x(info_x)
-        self.cell(0, 5, "NIT: 901144615-6", 0, 1, 'R')
-        self.set_x(info_x)
-        self.cell(0, 5, "CEL: 3153357921", 0, 1, 'R')
-        self.set_x(info_x)
-        self.cell(0, 5, "jugandoyeducando@hotmail.com", 0, 1, 'R')
-        self.set_x(info_x)
-        self.cell(0, 5, "Avenida 19 # 114A - 22, Bogota", 0, 1, 'R')
-
-        if self.is_table_page and self.table_col_widths:
-            self.set_y(40)
-            self.draw_table_header(self.table_col_widths)
-
-    def draw_quote_number(self, numero):
-        self.set_font(self.current_font_family, '', 11)
-        self.set_text_color(50, 50, 50)
-        self.set_xy(150, 55)
-        self.cell(35, 6, "Cotización N°:", 0, 0, 'R')
-
-        y_numero = self.get_y()
-        self.set_font(self.current_font_family, 'B', 12)
-        self.set_text_color(4, 76, 125)
-        self.cell(25, 6, numero, 0, 1, 'L')
-
-        self.set_draw_color(4, 76, 125)
-        self.set_line_width(0.6)
-        y_line = y_numero + 10
-        self.line(10, y_line, 200, y_line)
-        self.ln(12)
-
-    def draw_client_info(self, data):
-        self.ln(5)
-        self.set_font(self.current_font_family, "B", 11)
-        self.set_text_color(*self.color_primary)
-        self.cell(0, 8, "Información del Cliente", 0, 1, 'L')
-        self.set_font(self.current_font_family, "", 10)
-        self.set_text_color(*self.color_text)
-        y_start = self.get_y()
-        self.set_xy(10, y_start)
-        self.cell(25, 6, "Cliente:", 0, 0, 'L')
-        self.set_font(self.current_font_family, "B", 10)
-        self.multi_cell(75, 6, data.get('cliente_nombre', ''), 0, 'L')
-        self.set_font(self.current_font_family, "", 10)
-        self.set_xy(10, self.get_y())
-        self.cell(25, 6, "NIT/CC:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('cliente_nit', ''), 0, 'L')
-        self.set_xy(10, self.get_y())
-        self.cell(25, 6, "Dirección:", 0, 0, 'L')
-        self.multi_cell(75, 6, f"{data.get('cliente_dir','')}, {data.get('cliente_ciudad','')}", 0, 'L')
-        y_left_end = self.get_y()
-        self.set_xy(110, y_start)
-        self.cell(25, 6, "Fecha:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('fecha', ''), 0, 'L')
-        self.set_xy(110, self.get_y())
-        self.cell(25, 6, "Teléfono:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('cliente_tel', ''), 0, 'L')
-        self.set_xy(110, self.get_y())
-        self.cell(25, 6, "Vigencia:", 0, 0, 'L')
-        self.multi_cell(75, 6, data.get('vigencia', ''), 0, 'L')
-        y_right_end = self.get_y()
-        self.set_y(max(y_left_end, y_right_end) + 5)
-
-    def get_multicell_lines(self, text, width):
-        self.set_font(self.current_font_family, "", 9)
-        words = str(text).split(' ')
-        lines_count = 1
-        current_line_w = 0
-        space_w = self.get_string_width(' ')
-        for word in words:
-            word_w = self.get_string_width(word)
-            if word_w > width:
-                lines_count += int(word_w / width)
-                word_w = word_w % width
-            if current_line_w + word_w + space_w < width:
-                current_line_w += word_w + space_w
-            else:
-                lines_count += 1
-                current_line_w = word_w + space_w
-        return lines_count
-
-    def draw_table_header(self, col_widths):
-        self.set_font(self.current_font_family, "B", 9)
-        self.set_fill_color(*self.color_primary)
-        self.set_text_color(255, 255, 255)
-        self.set_draw_color(*self.color_primary)
-        self.set_line_width(0.3)
-        self.cell(col_widths['img'], 8, "IMAGEN", 'T', 0, 'C', 1)
-        self.cell(col_widths['name'], 8, "PRODUCTO", 'T', 0, 'C', 1)
-        self.cell(col_widths['sku'], 8, "CÓDIGO", 'T', 0, 'C', 1)
-        self.cell(col_widths['qty'], 8, "UNDS.", 'T', 0, 'C', 1)
-        self.cell(col_widths['price'], 8, "VLR. UNITARIO", 'T', 0, 'C', 1)
-        self.cell(col_widths['total'], 8, "VALOR TOTAL", 'T', 1, 'C', 1)
-
-    def ensure_row_fits(self, row_height):
-        if self.get_y() + row_height > self.page_break_trigger:
-            self.add_page()
-            if self.is_table_page and self.table_col_widths:
-                self.set_y(40)
-                self.draw_table_header(self.table_col_widths)
-
-    def draw_table_row(self, item, col_widths, fill=False):
-        line_height = 5
-        num_lines = self.get_multicell_lines(item.get('nombre', ''), col_widths['name'] - 2)
-        name_height = num_lines * line_height
-        row_height = max(30, name_height + 4)
-
-        self.ensure_row_fits(row_height)
-
-        x_start = self.get_x()
-        y_start = self.get_y()
-
-        self.set_font(self.current_font_family, "", 9)
-        self.set_text_color(*self.color_text)
-        self.set_draw_color(*self.color_border)
-        self.set_fill_color(*self.color_secondary)
-
-        self.cell(col_widths['img'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['name'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['sku'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['qty'], row_height, "", 'B', 0, 'C', fill)
-        self.cell(col_widths['price'], row_height, "", 'B', 0, 'R', fill)
-        self.cell(col_widths['total'], row_height, "", 'B', 1, 'R', fill)
-
-        # Imagen
+            stored_at = os.path.getmtime(url_path)
+            if self._is_expired(stored_at):
+                return None, None
+            with open(url_path, 'r') as f:
+                blob_path = os.path.join(self._blobs_dir, f.read().strip())
+            with open(blob_path, 'rb') as f:
+                content = f.read()
+            os.utime(blob_path)  # Marca de uso para el desalojo LRU en disco
+            return stored_at, content
+        except OSError:
+            return None, None
+
+    def _write_blob_tmp(self, blob_path, content):
+        tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        return tmp_path
+
+    def _write_disk(self, key, content):
+        content_hash = hashlib.sha256(content).hexdigest()
+        blob_path = os.path.join(self._blobs_dir, content_hash)
         try:
-            image_source = None
-            if item.get('imagen_base64'):
-                image_bytes = base64.b64decode(item['imagen_base64'])
-                image_source = BytesIO(image_bytes)
-            elif item.get('imagen_url') and "placehold.co" not in item.get('imagen_url'):
-                # Añadimos header para simular navegador si es necesario, 
-                # aunque Wix suele servir imágenes estáticas sin problemas
-                headers_img = {'User-Agent': 'Mozilla/5.0'}
-                response = requests.get(item['imagen_url'], headers=headers_img, timeout=5)
-                if response.status_code == 200:
-                    image_source = BytesIO(response.content)
-            
-            if image_source:
-                # Ajuste de imagen para mantener proporción
-                self.image(image_source, x=x_start + 2, y=y_start + 2, w=col_widths['img'] - 4, h=row_height - 4)
-            else:
-                raise Exception("No image")
-        except Exception:
-            v_offset_placeholder = (row_height - 4) / 2
-            self.set_xy(x_start, y_start + v_offset_placeholder)
-            self.cell(col_widths['img'], 4, "S/I", 0, 0, 'C')
-
-        # Nombre
-        name_v_offset = (row_height - name_height) / 2
-        self.set_xy(x_start + col_widths['img'], y_start + name_v_offset)
-        self.multi_cell(col_widths['name'], line_height, str(item.get('nombre', '')), border=0, align='C')
-
-        text_height = self.font_size
-        cell_v_offset = (row_height - text_height) / 2
-        
-        # SKU
-        self.set_xy(x_start + col_widths['img'] + col_widths['name'], y_start + cell_v_offset)
-        self.cell(col_widths['sku'], text_height, str(item.get('sku', '')), 0, 0, 'C')
-        
-        # Cantidad
-        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'])
-        self.cell(col_widths['qty'], text_height, str(item.get('cantidad', '')), 0, 0, 'C')
-        
-        # Precio
-        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'])
-        self.cell(col_widths['price'], text_height, format_currency(item.get('precio_unitario', 0)), 0, 0, 'R')
-        
-        # Total
-        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'] + col_widths['price'])
-        self.cell(col_widths['total'], text_height, format_currency(item.get('valor_total', 0)), 0, 0, 'R')
+            # Los bytes se escriben fuera del lock; publicarlos y contarlos, dentro
+            tmp_path = None if os.path.exists(blob_path) else self._write_blob_tmp(blob_path, content)
+            with self._lock:
+                # Otro hilo pudo guardar el mismo contenido (o el desalojo borrarlo) entre tanto
+                if os.path.exists(blob_path):
+                    if tmp_path:
+                        os.remove(tmp_path)
+                else:
+                    os.replace(tmp_path or self._write_blob_tmp(blob_path, content), blob_path)
+                    self._disk_bytes += len(content)
+                with open(self._url_path(key), 'w') as f:
+                    f.write(content_hash)
+        except OSError as e:
+            logger.warning("No se pudo guardar la imagen en caché: %s", e)
+            return
+        if self._disk_bytes > self.disk_limit:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Borra los blobs menos usados, junto con los archivos de URL que apuntan a ellos."""
+        with self._lock:
+            pointers = defaultdict(list)  # hash del contenido -> archivos de URL
+            for entry in os.scandir(self._urls_dir):
+                try:
+                    with open(entry.path, 'r') as f:
+                        pointers[f.read().strip()].append(entry.path)
+                except OSError:
+                    continue
+            # Los .tmp son escrituras en curso de otros hilos
+            blobs = [entry for entry in os.scandir(self._blobs_dir) if not entry.name.endswith('.tmp')]
+            for entry in sorted(blobs, key=lambda entry: entry.stat().st_mtime):
+                if self._disk_bytes <= self.disk_limit * 0.9:
+                    break
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    self._disk_bytes -= size
+                except OSError:
+                    continue
+                for url_path in pointers.pop(entry.name, []):
+                    try:
+                        os.remove(url_path)
+                    except OSError:
+                        pass
+
+    def get_or_create(self, key, create):
+        """Bytes guardados bajo `key` en memoria o disco; si no están, los produce `create()`."""
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached and not self._is_expired(cached[0]):
+                self._memory.move_to_end(key)
+                return cached[1]
+
+        stored_at, content = self._read_disk(key)
+        if content is None:
+            content = create()
+            if content is None:
+                return None
+            stored_at = time.time()
+            self._write_disk(key, content)
+        self._remember(key, stored_at, content)
+        return content
+
+    def get(self, url):
+        """Bytes de la imagen de `url` desde memoria, disco o red (None si no se pudo obtener)."""
+        if not is_real_image_url(url):
+            return None
+        return self.get_or_create(url, lambda: self.fetch(url))
+
+    def get_thumbnail(self, url, max_px=THUMBNAIL_MAX_PX, quality=THUMBNAIL_JPEG_QUALITY):
+        """Miniatura de la imagen de `url`, pedida ya reducida a Wix cuando se puede."""
+        if not is_real_image_url(url):
+            return None
+        source_url = wix_thumbnail_url(url, max_px, quality)
+        return self.get_or_create(f"{url}#{max_px}px-q{quality}", lambda: make_thumbnail(self.get(source_url), max_px, quality))
 
-        self.set_y(y_start + row_height)
+    def get_thumbnail_from_blob(self, image_ref, blob_store, max_px=THUMBNAIL_MAX_PX, quality=THUMBNAIL_JPEG_QUALITY):
+        """Miniatura de una imagen subida a mano y guardada en el almacén de imágenes."""
+        return self.get_or_create(f"{image_ref}#{max_px}px-q{quality}",
+                                  lambda: make_thumbnail(blob_store.get(image_ref), max_px, quality))
 
-    def footer(self):
-        self.set_y(-15)
-        self.set_font(self.current_font_family, "I", 8)
-        self.set_text_color(150, 150, 150)
-        self.cell(0, 10, f"Página {self.page_no()}", 0, 0, 'C')
+    def get_thumbnail_from_base64(self, image_base64, max_px=THUMBNAIL_MAX_PX, quality=THUMBNAIL_JPEG_QUALITY):
+        """Miniatura de una imagen subida a mano (base64), guardada por hash del contenido."""
+        content_hash = hashlib.sha256(image_base64.encode()).hexdigest()
+        return self.get_or_create(f"base64:{content_hash}#{max_px}px-q{quality}",
+                                  lambda: make_thumbnail(base64.b64decode(image_base64), max_px, quality))
+
+@st.cache_resource
+def get_image_cache():
+    """Caché de imágenes compartida por todas las sesiones del proceso."""
+    return ImageCache()
+
+# --- ALMACÉN DE IMÁGENES SUBIDAS ---
+# Las imágenes de los productos manuales no van dentro de la cotización: se
+# guardan una vez por contenido y el ítem lleva solo `imagen_ref` ("sha256:...").
+# En producción van a Cloud Storage (st.secrets["blob_store"]["bucket"]); sin
+# esa configuración, a una carpeta local (desarrollo y pruebas).
+BLOB_STORE_LOCAL_DIR = "imagenes_subidas"
+BLOB_STORE_PREFIX = "imagenes_manuales"
+
+def image_content_ref(image_bytes):
+    return f"sha256:{hashlib.sha256(image_bytes).hexdigest()}"
+
+def image_mime_type(image_bytes):
+    try:
+        return Image.MIME.get(Image.open(BytesIO(image_bytes)).format, 'application/octet-stream')
+    except Exception:
+        return 'application/octet-stream'
+
+def _blob_name(image_ref):
+    algorithm, _, digest = image_ref.partition(':')
+    if algorithm != 'sha256' or not re.fullmatch(r'[0-9a-f]{64}', digest):
+        raise ValueError(f"Referencia de imagen inválida: {image_ref}")
+    return f"{BLOB_STORE_PREFIX}/{digest}"
+
+class LocalBlobStore:
+    """Almacén de imágenes en una carpeta local, indexado por el hash del contenido."""
+    def __init__(self, directory=BLOB_STORE_LOCAL_DIR):
+        self.directory = directory
+
+    def _path(self, image_ref):
+        return os.path.join(self.directory, *_blob_name(image_ref).split('/'))
+
+    def put(self, image_bytes, content_type=None):
+        """Guarda la imagen (una sola vez por contenido) y devuelve su referencia."""
+        image_ref = image_content_ref(image_bytes)
+        path = self._path(image_ref)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(image_bytes)
+            os.replace(tmp_path, path)
+        return image_ref
+
+    def get(self, image_ref):
+        with open(self._path(image_ref), 'rb') as f:
+            return f.read()
+
+class CloudBlobStore:
+    """Almacén de imágenes en un bucket de Cloud Storage (el de Firebase)."""
+    def __init__(self, bucket_name):
+        self.bucket = storage.bucket(bucket_name)
+
+    def put(self, image_bytes, content_type=None):
+        image_ref = image_content_ref(image_bytes)
+        blob = self.bucket.blob(_blob_name(image_ref))
+        if not blob.exists():
+            blob.upload_from_string(image_bytes, content_type=content_type or image_mime_type(image_bytes))
+        return image_ref
+
+    def get(self, image_ref):
+        return self.bucket.blob(_blob_name(image_ref)).download_as_bytes()
+
+@st.cache_resource
+def get_blob_store():
+    """Almacén de imágenes configurado, compartido por todas las sesiones del proceso."""
+    config = st.secrets.get("blob_store", {})
+    if config.get("bucket"):
+        return CloudBlobStore(config["bucket"])
+    logger.warning("Sin st.secrets['blob_store']['bucket']: las imágenes subidas se guardan en la carpeta local")
+    return LocalBlobStore(config.get("local_dir", BLOB_STORE_LOCAL_DIR))
+
+def move_item_images_to_blob_store(items, blob_store):
+    """Pasa al almacén las imágenes en `imagen_base64` de los ítems (cotizaciones antiguas).
+
+    Devuelve (ítems con `imagen_ref` en lugar del base64, cuántas se movieron).
+    Con `blob_store` None solo cuenta.
+    """
+    moved = 0
+    new_items = {}
+    for key, item in items.items():
+        if item.get('imagen_base64'):
+            moved += 1
+            if blob_store is not None:
+                item = {k: v for k, v in item.items() if k != 'imagen_base64'}
+                item['imagen_ref'] = blob_store.put(base64.b64decode(items[key]['imagen_base64']))
+        new_items[key] = item
+    return new_items, moved
+
+def resolve_item_image(item, image_cache):
+    """Obtiene y valida la miniatura de un ítem. Devuelve (bytes o None, estado).
+
+    El estado es 'ok', 'sin_imagen' (el ítem no tiene imagen) o 'error'
+    (la descarga falló o los bytes no son una imagen válida).
+    """
+    try:
+        if item.get('imagen_ref'):
+            image_bytes = image_cache.get_thumbnail_from_blob(item['imagen_ref'], get_blob_store())
+        elif item.get('imagen_base64'):
+            # Cotización guardada antes del almacén de imágenes y aún sin migrar
+            image_bytes = image_cache.get_thumbnail_from_base64(item['imagen_base64'])
+        elif is_real_image_url(item.get('imagen_url')):
+            image_bytes = image_cache.get_thumbnail(item['imagen_url'])
+        else:
+            return None, 'sin_imagen'
+        if not image_bytes:
+            return None, 'error'
+        Image.open(BytesIO(image_bytes)).verify()
+        return image_bytes, 'ok'
+    except Exception:
+        return None, 'error'
+
+def prefetch_quote_images(items, max_workers=IMAGE_PREFETCH_WORKERS, image_cache=None):
+    """Resuelve en paralelo las imágenes de todos los ítems de una cotización.
+
+    Devuelve {clave_del_item: (bytes o None, estado)}; una imagen que falla
+    no frena a las demás y su fila queda con "S/I".
+    """
+    image_cache = image_cache or get_image_cache()
+    if not items:
+        return {}
+    with perf_span('imagen.prefetch') as span, \
+            ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        span.add(items=len(items))
+        resolve = perf_recorder.bind(resolve_item_image)
+        futures = {key: executor.submit(resolve, item, image_cache) for key, item in items.items()}
+        return {key: future.result() for key, future in futures.items()}
 
 # --- FUNCIONES DE FIREBASE (DB) ---
+TIENDAS = ["Oviedo", "Barranquilla"]
+ESTADOS_COTIZACION = ["🔵 Creada", "✉️ Enviada", "✅ Aprobada", "❌ Rechazada", "🧾 Facturada"]
+TRACKING_PAGE_SIZES = [25, 50, 100]
+CLIENT_PREFIX_MAX_LEN = 12  # Prefijos de cada palabra del cliente guardados para el filtro
+
+def quote_fecha_orden(fecha):
+    """`fecha` ("%d/%m/%Y") como "AAAA-MM-DD", que sí ordena bien en Firestore. None si no es válida."""
+    try:
+        return datetime.strptime(str(fecha), "%d/%m/%Y").date().isoformat()
+    except ValueError:
+        return None
+
+def client_search_prefixes(cliente_nombre):
+    """Prefijos normalizados de cada palabra del cliente, para filtrar con `array_contains`."""
+    return sorted({
+        token[:length]
+        for token in tokenize(cliente_nombre or '')
+        for length in range(1, min(len(token), CLIENT_PREFIX_MAX_LEN) + 1)
+    })
+
+# `fecha_orden` de una cotización con `fecha` ilegible: queda de última en el
+# Seguimiento en vez de faltar en las consultas (y de contar siempre como pendiente de migrar)
+FECHA_ORDEN_INVALIDA = "1970-01-01"
+
+def quote_derived_fields(quote_data):
+    """Campos calculados que se guardan junto a la cotización.
+
+    `fecha_orden` y `cliente_prefijos` los usan las consultas paginadas del
+    Seguimiento; los totales permiten listar cotizaciones sin leer los ítems.
+    """
+    items = quote_data.get('items', {}) or {}
+    subtotal = sum(item.get('valor_total', 0) for item in items.values())
+    return {
+        'fecha_orden': quote_fecha_orden(quote_data.get('fecha', '')) or FECHA_ORDEN_INVALIDA,
+        'cliente_prefijos': client_search_prefixes(quote_data.get('cliente_nombre', '')),
+        'subtotal': subtotal,
+        'total': subtotal + int(quote_data.get('flete_val', 0) or 0),
+        'total_unidades': sum(item.get('cantidad', 0) for item in items.values()),
+        'num_items': len(items),
+    }
+
+QUOTE_DERIVED_FIELDS = ('fecha_orden', 'cliente_prefijos', 'subtotal', 'total', 'total_unidades', 'num_items')
+# Lo único que se descarga por cotización en el Seguimiento
+# `fecha_orden` va aunque no se muestre: el documento proyectado es el cursor de la página siguiente
+TRACKING_FIELDS = ['numero_cotizacion', 'fecha', 'fecha_orden', 'cliente_nombre', 'cliente_prefijos', 'total', 'estado', 'comentarios']
+
+# --- NUMERACIÓN DE COTIZACIONES ---
+# Un documento contador por tienda (counters/cotizaciones_oviedo, ...): las
+# tiendas ya no compiten por el mismo documento. Cada número se asigna en una
+# transacción, así la numeración sigue sin huecos (solo un borrado deja uno).
+# Antes los contadores eran campos de counters/cotizaciones; el de cada tienda
+# se toma de ahí la primera vez.
+LEGACY_COUNTER_DOC = 'cotizaciones'
+
+class QuoteNumberMetrics:
+    """Reintentos y latencia de la asignación de números, acumulados por proceso."""
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.retries = 0
+        self.failures = 0
+        self.latencies_ms = deque(maxlen=window)
+
+    def record(self, attempts, elapsed_ms, ok=True):
+        with self._lock:
+            self.retries += max(0, attempts - 1)
+            if ok:
+                self.allocations += 1
+                self.latencies_ms.append(elapsed_ms)
+            else:
+                self.failures += 1
+
+    def summary(self):
+        with self._lock:
+            latencies = sorted(self.latencies_ms)
+        return {
+            'asignaciones': self.allocations, 'reintentos': self.retries, 'fallos': self.failures,
+            'p50_ms': percentile(latencies, 0.5), 'p95_ms': percentile(latencies, 0.95),
+        }
+
+@st.cache_resource
+def get_quote_number_metrics():
+    return QuoteNumberMetrics()
+
 @firestore.transactional
-def get_next_quote_number_transaction(transaction, counter_ref, tienda_key):
+def get_next_quote_number_transaction(transaction, counter_ref, legacy_ref, tienda_key, attempts):
+    attempts.append(1)  # Firestore vuelve a llamar a esta función en cada reintento
     snapshot = counter_ref.get(transaction=transaction)
-    data = snapshot.to_dict() or {}
-    current_number = data.get(tienda_key, 0)
+    if snapshot.exists:
+        current_number = snapshot.get('ultimo') or 0
+    else:
+        legacy = legacy_ref.get(transaction=transaction).to_dict() or {}
+        current_number = legacy.get(tienda_key, 0)
     new_number = current_number + 1
-    transaction.set(counter_ref, {tienda_key: new_number}, merge=True)
+    transaction.set(counter_ref, {'ultimo': new_number})
     return new_number
 
 def get_next_quote_number(db, tienda):
     if not db: return None
     tienda_key = tienda.lower()
-    counter_ref = db.collection('counters').document('cotizaciones')
-    
+    counters = db.collection('counters')
+    counter_ref = counters.document(f"{LEGACY_COUNTER_DOC}_{tienda_key}")
+    legacy_ref = counters.document(LEGACY_COUNTER_DOC)
+
+    metrics = get_quote_number_metrics()
+    attempts = []
+    start = time.perf_counter()
     try:
-        new_number = get_next_quote_number_transaction(db.transaction(), counter_ref, tienda_key)
-        prefix = "OV" if tienda == "Oviedo" else "BQ"
-        return f"{prefix}-{str(new_number).zfill(4)}"
+        new_number = get_next_quote_number_transaction(db.transaction(), counter_ref, legacy_ref, tienda_key, attempts)
     except Exception as e:
+        metrics.record(len(attempts), (time.perf_counter() - start) * 1000, ok=False)
         st.error(f"Error al obtener número de cotización: {e}")
         return None
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    metrics.record(len(attempts), elapsed_ms)
+    logger.info("Número de cotización %s asignado a %s en %.0f ms (%d intentos)", new_number, tienda, elapsed_ms, len(attempts))
+    prefix = "OV" if tienda == "Oviedo" else "BQ"
+    return f"{prefix}-{str(new_number).zfill(4)}"
+
+# --- ESPEJO EN MEMORIA DE LAS COTIZACIONES ---
+QUOTE_MIRROR_READY_TIMEOUT = 15  # Segundos a esperar la primera carga del listener
+
+class QuoteMirror:
+    """Copia en memoria de las cotizaciones de una tienda, al día vía `on_snapshot`.
+
+    La colección se descarga una sola vez al crear el listener; después solo
+    llegan los documentos que cambian. El callback corre en un hilo de
+    Firestore, así que todo acceso pasa por el lock. Las escrituras de esta
+    app se aplican también aquí (`put`/`remove`) para que el rerun que sigue
+    al guardado ya las vea, sin esperar al listener.
+    """
+    def __init__(self, db, tienda):
+        self.db = db
+        self.tienda = tienda
+        self._lock = threading.Lock()
+        self._listen_lock = threading.Lock()
+        self._docs = {}
+        self._ready = threading.Event()
+        self._watch = None
+        self.ensure_listening()
+
+    def ensure_listening(self):
+        """Crea el listener, o lo vuelve a crear si se cayó (red, credenciales)."""
+        with self._listen_lock:
+            if self._watch is not None and self._watch.is_active:
+                return
+            if self._watch is not None:
+                logger.warning("Listener de cotizaciones de %s inactivo, se reconecta", self.tienda)
+            self._ready.clear()
+            self._listen_started = time.perf_counter()
+            query = self.db.collection('cotizaciones').where('tienda', '==', self.tienda)
+            self._watch = query.on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        with self._lock:
+            if not self._ready.is_set():
+                # Primera entrega de un listener nuevo: trae la colección completa
+                self._docs = {doc.id: doc.to_dict() for doc in docs}
+                perf_recorder.record('firestore.espejo_carga', (time.perf_counter() - self._listen_started) * 1000)
+            else:
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        self._docs.pop(change.document.id, None)
+                    else:
+                        self._docs[change.document.id] = change.document.to_dict()
+        self._ready.set()
+
+    def wait_ready(self, timeout=QUOTE_MIRROR_READY_TIMEOUT):
+        return self._ready.wait(timeout)
+
+    def items(self):
+        """[(id, datos)] de todas las cotizaciones de la tienda (los dicts no se deben modificar)."""
+        with self._lock:
+            return list(self._docs.items())
+
+    def get(self, doc_id):
+        with self._lock:
+            return self._docs.get(doc_id)
+
+    def put(self, doc_id, data, merge=False):
+        with self._lock:
+            if merge and doc_id in self._docs:
+                data = {**self._docs[doc_id], **data}
+            self._docs[doc_id] = data
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._docs.pop(doc_id, None)
+
+    def reload(self):
+        """Descarta la copia y la vuelve a cargar con un listener nuevo."""
+        with self._listen_lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+            self._watch = None
+        self.ensure_listening()
+
+    def close(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+
+@st.cache_resource(show_spinner=False)
+def _get_quote_mirror(_db, tienda):
+    return QuoteMirror(_db, tienda)
+
+def get_quote_mirror(db, tienda):
+    """Espejo compartido por todas las sesiones del proceso, o None si no está disponible.
+
+    Si el listener se cayó (red, credenciales) se vuelve a crear; si la
+    primera carga no llega a tiempo, quien llama lee directo de Firestore.
+    """
+    try:
+        mirror = _get_quote_mirror(db, tienda)
+        mirror.ensure_listening()
+        with perf_span('firestore.espejo_espera'):
+            ready = mirror.wait_ready()
+        if not ready:
+            logger.warning("El espejo de cotizaciones de %s no cargó a tiempo", tienda)
+            return None
+        return mirror
+    except Exception as e:
+        logger.warning("No se pudo iniciar el espejo de cotizaciones de %s: %s", tienda, e)
+        return None
+
+def get_store_quotes(db, tienda):
+    """[(id, datos)] de las cotizaciones de la tienda: del espejo o, si no hay, de Firestore."""
+    mirror = get_quote_mirror(db, tienda)
+    if mirror is not None:
+        return mirror.items()
+    with perf_span('firestore.stream') as span:
+        quotes = [(quote.id, quote.to_dict()) for quote in db.collection('cotizaciones').where('tienda', '==', tienda).stream()]
+        span.add(docs=len(quotes))
+    return quotes
+
+def get_quote(db, tienda, quote_id):
+    """Una cotización completa, del espejo si ya la tiene."""
+    mirror = get_quote_mirror(db, tienda)
+    quote_data = mirror.get(quote_id) if mirror is not None else None
+    if quote_data is None:
+        with perf_span('firestore.get') as span:
+            quote_data = db.collection('cotizaciones').document(quote_id).get().to_dict()
+            span.add(docs=1)
+    return copy.deepcopy(quote_data)
 
 def get_quotes_list(db, tienda):
     if not db or not tienda: return {}
-    quotes_ref = db.collection('cotizaciones').where('tienda', '==', tienda).stream()
     quotes_dict = {}
-    for quote in quotes_ref:
-        quote_data = quote.to_dict()
-        label = quote_data.get('numero_cotizacion', quote.id)
-        quotes_dict[f"{label} - {quote_data.get('cliente_nombre', 'N/A')}"] = quote.id
+    for quote_id, quote_data in get_store_quotes(db, tienda):
+        label = quote_data.get('numero_cotizacion', quote_id)
+        quotes_dict[f"{label} - {quote_data.get('cliente_nombre', 'N/A')}"] = quote_id
     return quotes_dict
 
 def save_quote(db, quote_data, quote_id=None):
@@ -426,8 +1764,13 @@ def save_quote(db, quote_data, quote_id=None):
         st.error("Error: No se puede guardar la cotización sin una tienda asignada.")
         return None
     try:
+        if any(item.get('imagen_base64') for item in quote_data.get('items', {}).values()):
+            quote_data['items'], _ = move_item_images_to_blob_store(quote_data['items'], get_blob_store())
+        # Siempre desde los ítems que se guardan, así los totales no se desincronizan
+        quote_data.update(quote_derived_fields(quote_data))
         if quote_id:
             db.collection('cotizaciones').document(quote_id).update(quote_data)
+            invalidate_quote_list_cache(db, quote_data['tienda'], {quote_id: quote_data})
             st.success(f"¡Cotización '{quote_data.get('numero_cotizacion', '')}' actualizada!")
         else:
             quote_number = get_next_quote_number(db, quote_data['tienda'])
@@ -437,114 +1780,319 @@ def save_quote(db, quote_data, quote_id=None):
             quote_data['estado'] = "🔵 Creada"
             quote_data['comentarios'] = ""
 
-            db.collection('cotizaciones').add(quote_data)
+            _, quote_ref = db.collection('cotizaciones').add(quote_data)
+            invalidate_quote_list_cache(db, quote_data['tienda'], {quote_ref.id: quote_data})
             st.success(f"¡Cotización '{quote_number}' guardada como nueva!")
-        
-        st.cache_data.clear()
         return True
     except Exception as e:
         st.error(f"Error al guardar la cotización: {e}")
         return None
 
-def delete_quote(db, quote_id):
+def delete_quote(db, quote_id, tienda=None):
     if not db: return
     try:
         db.collection('cotizaciones').document(quote_id).delete()
+        if tienda:
+            invalidate_quote_list_cache(db, tienda, {quote_id: None})
         st.success("¡Cotización eliminada con éxito!")
-        st.cache_data.clear()
     except Exception as e:
         st.error(f"Error al eliminar la cotización: {e}")
 
-def get_all_quotes_for_tracking(db, tienda):
+def quote_tracking_row(quote_id, data):
+    """Fila de la tabla de Seguimiento, a partir de los `TRACKING_FIELDS` del documento."""
+    total = data.get('total')
+    if total is None:
+        # Documento sin migrar (o completo): se calcula desde los ítems si vienen
+        total = sum(item.get('valor_total', 0) for item in data.get('items', {}).values()) + (data.get('flete_val', 0) or 0)
+    return {
+        "id": quote_id,
+        "N° Cotización": data.get("numero_cotizacion", "S/N"),
+        "Fecha": data.get("fecha", "S/F"),
+        "Cliente": data.get("cliente_nombre", "N/A"),
+        "Total": total,
+        "Estado": data.get("estado", "🔵 Creada"),
+        "Comentarios": data.get("comentarios", "")
+    }
+
+def get_tracking_page(db, tienda, page_size, cursor=None, estado=None, fecha_desde=None, fecha_hasta=None, cliente=None):
+    """Una página del Seguimiento, filtrada y paginada en Firestore (más recientes primero).
+
+    `cursor` es el último documento de la página anterior. El filtro de cliente
+    usa en el servidor la palabra más larga escrita (sobre `cliente_prefijos`)
+    y las demás se verifican aquí, así que esa página puede traer menos filas.
+    Devuelve (filas, {id: update_time} para detectar ediciones concurrentes,
+    cursor de la página siguiente o None).
+    """
+    if not db or not tienda: return [], {}, None
+    query = db.collection('cotizaciones').where('tienda', '==', tienda)
+    if estado:
+        query = query.where('estado', '==', estado)
+    client_tokens = [token[:CLIENT_PREFIX_MAX_LEN] for token in tokenize(cliente or '')]
+    if client_tokens:
+        query = query.where('cliente_prefijos', 'array_contains', max(client_tokens, key=len))
+    if fecha_desde:
+        query = query.where('fecha_orden', '>=', fecha_desde.isoformat())
+    if fecha_hasta:
+        query = query.where('fecha_orden', '<=', fecha_hasta.isoformat())
+    query = query.order_by('fecha_orden', direction=firestore.Query.DESCENDING)
+    if cursor is not None:
+        query = query.start_after(cursor)
+
+    # Un documento de más para saber si hay página siguiente
+    with perf_span('firestore.seguimiento') as span:
+        docs = list(query.select(TRACKING_FIELDS).limit(page_size + 1).stream())
+        span.add(docs=len(docs))
+    next_cursor = docs[page_size - 1] if len(docs) > page_size else None
+    rows, versions = [], {}
+    for doc in docs[:page_size]:
+        data = doc.to_dict()
+        if client_tokens:
+            prefixes = set(data.get('cliente_prefijos', []))
+            if not all(token in prefixes for token in client_tokens):
+                continue
+        rows.append(quote_tracking_row(doc.id, data))
+        versions[doc.id] = doc.update_time
+    return rows, versions, next_cursor
+
+TRACKING_EDITABLE_FIELDS = {'Estado': 'estado', 'Comentarios': 'comentarios'}
+
+def diff_tracking_changes(original_df, edited_df):
+    """Cambios hechos en el editor de Seguimiento, emparejados por `id` y no por posición.
+
+    `original_df` está indexado por `id`; `edited_df` es lo que devuelve el
+    editor. Se comparan en bloque solo las columnas editables, y un comentario
+    nulo (NaN/None) cuenta igual que uno vacío. Devuelve {id: {campo: valor}}
+    con únicamente los campos que cambiaron.
+    """
+    columns = list(TRACKING_EDITABLE_FIELDS)
+    edited = edited_df.set_index('id')[columns]
+    edited = edited[edited.index.isin(original_df.index)].fillna('').astype(str)
+    original = original_df.loc[edited.index, columns].fillna('').astype(str)
+    changed = edited.ne(original)
+    changed = changed[changed.any(axis=1)]
+
+    updates = {}
+    flags = changed.stack()
+    for doc_id, column in flags[flags].index:
+        updates.setdefault(doc_id, {})[TRACKING_EDITABLE_FIELDS[column]] = edited.at[doc_id, column]
+    return updates
+
+def count_quotes_pending_migration(db, tienda):
+    """Cotizaciones sin los campos derivados (sin `fecha_orden` ni siquiera salen en el Seguimiento)."""
+    mirror = get_quote_mirror(db, tienda)
+    if mirror is None:
+        return 0
+    return sum(1 for _, data in mirror.items() if any(field not in data for field in QUOTE_DERIVED_FIELDS))
+
+def get_quotes_for_export(db, tienda, estado=None, fecha_desde=None, fecha_hasta=None):
+    """Cotizaciones de la tienda como [(id, datos)], filtradas por estado y rango de fechas (date)."""
     if not db or not tienda: return []
-    quotes_ref = db.collection('cotizaciones').where('tienda', '==', tienda).stream()
-    quotes_list = []
-    for quote in quotes_ref:
-        data = quote.to_dict()
-        subtotal = sum(item.get('valor_total', 0) for item in data.get('items', {}).values())
-        flete_val_doc = data.get('flete_val', 0)
-        quotes_list.append({
-            "id": quote.id,
-            "N° Cotización": data.get("numero_cotizacion", "S/N"),
-            "Fecha": data.get("fecha", "S/F"),
-            "Cliente": data.get("cliente_nombre", "N/A"),
-            "Total": subtotal + (flete_val_doc or 0),
-            "Estado": data.get("estado", "🔵 Creada"),
-            "Comentarios": data.get("comentarios", "")
-        })
-    return quotes_list
-
-def update_quotes_tracking(db, edited_data):
-    if not db: return
-    try:
-        for doc_id, changes in edited_data.items():
-            db.collection('cotizaciones').document(doc_id).update(changes)
-        st.success("¡Seguimiento actualizado con éxito!")
-    except Exception as e:
-        st.error(f"Error al actualizar seguimiento: {e}")
+    query = db.collection('cotizaciones').where('tienda', '==', tienda)
+    if estado:
+        query = query.where('estado', '==', estado)
+    quotes = []
+    with perf_span('firestore.exportacion') as span:
+        for quote in query.stream():
+            span.add(docs=1)
+            data = quote.to_dict()
+            if fecha_desde or fecha_hasta:
+                try:
+                    fecha = datetime.strptime(data.get('fecha', ''), "%d/%m/%Y").date()
+                except ValueError:
+                    continue
+                if (fecha_desde and fecha < fecha_desde) or (fecha_hasta and fecha > fecha_hasta):
+                    continue
+            quotes.append((quote.id, data))
+    return quotes
+
+FIRESTORE_BATCH_SIZE = 400  # Firestore admite hasta 500 escrituras por lote
+
+QUOTE_CONFLICT_ERROR = "Alguien más la modificó mientras la editabas; recarga y vuelve a aplicar el cambio."
+
+def commit_quote_updates(db, updates, batch_size=FIRESTORE_BATCH_SIZE, on_progress=None, versions=None):
+    """Aplica {id: cambios} sobre `cotizaciones` en lotes de escritura.
+
+    Cada lote es atómico; si uno falla se reintenta documento por documento
+    para saber exactamente cuáles no se guardaron. Con `versions`
+    ({id: update_time leído}) cada escritura exige que el documento no haya
+    cambiado desde entonces. `on_progress(hechos, total)` se llama después de
+    cada lote. Devuelve (ids guardados, {id: error}).
+    """
+    collection = db.collection('cotizaciones')
+    pending = list(updates.items())
+    versions = versions or {}
+
+    def write_option(doc_id):
+        update_time = versions.get(doc_id)
+        return db.write_option(last_update_time=update_time) if update_time else None
+
+    saved, failures = [], {}
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        batch = db.batch()
+        for doc_id, changes in chunk:
+            batch.update(collection.document(doc_id), changes, option=write_option(doc_id))
+        try:
+            with perf_span('firestore.lote') as span:
+                span.add(escrituras=len(chunk))
+                batch.commit()
+            saved.extend(doc_id for doc_id, _ in chunk)
+        except Exception as e:
+            logger.warning("Falló un lote de %d escrituras, se reintenta uno por uno: %s", len(chunk), e)
+            for doc_id, changes in chunk:
+                try:
+                    collection.document(doc_id).update(changes, option=write_option(doc_id))
+                    saved.append(doc_id)
+                except FailedPrecondition:
+                    failures[doc_id] = QUOTE_CONFLICT_ERROR
+                except Exception as doc_error:
+                    failures[doc_id] = str(doc_error)
+        if on_progress:
+            on_progress(start + len(chunk), len(pending))
+    return saved, failures
+
+def update_quotes_tracking(db, edited_data, tienda=None, versions=None):
+    """Guarda los cambios del Seguimiento. Devuelve (ids guardados, {id: error}).
+
+    `versions` ({id: update_time}) es de cuando se cargó la página: una
+    cotización modificada desde entonces no se pisa y vuelve como conflicto.
+    """
+    if not db: return [], {}
+    saved, failures = commit_quote_updates(db, edited_data, versions=versions)
+    if tienda:
+        invalidate_quote_list_cache(db, tienda, {doc_id: edited_data[doc_id] for doc_id in saved})
+    return saved, failures
 
 # --- GENERACIÓN DEL PDF ---
-def generate_pdf_content(quote_data):
-    pdf = PDF('P', 'mm', 'A4')
-    pdf.set_auto_page_break(auto=True, margin=15)
-    pdf.add_page()
-    
-    pdf.set_font(pdf.current_font_family, "B", 22)
-    pdf.set_text_color(*pdf.color_primary)
-    pdf.set_y(45)
-    pdf.cell(130, 10, "COTIZACIÓN", 0, 0, 'L')
-    pdf.draw_quote_number(quote_data.get("numero_cotizacion", "S/N"))
-    pdf.draw_client_info(quote_data)
-    
-    col_widths = {'img': 30, 'name': 70, 'sku': 20, 'qty': 15, 'price': 25, 'total': 30}
-    
-    pdf.is_table_page = True
-    pdf.table_col_widths = col_widths
-    pdf.draw_table_header(col_widths)
-    
-    fill = True
-    for item in quote_data['items'].values():
-        pdf.draw_table_row(item, col_widths, fill)
-        fill = not fill
-    
-    pdf.is_table_page = False
-
-    needed = 55
-    if pdf.get_y() + needed > pdf.page_break_trigger:
-        pdf.add_page()
-
-    total_label_x = 100
-    totals_y_start = pdf.get_y() + 5 
-    pdf.set_font(pdf.current_font_family, "", 10)
-    pdf.set_text_color(*pdf.color_text)
-    pdf.set_xy(total_label_x, totals_y_start)
-    pdf.cell(70, 8, "SUBTOTAL", 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 10)
-    pdf.cell(30, 8, format_currency(quote_data['subtotal']), 0, 1, 'R')
-
-    pdf.set_font(pdf.current_font_family, "", 10)
-    pdf.set_x(total_label_x)
-    flete_label = "FLETE (INCLUIDO)" if str(quote_data.get('flete_str','')).upper() == 'INCLUIDO' else "FLETE"
-    pdf.cell(70, 8, flete_label, 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 10)
-    pdf.cell(30, 8, format_currency(quote_data.get('flete_val', 0)), 0, 1, 'R')
-
-    pdf.set_font(pdf.current_font_family, "", 10)
-    pdf.set_x(total_label_x)
-    pdf.cell(70, 8, "TOTAL UNIDADES", 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 10)
-    pdf.cell(30, 8, str(quote_data['total_unidades']), 0, 1, 'R')
-    pdf.set_x(total_label_x)
-    pdf.set_draw_color(*pdf.color_border)
-    pdf.line(total_label_x + 5, pdf.get_y(), 200, pdf.get_y())
-    pdf.ln(2)
-    pdf.set_font(pdf.current_font_family, "B", 11)
-    pdf.set_text_color(*pdf.color_primary)
-    pdf.set_x(total_label_x)
-    pdf.cell(70, 10, "TOTAL COTIZACION INCLUIDO IVA", 0, 0, 'R')
-    pdf.set_font(pdf.current_font_family, "B", 12)
-    pdf.cell(30, 10, format_currency(quote_data['total_cotizacion']), 0, 1, 'R')
-    return bytes(pdf.output())
+def quote_pdf_filename(numero_cotizacion, cliente_nombre):
+    file_name_cliente = cliente_nombre.replace(' ', '_') if cliente_nombre else 'General'
+    file_name_cot = numero_cotizacion or "NUEVA"
+    return f"Cotizacion_{file_name_cot}_{file_name_cliente}.pdf"
+
+def build_pdf_data_from_quote(quote):
+    """Arma los datos de `generate_pdf_content` a partir de una cotización guardada en Firestore.
+
+    El documento no guarda la opción de flete: un flete en 0 se muestra como INCLUIDO.
+    """
+    items = quote.get('items', {})
+    subtotal = sum(item.get('valor_total', 0) for item in items.values())
+    flete_val = int(quote.get('flete_val', 0) or 0)
+    return {
+        'fecha': quote.get('fecha', ''),
+        'numero_cotizacion': quote.get('numero_cotizacion') or "N/A",
+        'cliente_nombre': quote.get('cliente_nombre', ''),
+        'cliente_nit': quote.get('cliente_nit', ''),
+        'cliente_ciudad': quote.get('cliente_ciudad', ''),
+        'cliente_tel': quote.get('cliente_tel', ''),
+        'cliente_email': quote.get('cliente_email', ''),
+        'cliente_dir': quote.get('cliente_dir', ''),
+        'forma_pago': quote.get('forma_pago', ''),
+        'vigencia': quote.get('vigencia', ''),
+        'items': items,
+        'subtotal': subtotal,
+        'flete_str': "MANUAL" if flete_val else "INCLUIDO",
+        'flete_val': flete_val,
+        'total_unidades': sum(item.get('cantidad', 0) for item in items.values()),
+        'total_cotizacion': subtotal + flete_val
+    }
+
+def build_export_jobs(quotes):
+    """Trabajos para `exportar_cotizaciones.export_quotes_zip`: [(id, datos del PDF, nombre del archivo)].
+
+    Una cotización con datos inválidos no frena las demás: devuelve
+    (trabajos, {nombre del archivo: error}), como los errores del pool.
+    """
+    jobs, failures = [], {}
+    for doc_id, quote in quotes:
+        file_name = doc_id
+        try:
+            file_name = quote_pdf_filename(quote.get('numero_cotizacion'), quote.get('cliente_nombre'))
+            jobs.append((doc_id, build_pdf_data_from_quote(quote), file_name))
+        except Exception as e:
+            failures[file_name] = str(e)
+    return jobs, failures
+
+# --- CACHÉ DE PDF ---
+PDF_CACHE_MAX_ENTRIES = 32
+
+def quote_payload_hash(quote_data, images=None):
+    """Hash estable del contenido de la cotización: mismo contenido, mismo hash.
+
+    Con `images` (de `prefetch_quote_images`) también cuenta qué imagen salió
+    en cada fila, por el hash de sus bytes y su estado.
+    """
+    payload = {'cotizacion': quote_data}
+    if images is not None:
+        payload['imagenes'] = {
+            key: (status, hashlib.sha256(image_bytes).hexdigest() if image_bytes else None)
+            for key, (image_bytes, status) in images.items()
+        }
+    canonical = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class PdfCache:
+    """LRU acotada de PDFs ya generados, indexada por `quote_payload_hash`."""
+    def __init__(self, max_entries=PDF_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            pdf_bytes = self._entries.get(key)
+            if pdf_bytes is not None:
+                self._entries.move_to_end(key)
+            return pdf_bytes
+
+    def put(self, key, pdf_bytes):
+        with self._lock:
+            self._entries[key] = pdf_bytes
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+@st.cache_resource
+def get_pdf_cache():
+    """Caché de PDFs compartida por todas las sesiones del proceso."""
+    return PdfCache()
+
+def get_quote_pdf(quote_data, images, pdf_cache):
+    """PDF de la cotización, generado solo si ese mismo contenido (con sus imágenes) no se generó antes.
+
+    Un PDF con alguna imagen que no se pudo descargar no se guarda: el
+    próximo intento puede traerla.
+    """
+    key = quote_payload_hash(quote_data, images)
+    pdf_bytes = pdf_cache.get(key)
+    if pdf_bytes is None:
+        pdf_bytes = generate_pdf_content(quote_data, images=images, perf_recorder=perf_recorder)
+        if not any(status == 'error' for _, status in images.values()):
+            pdf_cache.put(key, pdf_bytes)
+    return pdf_bytes
+
+# --- INVALIDACIÓN DE CACHÉS ---
+# Cada caché se invalida por separado; una escritura solo toca lo que cambió:
+# guardar una cotización actualiza la lista de su tienda, no el catálogo.
+# El catálogo no se descarta: "Forzar Actualización" lo reemplaza cuando la
+# descarga termina bien. Los PDFs tampoco: la clave es el contenido (datos e
+# imágenes), así que una cotización editada simplemente genera otra clave.
+def invalidate_quote_list_cache(db, tienda, changes=None):
+    """Lista de cotizaciones de `tienda` (su espejo en memoria); las otras tiendas no se tocan.
+
+    `changes` es {id: campos escritos, o None si se borró} y se aplica al
+    espejo sin volver a leer Firestore. Sin `changes` se recarga entero.
+    """
+    mirror = get_quote_mirror(db, tienda)
+    if mirror is None:
+        return
+    if changes is None:
+        mirror.reload()
+        return
+    for doc_id, data in changes.items():
+        if data is None:
+            mirror.remove(doc_id)
+        else:
+            mirror.put(doc_id, copy.deepcopy(data), merge=True)
 
 # --- ESTADO DE SESIÓN ---
 def init_session_state():
@@ -556,430 +2104,678 @@ def init_session_state():
         'numero_cotizacion': None, 'estado': None, 'comentarios': None,
         'fecha': datetime.now(),
         'manual_product_count': 0,
+        'request_import_count': 0,
         'flete_val': 0
     }
     for key, value in defaults.items():
         st.session_state.setdefault(key, value)
 
+# Claves que sobreviven a la limpieza del formulario y al cambio de tienda:
+# la versión del catálogo que vio la sesión y sus mediciones de rendimiento
+PRESERVED_SESSION_KEYS = ('catalog_version', 'perf_sesion')
+
 def clear_form_state():
     current_tienda = st.session_state.tienda_seleccionada
-    products_df = st.session_state.get('products_df')
+    preserved_state = {key: st.session_state.get(key) for key in PRESERVED_SESSION_KEYS}
     
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     
     init_session_state()
     st.session_state.tienda_seleccionada = current_tienda
-    st.session_state.products_df = products_df
+    st.session_state.update(preserved_state)
     st.success("Formulario limpiado. Listo para una nueva cotización.")
 
-init_session_state()
+# --- PANEL DE RENDIMIENTO ---
+def get_session_perf_trace():
+    """Totales por etapa de la sesión actual (None si la medición está apagada)."""
+    if not perf_recorder.enabled:
+        return None
+    return st.session_state.setdefault('perf_sesion', PerfTrace())
+
+def render_perf_panel():
+    """Panel de la barra lateral con p50/p95 por etapa, reruns lentos y exportación."""
+    if not perf_recorder.enabled:
+        return
+    with st.sidebar.expander("⏱️ Rendimiento"):
+        summary = perf_recorder.stage_summary()
+        if summary:
+            st.caption("Proceso (últimas mediciones por etapa)")
+            st.dataframe(pd.DataFrame(summary).round(1), hide_index=True)
+
+        session_trace = get_session_perf_trace()
+        session_stages = session_trace.snapshot() if session_trace else {}
+        if session_stages:
+            st.caption("Esta sesión (totales)")
+            rows = [{'etapa': stage, **totals} for stage, totals in sorted(session_stages.items())]
+            st.dataframe(pd.DataFrame(rows).round(1), hide_index=True)
+
+        slow_reruns = list(perf_recorder.slow_reruns)[-10:]
+        st.caption(f"Reruns de más de {perf_recorder.slow_rerun_ms:.0f} ms")
+        if not slow_reruns:
+            st.write("Ninguno por ahora.")
+        for entry in reversed(slow_reruns):
+            top = sorted(((stage, totals['ms']) for stage, totals in entry['etapas'].items() if stage != 'rerun'),
+                         key=lambda pair: pair[1], reverse=True)[:3]
+            detail = ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in top)
+            st.text(f"{entry['fecha'][11:]} · {entry['total_ms']:.0f} ms · {detail}")
+
+        numbering = get_quote_number_metrics().summary()
+        st.caption(f"Numeración: {numbering['asignaciones']} asignaciones, {numbering['reintentos']} reintentos, "
+                   f"{numbering['fallos']} fallos, p50 {numbering['p50_ms'] or 0:.0f} ms, p95 {numbering['p95_ms'] or 0:.0f} ms")
+
+        export = {**perf_recorder.export(), 'sesion': session_stages, 'numeracion': numbering}
+        st.download_button("⬇️ Exportar JSON", json.dumps(export, ensure_ascii=False, indent=2, default=str),
+                           file_name=f"rendimiento_{datetime.now():%Y%m%d_%H%M}.json", mime="application/json",
+                           use_container_width=True)
+
+# --- IMPORTACIÓN DE SOLICITUDES (INTERFAZ) ---
+def render_request_import(catalog):
+    """Carga de una solicitud (xlsx o csv): columnas, revisión de coincidencias y alta en bloque en la cotización."""
+    uploaded = st.file_uploader("Solicitud del cliente", type=['xlsx', 'csv'],
+                                key=f"request_file_{st.session_state.request_import_count}")
+    if uploaded is None:
+        return
+
+    state = st.session_state.get('request_import')
+    if state is None or state['file_id'] != uploaded.file_id:
+        try:
+            grid = read_request_grid(uploaded.getvalue(), uploaded.name)
+        except Exception as e:
+            st.error(f"❌ No se pudo leer el archivo: {e}")
+            return
+        header_row, columns = detect_request_columns(grid, catalog.sku_index)
+        state = {'file_id': uploaded.file_id, 'grid': grid, 'header_row': header_row, 'columns': columns}
+        st.session_state.request_import = state
+    grid, header_row = state['grid'], state['header_row']
+
+    def column_label(column):
+        if column is None:
+            return "— Ninguna —"
+        header = grid.at[header_row, column] if header_row is not None else None
+        return f"Columna {column_letter(column)}" + (f" ({header})" if isinstance(header, str) else "")
+
+    options = [None, *grid.columns]
+    columns = {}
+    for col, (field, title) in zip(st.columns(3), [('descripcion', "Descripción"), ('sku', "SKU"), ('cantidad', "Cantidad")]):
+        columns[field] = col.selectbox(title, options, index=options.index(state['columns'][field]),
+                                       format_func=column_label, key=f"request_column_{field}_{uploaded.file_id}")
+    if columns['descripcion'] is None and columns['sku'] is None:
+        st.warning("⚠️ Elige al menos la columna de descripción o la de SKU.")
+        return
+
+    # Se vuelve a emparejar solo si cambian las columnas o el catálogo
+    match_key = (tuple(columns.values()), catalog.version)
+    if state.get('match_key') != match_key:
+        lines = build_request_lines(grid, header_row, columns)
+        state['matches'] = match_request_lines(lines, catalog)
+        state['match_key'] = match_key
+    matches = state['matches']
+    if matches.empty:
+        st.info("La solicitud no tiene líneas con descripción o SKU.")
+        return
+
+    counts = matches['estado'].value_counts()
+    st.caption(" · ".join(f"{label}: {counts.get(status, 0)}" for status, label in MATCH_STATUS_LABELS.items())
+               + ". Revisa las líneas marcadas; las que no tienen producto se añaden con el buscador o como producto manual.")
+
+    def product_label(position):
+        return f"{catalog.df['sku'].iat[position]} — {catalog.df['nombre'].iat[position]}"
+
+    candidate_positions = list(dict.fromkeys(position for candidates in matches['candidatos'] for position in candidates))
+    position_by_label = {product_label(position): position for position in candidate_positions}
+    review = pd.DataFrame({
+        "Añadir": matches['estado'].isin(['sku', 'nombre']),
+        "Fila": matches['fila'],
+        "Solicitud": matches['descripcion'].map(lambda text: request_line_title(text)[:80]),
+        "Cantidad": matches['cantidad'],
+        "Producto": [product_label(position) if position >= 0 else None for position in matches['posicion']],
+        "Coincidencia": matches['estado'].map(MATCH_STATUS_LABELS),
+        "Puntaje": matches['puntaje'],
+    })
+    edited = st.data_editor(
+        review,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Añadir": st.column_config.CheckboxColumn(),
+            "Fila": st.column_config.NumberColumn(disabled=True),
+            "Solicitud": st.column_config.TextColumn(disabled=True, width="large"),
+            "Cantidad": st.column_config.NumberColumn(min_value=1, step=1),
+            "Producto": st.column_config.SelectboxColumn(options=list(position_by_label), width="large"),
+            "Coincidencia": st.column_config.TextColumn(disabled=True),
+            "Puntaje": st.column_config.NumberColumn(format="%.2f", disabled=True),
+        },
+        key=f"request_review_{uploaded.file_id}_{'_'.join(map(str, match_key))}"
+    )
+
+    selected = edited[edited["Añadir"] & edited["Producto"].notna() & (edited["Cantidad"].fillna(0) > 0)]
+    if st.button(f"➕ Añadir {len(selected)} productos a la cotización", type="primary", disabled=selected.empty,
+                 use_container_width=True):
+        for label, quantity in zip(selected["Producto"], selected["Cantidad"]):
+            add_catalog_product(st.session_state.quote_items, catalog.df.iloc[position_by_label[label]], int(quantity))
+        # Un cargador nuevo (vacío) para la próxima solicitud
+        st.session_state.request_import_count += 1
+        st.session_state.pop('request_import', None)
+        st.toast(f"✅ {len(selected)} líneas de la solicitud añadidas a la cotización.")
+        st.rerun()
+
+# --- INTERFAZ ---
+def main():
+    init_session_state()
 
-# --- BARRA LATERAL ---
-with st.sidebar:
-    st.title("Gestión de Cotizaciones")
-    tiendas = ["Oviedo", "Barranquilla"]
+    # Sin fuentes o logo el PDF saldría mal: se avisa al arrancar en vez de descubrirlo al descargar
+    try:
+        get_pdf_assets()
+    except FileNotFoundError as e:
+        st.error(f"❌ {e}")
+        st.stop()
+
+    # --- BARRA LATERAL ---
+    with st.sidebar:
+        st.title("Gestión de Cotizaciones")
+        tiendas = TIENDAS
     
-    def on_store_change():
-        new_store = st.session_state.tienda_selector
-        products_df = st.session_state.get('products_df')
+        def on_store_change():
+            new_store = st.session_state.tienda_selector
+            preserved_state = {key: st.session_state.get(key) for key in PRESERVED_SESSION_KEYS}
 
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
+            for key in list(st.session_state.keys()):
+                del st.session_state[key]
         
-        init_session_state()
-        st.session_state.tienda_seleccionada = new_store
-        st.session_state.products_df = products_df
-
-    if 'tienda_seleccionada' not in st.session_state or st.session_state.tienda_seleccionada is None:
-        st.session_state.tienda_seleccionada = tiendas[0]
-
-    st.radio(
-        "Selecciona tu tienda:",
-        tiendas,
-        key="tienda_selector",
-        on_change=on_store_change,
-        horizontal=True,
-        index=tiendas.index(st.session_state.tienda_seleccionada)
-    )
+            init_session_state()
+            st.session_state.tienda_seleccionada = new_store
+            st.session_state.update(preserved_state)
+
+        if 'tienda_seleccionada' not in st.session_state or st.session_state.tienda_seleccionada is None:
+            st.session_state.tienda_seleccionada = tiendas[0]
+
+        st.radio(
+            "Selecciona tu tienda:",
+            tiendas,
+            key="tienda_selector",
+            on_change=on_store_change,
+            horizontal=True,
+            index=tiendas.index(st.session_state.tienda_seleccionada)
+        )
+
+        if st.session_state.tienda_seleccionada:
+            st.success(f"Tienda seleccionada: **{st.session_state.tienda_seleccionada}**")
+
+    render_perf_panel()
+
+    # --- UI PRINCIPAL ---
+    if not st.session_state.tienda_seleccionada:
+        st.info("👋 ¡Bienvenido! Por favor, selecciona tu tienda en la barra lateral para comenzar.")
+        try:
+            st.image("logo_transparente.png", width=200)
+        except FileNotFoundError:
+            pass
+    else:
+        tab1, tab2 = st.tabs(["📝 Crear Cotización", "📊 Seguimiento de Cotizaciones"])
 
-    if st.session_state.tienda_seleccionada:
-        st.success(f"Tienda seleccionada: **{st.session_state.tienda_seleccionada}**")
+        # --- PESTAÑA DE CREAR COTIZACIÓN ---
+        with tab1:
+            with st.sidebar:
+                st.divider()
+                st.header("Opciones de Creación")
+                if st.button("➕ Nueva Cotización", use_container_width=True):
+                    clear_form_state()
+                    st.rerun()
 
-# --- UI PRINCIPAL ---
-if not st.session_state.tienda_seleccionada:
-    st.info("👋 ¡Bienvenido! Por favor, selecciona tu tienda en la barra lateral para comenzar.")
-    try:
-        st.image("logo_transparente.png", width=200)
-    except FileNotFoundError:
-        pass
-else:
-    tab1, tab2 = st.tabs(["📝 Crear Cotización", "📊 Seguimiento de Cotizaciones"])
-
-    # --- PESTAÑA DE CREAR COTIZACIÓN ---
-    with tab1:
-        with st.sidebar:
-            st.divider()
-            st.header("Opciones de Creación")
-            if st.button("➕ Nueva Cotización", use_container_width=True):
-                clear_form_state()
-                st.rerun()
-
-            st.divider()
+                st.divider()
             
-            if db:
-                quotes_dict = get_quotes_list(db, st.session_state.tienda_seleccionada)
-                if quotes_dict:
-                    selected_quote_label = st.selectbox(
-                        "Cargar Cotización Existente",
-                        options=list(quotes_dict.keys()),
-                        index=None,
-                        placeholder="Selecciona una cotización...",
-                        key="load_quote_sb"
-                    )
-
-                    if st.button("📥 Cargar Cotización", use_container_width=True):
-                        if selected_quote_label:
-                            quote_id_to_load = quotes_dict[selected_quote_label]
-                            quote_data = db.collection('cotizaciones').document(quote_id_to_load).get().to_dict()
+                if db:
+                    quotes_dict = get_quotes_list(db, st.session_state.tienda_seleccionada)
+                    if quotes_dict:
+                        selected_quote_label = st.selectbox(
+                            "Cargar Cotización Existente",
+                            options=list(quotes_dict.keys()),
+                            index=None,
+                            placeholder="Selecciona una cotización...",
+                            key="load_quote_sb"
+                        )
+
+                        if st.button("📥 Cargar Cotización", use_container_width=True):
+                            if selected_quote_label:
+                                quote_id_to_load = quotes_dict[selected_quote_label]
+                                quote_data = get_quote(db, st.session_state.tienda_seleccionada, quote_id_to_load)
                             
-                            clear_form_state()
+                                clear_form_state()
                             
-                            st.session_state.current_quote_id = quote_id_to_load
-                            st.session_state.cliente_nombre = quote_data.get('cliente_nombre', '')
-                            st.session_state.cliente_nit = quote_data.get('cliente_nit', '')
-                            st.session_state.cliente_ciudad = quote_data.get('cliente_ciudad', '')
-                            st.session_state.cliente_tel = quote_data.get('cliente_tel', '')
-                            st.session_state.cliente_email = quote_data.get('cliente_email', '')
-                            st.session_state.cliente_dir = quote_data.get('cliente_dir', '')
-                            st.session_state.forma_pago = quote_data.get('forma_pago', "Transferencia bancaria (pago anticipado)")
-                            st.session_state.vigencia = quote_data.get('vigencia', "5 DÍAS HÁBILES")
-                            st.session_state.numero_cotizacion = quote_data.get('numero_cotizacion')
-                            st.session_state.estado = quote_data.get('estado')
-                            st.session_state.comentarios = quote_data.get('comentarios')
-                            st.session_state.quote_items = quote_data.get('items', {})
-                            st.session_state.flete_val = quote_data.get('flete_val', 0)
-
-                            fecha_str = quote_data.get('fecha')
-                            if fecha_str and isinstance(fecha_str, str):
-                                st.session_state.fecha = datetime.strptime(fecha_str, "%d/%m/%Y")
+                                st.session_state.current_quote_id = quote_id_to_load
+                                st.session_state.cliente_nombre = quote_data.get('cliente_nombre', '')
+                                st.session_state.cliente_nit = quote_data.get('cliente_nit', '')
+                                st.session_state.cliente_ciudad = quote_data.get('cliente_ciudad', '')
+                                st.session_state.cliente_tel = quote_data.get('cliente_tel', '')
+                                st.session_state.cliente_email = quote_data.get('cliente_email', '')
+                                st.session_state.cliente_dir = quote_data.get('cliente_dir', '')
+                                st.session_state.forma_pago = quote_data.get('forma_pago', "Transferencia bancaria (pago anticipado)")
+                                st.session_state.vigencia = quote_data.get('vigencia', "5 DÍAS HÁBILES")
+                                st.session_state.numero_cotizacion = quote_data.get('numero_cotizacion')
+                                st.session_state.estado = quote_data.get('estado')
+                                st.session_state.comentarios = quote_data.get('comentarios')
+                                st.session_state.quote_items = quote_data.get('items', {})
+                                st.session_state.flete_val = quote_data.get('flete_val', 0)
+
+                                fecha_str = quote_data.get('fecha')
+                                if fecha_str and isinstance(fecha_str, str):
+                                    st.session_state.fecha = datetime.strptime(fecha_str, "%d/%m/%Y")
                             
-                            st.success(f"Cotización '{st.session_state.numero_cotizacion}' cargada.")
-                            st.rerun()
+                                st.success(f"Cotización '{st.session_state.numero_cotizacion}' cargada.")
+                                st.rerun()
 
-            st.divider()
+                st.divider()
             
-            if st.session_state.get('current_quote_id'):
-                if st.button("🗑️ Eliminar Cotización", use_container_width=True):
-                    delete_quote(db, st.session_state.current_quote_id)
-                    clear_form_state()
-                    st.rerun()
+                if st.session_state.get('current_quote_id'):
+                    if st.button("🗑️ Eliminar Cotización", use_container_width=True):
+                        delete_quote(db, st.session_state.current_quote_id, st.session_state.tienda_seleccionada)
+                        clear_form_state()
+                        st.rerun()
 
-        try:
-            logo = Image.open("logo_transparente.png")
-            st.image(logo, width=180)
-        except FileNotFoundError:
-            st.title("GENERADOR DE COTIZACIONES")
+            try:
+                logo = Image.open("logo_transparente.png")
+                st.image(logo, width=180)
+            except FileNotFoundError:
+                st.title("GENERADOR DE COTIZACIONES")
 
-        st.markdown("---")
-        st.header("Paso 1: Catálogo de Productos (Sincronizado)")
+            st.markdown("---")
+            st.header("Paso 1: Catálogo de Productos (Sincronizado)")
         
-        col_cat_1, col_cat_2 = st.columns([3, 1])
-        with col_cat_1:
-            st.info("El catálogo se conecta directamente a Wix y trae TODOS los productos (incluyendo stock 0).")
-        with col_cat_2:
-            if st.button("🔄 Forzar Actualización", help="Vuelve a descargar los productos desde Wix"):
-                st.cache_data.clear()
-                st.rerun()
-
-        # Cargar datos automáticamente si no existen
-        if st.session_state.get('products_df') is None:
-            df_wix = fetch_and_process_wix_data()
-            if df_wix is not None:
-                st.session_state.products_df = df_wix
-            else:
+            col_cat_1, col_cat_2 = st.columns([3, 1])
+            with col_cat_1:
+                st.info("El catálogo se conecta directamente a Wix y trae TODOS los productos (incluyendo stock 0).")
+            with col_cat_2:
+                if st.button("🔄 Forzar Actualización", help="Vuelve a descargar los productos desde Wix"):
+                    st.session_state.catalog_force_refresh = True
+                    st.rerun()
+
+            catalog = load_shared_catalog(force_refresh=st.session_state.pop('catalog_force_refresh', False))
+            if catalog is None:
                 st.warning("⚠️ No se pudieron cargar los productos. Revisa tu conexión o API Key.")
 
-        # Mostrar confirmación si ya están cargados
-        if st.session_state.get('products_df') is not None:
-            st.success(f"✅ Catálogo sincronizado: {len(st.session_state.products_df)} productos disponibles.")
+            # Mostrar confirmación si ya están cargados
+            if catalog is not None:
+                # La sesión solo recuerda qué versión vio, para avisar cuando cambia
+                if st.session_state.get('catalog_version') not in (None, catalog.version):
+                    st.toast("🔄 El catálogo se actualizó con los últimos cambios de Wix.")
+                st.session_state.catalog_version = catalog.version
+                st.success(f"✅ Catálogo sincronizado: {len(catalog.df)} productos disponibles.")
+                sku_index = catalog.sku_index
+                if sku_index.duplicates or sku_index.blank_count:
+                    with st.expander(f"⚠️ Revisar SKU en Wix: {len(sku_index.duplicates)} duplicados, {sku_index.blank_count} sin SKU"):
+                        st.caption("Los productos sin SKU no se pueden añadir por código. En los duplicados se usa el primer producto encontrado.")
+                        if sku_index.duplicates:
+                            duplicated_rows = catalog_display(catalog.df[catalog.df['sku'].isin(sku_index.duplicates)])
+                            st.dataframe(duplicated_rows[['sku', 'nombre', 'precio_iva_incluido']].sort_values('sku'), hide_index=True)
             
-            # Buscador rápido para verificar
-            with st.expander("🔍 Verificar productos (Buscador rápido)"):
-                search_term = st.text_input("Buscar por nombre o SKU en el catálogo cargado:")
-                if search_term:
-                    mask = st.session_state.products_df.apply(lambda x: search_term.lower() in str(x).lower(), axis=1)
-                    st.dataframe(st.session_state.products_df[mask].head(10))
-                else:
-                    st.dataframe(st.session_state.products_df.head())
-            st.divider()
-
-            st.header("Paso 2: Información General")
-            c1, c2, c3 = st.columns(3)
-            c1.date_input("Fecha", key="fecha", disabled=True)
-            c1.text_input("Ciudad (Origen)", "BOGOTA D.C", disabled=True)
-            c2.text_input("Entrega", "A CONVENIR CON EL CLIENTE", disabled=True)
-            c2.selectbox("Forma de Pago", ["Transferencia bancaria (pago anticipado)", "50% anticipado - 50% contraentrega", "Contraentrega"], key="forma_pago")
-            c3.selectbox("Vigencia", [f"{i} DÍAS HÁBILES" for i in range(1, 8)], key="vigencia")
-
-            st.subheader("Datos del Cliente")
-            cl1, cl2 = st.columns(2)
-            cl1.text_input("Cliente:", key="cliente_nombre")
-            cl1.text_input("NIT/CC:", key="cliente_nit")
-            cl1.text_input("Ciudad (Destino):", key="cliente_ciudad")
-            cl2.text_input("Teléfono:", key="cliente_tel")
-            cl2.text_input("Correo:", key="cliente_email")
-            cl2.text_input("Dirección:", key="cliente_dir")
-
-            st.divider()
-            st.header("Paso 3: Añadir Productos")
-            form_cols = st.columns([2, 1, 1])
-            sku_input = form_cols[0].text_input("Introduce el SKU del producto:", key="sku_input")
-            qty_input = form_cols[1].number_input("Cantidad", min_value=1, value=1, step=1, key="qty_input")
-            if form_cols[2].button("➕ Añadir Producto", type="primary", use_container_width=True):
-                if st.session_state.sku_input:
-                    product = st.session_state.products_df[st.session_state.products_df['sku'] == st.session_state.sku_input]
-                    if not product.empty:
-                        data = product.iloc[0]
-                        sku = data['sku']
-                        if sku in st.session_state.quote_items:
-                            st.session_state.quote_items[sku]['cantidad'] += st.session_state.qty_input
+                # Buscador rápido para verificar
+                with st.expander("🔍 Verificar productos (Buscador rápido)"):
+                    search_term = st.text_input("Buscar por nombre o SKU en el catálogo cargado:")
+                    if search_term:
+                        st.dataframe(catalog_display(catalog.search_index.search(search_term)))
+                    else:
+                        st.dataframe(catalog_display(catalog.df.head()))
+                st.divider()
+
+                st.header("Paso 2: Información General")
+                c1, c2, c3 = st.columns(3)
+                c1.date_input("Fecha", key="fecha", disabled=True)
+                c1.text_input("Ciudad (Origen)", "BOGOTA D.C", disabled=True)
+                c2.text_input("Entrega", "A CONVENIR CON EL CLIENTE", disabled=True)
+                c2.selectbox("Forma de Pago", ["Transferencia bancaria (pago anticipado)", "50% anticipado - 50% contraentrega", "Contraentrega"], key="forma_pago")
+                c3.selectbox("Vigencia", [f"{i} DÍAS HÁBILES" for i in range(1, 8)], key="vigencia")
+
+                st.subheader("Datos del Cliente")
+                cl1, cl2 = st.columns(2)
+                cl1.text_input("Cliente:", key="cliente_nombre")
+                cl1.text_input("NIT/CC:", key="cliente_nit")
+                cl1.text_input("Ciudad (Destino):", key="cliente_ciudad")
+                cl2.text_input("Teléfono:", key="cliente_tel")
+                cl2.text_input("Correo:", key="cliente_email")
+                cl2.text_input("Dirección:", key="cliente_dir")
+
+                st.divider()
+                st.header("Paso 3: Añadir Productos")
+                search_cols = st.columns([2, 2])
+                product_search = search_cols[0].text_input("🔎 Buscar producto por nombre o SKU:", key="product_search")
+                if product_search:
+                    results = catalog.search_index.search(product_search)
+                    result_names = dict(zip(results['sku'], results['nombre']))
+                    search_cols[1].selectbox(
+                        f"Resultados ({len(results)})",
+                        options=list(result_names),
+                        format_func=lambda sku: f"{sku} — {result_names[sku]}",
+                        index=None,
+                        placeholder="Elige un producto para usar su SKU...",
+                        key="search_pick",
+                        on_change=use_search_result
+                    )
+                form_cols = st.columns([2, 1, 1])
+                sku_input = form_cols[0].text_input("Introduce el SKU del producto:", key="sku_input")
+                qty_input = form_cols[1].number_input("Cantidad", min_value=1, value=1, step=1, key="qty_input")
+                if form_cols[2].button("➕ Añadir Producto", type="primary", use_container_width=True):
+                    if st.session_state.sku_input:
+                        data = sku_index.lookup(st.session_state.sku_input)
+                        if data is not None:
+                            sku = data['sku']
+                            if sku_index.is_duplicate(sku):
+                                st.toast(f"⚠️ El SKU '{sku}' está duplicado en Wix; se usó '{data['nombre']}'.")
+                            add_catalog_product(st.session_state.quote_items, data, st.session_state.qty_input)
+                            st.rerun()
                         else:
-                            st.session_state.quote_items[sku] = {
-                                'imagen_url': data['imagen_url'],
-                                'nombre': data['nombre'],
-                                'sku': sku,
-                                'cantidad': st.session_state.qty_input,
-                                'precio_unitario': data['precio_iva_incluido']
-                            }
-                        item = st.session_state.quote_items[sku]
-                        item['valor_total'] = item['precio_unitario'] * item['cantidad']
-                        st.rerun()
+                            st.error(f"❌ SKU '{st.session_state.sku_input}' no encontrado.")
                     else:
-                        st.error(f"❌ SKU '{st.session_state.sku_input}' no encontrado.")
-                else:
-                    st.warning("⚠️ Introduce un SKU.")
+                        st.warning("⚠️ Introduce un SKU.")
             
-            with st.expander("👇 O añadir un producto manualmente"):
-                with st.form("manual_product_form", clear_on_submit=True):
-                    manual_name = st.text_input("Nombre del Producto")
-                    manual_sku = st.text_input("Código/SKU (ej: VARIOS-01)")
-                    manual_price = st.number_input("Valor Unitario", min_value=0, step=100)
-                    manual_qty = st.number_input("Cantidad", min_value=1, value=1, step=1)
-                    manual_image = st.file_uploader("Subir Imagen (Opcional)", type=['png', 'jpg', 'jpeg'])
+                with st.expander("👇 O añadir un producto manualmente"):
+                    with st.form("manual_product_form", clear_on_submit=True):
+                        manual_name = st.text_input("Nombre del Producto")
+                        manual_sku = st.text_input("Código/SKU (ej: VARIOS-01)")
+                        manual_price = st.number_input("Valor Unitario", min_value=0, step=100)
+                        manual_qty = st.number_input("Cantidad", min_value=1, value=1, step=1)
+                        manual_image = st.file_uploader("Subir Imagen (Opcional)", type=['png', 'jpg', 'jpeg'])
                     
-                    submitted = st.form_submit_button("Añadir Producto Manualmente")
-                    if submitted:
-                        if not all([manual_name, manual_sku, manual_price, manual_qty]):
-                            st.warning("Por favor, completa todos los campos del producto manual.")
-                        else:
-                            st.session_state.manual_product_count += 1
-                            unique_sku = f"manual_{st.session_state.manual_product_count}"
+                        submitted = st.form_submit_button("Añadir Producto Manualmente")
+                        if submitted:
+                            if not all([manual_name, manual_sku, manual_price, manual_qty]):
+                                st.warning("Por favor, completa todos los campos del producto manual.")
+                            else:
+                                st.session_state.manual_product_count += 1
+                                unique_sku = f"manual_{st.session_state.manual_product_count}"
                             
-                            image_base64 = None
-                            if manual_image is not None:
-                                image_bytes = manual_image.getvalue()
-                                image_base64 = base64.b64encode(image_bytes).decode()
-
-                            st.session_state.quote_items[unique_sku] = {
-                                'nombre': manual_name,
-                                'sku': manual_sku,
-                                'cantidad': manual_qty,
-                                'precio_unitario': manual_price,
-                                'valor_total': manual_price * manual_qty,
-                                'imagen_base64': image_base64,
-                                'imagen_url': None
-                            }
-                            st.success(f"Producto '{manual_name}' añadido.")
-                            st.rerun()
+                                image_ref = None
+                                if manual_image is not None:
+                                    try:
+                                        image_ref = get_blob_store().put(manual_image.getvalue(), manual_image.type)
+                                    except Exception as e:
+                                        st.error(f"No se pudo guardar la imagen, el producto queda sin imagen: {e}")
+
+                                st.session_state.quote_items[unique_sku] = {
+                                    'nombre': manual_name,
+                                    'sku': manual_sku,
+                                    'cantidad': manual_qty,
+                                    'precio_unitario': manual_price,
+                                    'valor_total': manual_price * manual_qty,
+                                    'imagen_ref': image_ref,
+                                    'imagen_url': None
+                                }
+                                st.success(f"Producto '{manual_name}' añadido.")
+                                st.rerun()
 
-            st.divider()
-            st.header("Paso 4: Cotización Actual")
-            if not st.session_state.quote_items:
-                st.info("Aún no has añadido productos.")
-            else:
-                cols = st.columns([1.2, 4, 1, 1, 2, 2, 1])
-                headers = ["Imagen", "Producto", "SKU", "Unds.", "Vlr. Unit.", "Vlr. Total", ""]
-                for col, header in zip(cols, headers):
-                    col.markdown(f"**{header}**")
-                
-                for sku, item in list(st.session_state.quote_items.items()):
+                with st.expander("📄 O importar la solicitud del cliente (Excel o CSV)"):
+                    render_request_import(catalog)
+
+                st.divider()
+                st.header("Paso 4: Cotización Actual")
+                if not st.session_state.quote_items:
+                    st.info("Aún no has añadido productos.")
+                else:
                     cols = st.columns([1.2, 4, 1, 1, 2, 2, 1])
-                    if item.get('imagen_base64'):
-                        img_bytes = base64.b64decode(item['imagen_base64'])
-                        cols[0].image(img_bytes, width=70)
-                    elif item.get('imagen_url') and "placehold.co" not in item['imagen_url']:
-                        cols[0].image(item['imagen_url'], width=70)
-                    else:
-                        cols[0].markdown("S/I")
-
-                    cols[1].write(item['nombre'])
-                    cols[2].write(item['sku'])
-                    cols[3].write(str(item['cantidad']))
-                    cols[4].write(format_currency(item['precio_unitario']))
-                    cols[5].write(format_currency(item['valor_total']))
-                    if cols[6].button("🗑️", key=f"delete_{sku}", on_click=remove_item, args=(sku,)):
-                        st.rerun()
+                    headers = ["Imagen", "Producto", "SKU", "Unds.", "Vlr. Unit.", "Vlr. Total", ""]
+                    for col, header in zip(cols, headers):
+                        col.markdown(f"**{header}**")
                 
-                st.divider()
-                st.subheader("Resumen y Acciones")
-                subtotal = sum(item['valor_total'] for item in st.session_state.quote_items.values())
-                total_unidades = sum(item['cantidad'] for item in st.session_state.quote_items.values())
+                    # Las imágenes se resuelven una vez, en paralelo, para la vista previa y el PDF
+                    quote_images = prefetch_quote_images(st.session_state.quote_items)
+                    for sku, item in list(st.session_state.quote_items.items()):
+                        cols = st.columns([1.2, 4, 1, 1, 2, 2, 1])
+                        img_bytes, _ = quote_images.get(sku, (None, 'sin_imagen'))
+                        if img_bytes:
+                            cols[0].image(img_bytes, width=70)
+                        else:
+                            cols[0].markdown("S/I")
+
+                        cols[1].write(item['nombre'])
+                        cols[2].write(item['sku'])
+                        cols[3].write(str(item['cantidad']))
+                        cols[4].write(format_currency(item['precio_unitario']))
+                        cols[5].write(format_currency(item['valor_total']))
+                        if cols[6].button("🗑️", key=f"delete_{sku}", on_click=remove_item, args=(sku,)):
+                            st.rerun()
+                
+                    st.divider()
+                    st.subheader("Resumen y Acciones")
+                    subtotal = sum(item['valor_total'] for item in st.session_state.quote_items.values())
+                    total_unidades = sum(item['cantidad'] for item in st.session_state.quote_items.values())
 
-                st.subheader("Costo de Envío (Flete)")
+                    st.subheader("Costo de Envío (Flete)")
                 
-                opcion_flete = st.radio(
-                    "Elige una opción para el flete:",
-                    ("Ingresar valor manualmente", "Flete Incluido en el precio"),
-                    key="flete_option",
-                    horizontal=True
-                )
+                    opcion_flete = st.radio(
+                        "Elige una opción para el flete:",
+                        ("Ingresar valor manualmente", "Flete Incluido en el precio"),
+                        key="flete_option",
+                        horizontal=True
+                    )
 
-                costo_flete_str = "" 
+                    costo_flete_str = "" 
 
-                if opcion_flete == "Ingresar valor manualmente":
-                    costo_flete_str = "MANUAL"
-                    flete_text = st.text_input(
-                        "Valor del Flete",
-                        value=str(st.session_state.get('flete_val', 0)),
-                        help="Escribe solo números. Ej: 35000"
-                    )
-                    st.session_state.flete_val = parse_int_from_text(flete_text)
-                else:
-                    costo_flete_str = "INCLUIDO"
-                    st.session_state.flete_val = 0
+                    if opcion_flete == "Ingresar valor manualmente":
+                        costo_flete_str = "MANUAL"
+                        flete_text = st.text_input(
+                            "Valor del Flete",
+                            value=str(st.session_state.get('flete_val', 0)),
+                            help="Escribe solo números. Ej: 35000"
+                        )
+                        st.session_state.flete_val = parse_int_from_text(flete_text)
+                    else:
+                        costo_flete_str = "INCLUIDO"
+                        st.session_state.flete_val = 0
                 
-                total_cotizacion = subtotal + (st.session_state.flete_val or 0)
+                    total_cotizacion = subtotal + (st.session_state.flete_val or 0)
                 
-                t1, t2, t3 = st.columns(3)
-                t1.metric("SUBTOTAL", format_currency(subtotal))
+                    t1, t2, t3 = st.columns(3)
+                    t1.metric("SUBTOTAL", format_currency(subtotal))
                 
-                flete_display_val = "INCLUIDO" if opcion_flete == "Flete Incluido en el precio" else format_currency(st.session_state.flete_val)
-                t2.metric("FLETE", flete_display_val)
+                    flete_display_val = "INCLUIDO" if opcion_flete == "Flete Incluido en el precio" else format_currency(st.session_state.flete_val)
+                    t2.metric("FLETE", flete_display_val)
                 
-                t3.metric("TOTAL COTIZACION", format_currency(total_cotizacion))
+                    t3.metric("TOTAL COTIZACION", format_currency(total_cotizacion))
 
-                st.caption(f"Total de unidades: {total_unidades}")
+                    st.caption(f"Total de unidades: {total_unidades}")
                 
-                action_cols = st.columns(2)
+                    action_cols = st.columns(2)
                 
-                is_new_quote = not st.session_state.current_quote_id
-                save_button_label = "💾 Guardar como Nueva" if is_new_quote else "💾 Guardar Cambios"
-                if action_cols[0].button(save_button_label, use_container_width=True, type="primary"):
-                    if not st.session_state.cliente_nombre:
-                        st.warning("Por favor, introduce al menos el nombre del cliente.")
-                    else:
-                        quote_data_to_save = {
-                            'tienda': st.session_state.tienda_seleccionada,
-                            'fecha': st.session_state.fecha.strftime("%d/%m/%Y"),
-                            'cliente_nombre': st.session_state.cliente_nombre,
-                            'cliente_nit': st.session_state.cliente_nit,
-                            'cliente_ciudad': st.session_state.cliente_ciudad,
-                            'cliente_tel': st.session_state.cliente_tel,
-                            'cliente_email': st.session_state.cliente_email,
-                            'cliente_dir': st.session_state.cliente_dir,
-                            'forma_pago': st.session_state.forma_pago,
-                            'vigencia': st.session_state.vigencia,
-                            'items': st.session_state.quote_items,
-                            'numero_cotizacion': st.session_state.numero_cotizacion,
-                            'estado': st.session_state.estado,
-                            'comentarios': st.session_state.comentarios,
-                            'flete_val': int(st.session_state.flete_val)
-                        }
-                        if save_quote(db, quote_data_to_save, st.session_state.current_quote_id):
-                            if is_new_quote:
-                                clear_form_state()
-                                st.rerun()
-
-                pdf_data_dict = {
-                    'fecha': st.session_state.fecha.strftime("%d/%m/%Y"),
-                    'numero_cotizacion': st.session_state.numero_cotizacion or "N/A",
-                    'cliente_nombre': st.session_state.cliente_nombre,
-                    'cliente_nit': st.session_state.cliente_nit,
-                    'cliente_ciudad': st.session_state.cliente_ciudad,
-                    'cliente_tel': st.session_state.cliente_tel,
-                    'cliente_email': st.session_state.cliente_email,
-                    'cliente_dir': st.session_state.cliente_dir,
-                    'forma_pago': st.session_state.forma_pago,
-                    'vigencia': st.session_state.vigencia,
-                    'items': st.session_state.quote_items,
-                    'subtotal': subtotal,
-                    'flete_str': costo_flete_str,
-                    'flete_val': int(st.session_state.flete_val),
-                    'total_unidades': total_unidades,
-                    'total_cotizacion': total_cotizacion
-                }
-                pdf_bytes = generate_pdf_content(pdf_data_dict)
-                
-                file_name_cliente = st.session_state.cliente_nombre.replace(' ', '_') if st.session_state.cliente_nombre else 'General'
-                file_name_cot = st.session_state.numero_cotizacion or "NUEVA"
+                    is_new_quote = not st.session_state.current_quote_id
+                    save_button_label = "💾 Guardar como Nueva" if is_new_quote else "💾 Guardar Cambios"
+                    if action_cols[0].button(save_button_label, use_container_width=True, type="primary"):
+                        if not st.session_state.cliente_nombre:
+                            st.warning("Por favor, introduce al menos el nombre del cliente.")
+                        else:
+                            quote_data_to_save = {
+                                'tienda': st.session_state.tienda_seleccionada,
+                                'fecha': st.session_state.fecha.strftime("%d/%m/%Y"),
+                                'cliente_nombre': st.session_state.cliente_nombre,
+                                'cliente_nit': st.session_state.cliente_nit,
+                                'cliente_ciudad': st.session_state.cliente_ciudad,
+                                'cliente_tel': st.session_state.cliente_tel,
+                                'cliente_email': st.session_state.cliente_email,
+                                'cliente_dir': st.session_state.cliente_dir,
+                                'forma_pago': st.session_state.forma_pago,
+                                'vigencia': st.session_state.vigencia,
+                                'items': st.session_state.quote_items,
+                                'numero_cotizacion': st.session_state.numero_cotizacion,
+                                'estado': st.session_state.estado,
+                                'comentarios': st.session_state.comentarios,
+                                'flete_val': int(st.session_state.flete_val)
+                            }
+                            if save_quote(db, quote_data_to_save, st.session_state.current_quote_id):
+                                if is_new_quote:
+                                    clear_form_state()
+                                    st.rerun()
+
+                    pdf_data_dict = {
+                        'fecha': st.session_state.fecha.strftime("%d/%m/%Y"),
+                        'numero_cotizacion': st.session_state.numero_cotizacion or "N/A",
+                        'cliente_nombre': st.session_state.cliente_nombre,
+                        'cliente_nit': st.session_state.cliente_nit,
+                        'cliente_ciudad': st.session_state.cliente_ciudad,
+                        'cliente_tel': st.session_state.cliente_tel,
+                        'cliente_email': st.session_state.cliente_email,
+                        'cliente_dir': st.session_state.cliente_dir,
+                        'forma_pago': st.session_state.forma_pago,
+                        'vigencia': st.session_state.vigencia,
+                        # Copia de los ítems: el PDF se genera después, al hacer clic en descargar
+                        'items': {key: dict(item) for key, item in st.session_state.quote_items.items()},
+                        'subtotal': subtotal,
+                        'flete_str': costo_flete_str,
+                        'flete_val': int(st.session_state.flete_val),
+                        'total_unidades': total_unidades,
+                        'total_cotizacion': total_cotizacion
+                    }
+                    pdf_cache = get_pdf_cache()
+                    failed_images = [st.session_state.quote_items[key]['nombre'] for key, (_, status) in quote_images.items() if status == 'error']
+                    if failed_images:
+                        st.caption(f"⚠️ Sin imagen en el PDF (no se pudo descargar): {', '.join(failed_images)}")
                 
-                action_cols[1].download_button(
-                    label="📄 Generar PDF",
-                    data=pdf_bytes,
-                    file_name=f"Cotizacion_{file_name_cot}_{file_name_cliente}.pdf",
-                    mime="application/pdf",
-                    use_container_width=True
-                )
-
-    # --- PESTAÑA DE SEGUIMIENTO ---
-    with tab2:
-        st.header(f"Seguimiento de Cotizaciones - {st.session_state.tienda_seleccionada}")
+                    action_cols[1].download_button(
+                        label="📄 Generar PDF",
+                        # Se genera solo al hacer clic, y se reutiliza si la cotización no cambió
+                        data=lambda: get_quote_pdf(pdf_data_dict, quote_images, pdf_cache),
+                        file_name=quote_pdf_filename(st.session_state.numero_cotizacion, st.session_state.cliente_nombre),
+                        mime="application/pdf",
+                        use_container_width=True
+                    )
 
-        if db:
-            tracking_data = get_all_quotes_for_tracking(db, st.session_state.tienda_seleccionada)
-            if not tracking_data:
-                st.info("No hay cotizaciones para mostrar en esta tienda.")
-            else:
-                df = pd.DataFrame(tracking_data)
-                
-                if 'original_df' not in st.session_state:
-                    st.session_state.original_df = df.set_index('id').copy()
+        # --- PESTAÑA DE SEGUIMIENTO ---
+        with tab2:
+            st.header(f"Seguimiento de Cotizaciones - {st.session_state.tienda_seleccionada}")
 
-                st.info("Puedes editar los campos 'Estado' y 'Comentarios' directamente en la tabla. Luego presiona 'Guardar Cambios'.")
-                
-                edited_df = st.data_editor(
-                    df,
-                    column_config={
-                        "id": None,
-                        "N° Cotización": st.column_config.TextColumn(disabled=True),
-                        "Fecha": st.column_config.TextColumn(disabled=True),
-                        "Cliente": st.column_config.TextColumn(disabled=True),
-                        "Total": st.column_config.NumberColumn("Total", format="$ %d", disabled=True),
-                        "Estado": st.column_config.SelectboxColumn(
-                            "Estado",
-                            options=["🔵 Creada", "✉️ Enviada", "✅ Aprobada", "❌ Rechazada", "🧾 Facturada"],
-                            required=True,
-                        ),
-                        "Comentarios": st.column_config.TextColumn(width="large")
-                    },
-                    use_container_width=True,
-                    hide_index=True,
-                    key="tracking_editor"
+            if db:
+                pending = count_quotes_pending_migration(db, st.session_state.tienda_seleccionada)
+                if pending:
+                    st.warning(f"{pending} cotizaciones antiguas no aparecen aquí (o sin total) hasta correr `python migrar_cotizaciones.py`.")
+
+                filter_cols = st.columns([2, 2, 2, 1])
+                filtro_estado = filter_cols[0].selectbox("Estado", ["Todos"] + ESTADOS_COTIZACION, key="tracking_estado")
+                filtro_rango = filter_cols[1].date_input("Rango de fechas", value=(), format="DD/MM/YYYY", key="tracking_rango")
+                filtro_cliente = filter_cols[2].text_input("Cliente", key="tracking_cliente", placeholder="Nombre del cliente")
+                page_size = filter_cols[3].selectbox("Por página", TRACKING_PAGE_SIZES, key="tracking_page_size")
+
+                tracking_query = (filtro_estado, tuple(filtro_rango), filtro_cliente.strip(), page_size)
+                if st.session_state.get('tracking_query') != tracking_query:
+                    # Filtros nuevos: se vuelve a la primera página
+                    st.session_state.tracking_query = tracking_query
+                    st.session_state.tracking_cursors = [None]
+
+                page = len(st.session_state.tracking_cursors) - 1
+                tracking_data, tracking_versions, next_cursor = get_tracking_page(
+                    db, st.session_state.tienda_seleccionada, page_size,
+                    cursor=st.session_state.tracking_cursors[-1],
+                    estado=None if filtro_estado == "Todos" else filtro_estado,
+                    fecha_desde=filtro_rango[0] if len(filtro_rango) > 0 else None,
+                    fecha_hasta=filtro_rango[1] if len(filtro_rango) > 1 else (filtro_rango[0] if filtro_rango else None),
+                    cliente=filtro_cliente.strip()
                 )
 
-                if st.button("💾 Guardar Cambios de Seguimiento", type="primary"):
-                    changes_to_update = {}
-                    original_df_reindexed = st.session_state.original_df.reset_index()
+                nav_cols = st.columns([1, 2, 1])
+                if nav_cols[0].button("⬅️ Anterior", disabled=page == 0, use_container_width=True):
+                    st.session_state.tracking_cursors.pop()
+                    st.rerun()
+                nav_cols[1].markdown(f"<div style='text-align: center'>Página {page + 1}</div>", unsafe_allow_html=True)
+                if nav_cols[2].button("Siguiente ➡️", disabled=next_cursor is None, use_container_width=True):
+                    st.session_state.tracking_cursors.append(next_cursor)
+                    st.rerun()
 
-                    for i, row in edited_df.iterrows():
-                        try:
-                            original_row = original_df_reindexed.iloc[i]
-                            doc_id = original_row['id']
-                            
-                            if row['Estado'] != original_row['Estado'] or row['Comentarios'] != original_row['Comentarios']:
-                                changes_to_update[doc_id] = {
-                                    'estado': row['Estado'],
-                                    'comentarios': row['Comentarios']
-                                }
-                        except IndexError:
-                            continue
-                    
-                    if changes_to_update:
-                        update_quotes_tracking(db, changes_to_update)
-                        st.cache_data.clear()
-                        if 'original_df' in st.session_state:
-                            del st.session_state.original_df
-                        st.rerun()
-                    else:
-                        st.toast("No se detectaron cambios para guardar.")
+                if not tracking_data:
+                    st.info("No hay cotizaciones para mostrar con estos filtros.")
+                else:
+                    df = pd.DataFrame(tracking_data)
+
+                    # La comparación al guardar es contra la página que se está viendo
+                    tracking_page_key = (tracking_query, page)
+                    if st.session_state.get('original_df_key') != tracking_page_key or 'original_df' not in st.session_state:
+                        st.session_state.original_df = df.set_index('id').copy()
+                        st.session_state.original_versions = tracking_versions
+                        st.session_state.original_df_key = tracking_page_key
+
+                    st.info("Puedes editar los campos 'Estado' y 'Comentarios' directamente en la tabla. Luego presiona 'Guardar Cambios'.")
+
+                    save_result = st.session_state.pop('tracking_save_result', None)
+                    if save_result:
+                        if save_result['saved']:
+                            st.success(f"¡Seguimiento actualizado! {save_result['saved']} cotizaciones guardadas.")
+                        if save_result['failures']:
+                            st.error(f"No se guardaron {len(save_result['failures'])} cotizaciones; vuelve a aplicar esos cambios:")
+                            st.dataframe(pd.DataFrame(save_result['failures'], columns=["N° Cotización", "Error"]), hide_index=True)
+                
+                    edited_df = st.data_editor(
+                        df,
+                        column_config={
+                            "id": None,
+                            "N° Cotización": st.column_config.TextColumn(disabled=True),
+                            "Fecha": st.column_config.TextColumn(disabled=True),
+                            "Cliente": st.column_config.TextColumn(disabled=True),
+                            "Total": st.column_config.NumberColumn("Total", format="$ %d", disabled=True),
+                            "Estado": st.column_config.SelectboxColumn(
+                                "Estado",
+                                options=ESTADOS_COTIZACION,
+                                required=True,
+                            ),
+                            "Comentarios": st.column_config.TextColumn(width="large")
+                        },
+                        use_container_width=True,
+                        hide_index=True,
+                        key=f"tracking_editor_{hash(tracking_page_key)}"
+                    )
+
+                    if st.button("💾 Guardar Cambios de Seguimiento", type="primary"):
+                        changes_to_update = diff_tracking_changes(st.session_state.original_df, edited_df)
+                        if changes_to_update:
+                            saved, failures = update_quotes_tracking(
+                                db, changes_to_update, st.session_state.tienda_seleccionada,
+                                versions=st.session_state.get('original_versions')
+                            )
+                            numeros = st.session_state.original_df['N° Cotización']
+                            st.session_state.tracking_save_result = {
+                                'saved': len(saved),
+                                'failures': [(numeros.get(doc_id, doc_id), error) for doc_id, error in failures.items()]
+                            }
+                            if 'original_df' in st.session_state:
+                                del st.session_state.original_df
+                            st.rerun()
+                        else:
+                            st.toast("No se detectaron cambios para guardar.")
+
+                with st.expander("📦 Exportar PDFs en lote"):
+                    st.caption("Regenera con el formato actual los PDF de las cotizaciones de la tienda y los entrega en un ZIP.")
+                    export_cols = st.columns(2)
+                    export_estado = export_cols[0].selectbox("Estado", ["Todos"] + ESTADOS_COTIZACION, key="export_estado")
+                    export_rango = export_cols[1].date_input("Rango de fechas (opcional)", value=(), format="DD/MM/YYYY", key="export_rango")
+                    if st.button("📦 Generar ZIP de PDFs"):
+                        fecha_desde = export_rango[0] if len(export_rango) > 0 else None
+                        fecha_hasta = export_rango[1] if len(export_rango) > 1 else fecha_desde
+                        quotes_to_export = get_quotes_for_export(
+                            db, st.session_state.tienda_seleccionada,
+                            None if export_estado == "Todos" else export_estado,
+                            fecha_desde, fecha_hasta
+                        )
+                        if not quotes_to_export:
+                            st.info("No hay cotizaciones con esos filtros.")
+                        else:
+                            export_bar = st.progress(0, text="Generando PDFs...")
+                            zip_buffer = BytesIO()
+                            export_jobs, failures = build_export_jobs(quotes_to_export)
+                            exported, pdf_failures = export_quotes_zip(
+                                export_jobs, zip_buffer, resolve_images=prefetch_quote_images,
+                                on_progress=lambda done, total: export_bar.progress(done / total, text=f"Generando PDFs: {done} de {total}")
+                            )
+                            failures.update(pdf_failures)
+                            export_bar.empty()
+                            st.session_state.export_zip = zip_buffer.getvalue()
+                            st.success(f"✅ {exported} PDF generados.")
+                            if failures:
+                                st.error(f"No se pudieron generar {len(failures)} PDF:")
+                                st.dataframe(pd.DataFrame(list(failures.items()), columns=["Archivo", "Error"]), hide_index=True)
+                    if st.session_state.get('export_zip'):
+                        st.download_button(
+                            "⬇️ Descargar ZIP",
+                            data=st.session_state.export_zip,
+                            file_name=f"Cotizaciones_{st.session_state.tienda_seleccionada}_{date.today():%Y%m%d}.zip",
+                            mime="application/zip"
+                        )
+
+if __name__ == "__main__":
+    # Solo al correr con `streamlit run`; al importarse (exportación, procesos del pool) no se dibuja la UI
+    with perf_recorder.rerun(get_session_perf_trace(), label=st.session_state.get('tienda_seleccionada')):
+        main()
@@ -0,0 +1,279 @@
+"""Micro-benchmarks de los caminos críticos: catálogo, búsqueda, PDF y Seguimiento.
+
+Corren sin red: el catálogo de ejemplo (wix_products_raw.json) se replica y lo
+sirve un Wix falso por HTTP local, las imágenes salen de un host falso y
+Firestore es un cliente en memoria (ver benchmarks/fakes.py). Cada etapa
+reporta la mediana del tiempo y la memoria pico de Python (tracemalloc, no
+incluye los búferes de Arrow), y se compara
+contra benchmarks/baseline.json:
+
+    python benchmarks/bench_cotizaciones.py --recursos-pdf ruta/a/fuentes_y_logo
+    python benchmarks/bench_cotizaciones.py --productos 100000
+    python benchmarks/bench_cotizaciones.py --guardar-baseline
+
+Sale con código 1 si alguna etapa empeora más que la tolerancia. La línea base
+depende de la máquina: guárdala en la misma donde se va a comparar.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from fakes import FakeFirestore, FakeImageHost, FakeWixServer, replicate_wix_products  # noqa: E402
+import pdf_cotizaciones  # noqa: E402
+
+RAW_PRODUCTS_PATH = os.path.join(ROOT_DIR, 'wix_products_raw.json')
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+OUTPUT_PATH = os.path.join(ROOT_DIR, 'bench_output.txt')
+QUOTE_SIZES = [1, 50, 500]
+TRACKING_QUOTES = 5000
+SEARCH_QUERIES = ['carro montable', 'rojo', 'ninos 12', 'libro', '1000', 'montable azul 3']
+REQUEST_SAMPLE_PATH = os.path.join(ROOT_DIR, 'ejemplo_solicitudes', 'elementos festivales INDER  Medellín (1).xlsx')
+REQUEST_LINES = 300
+# Por debajo de estas diferencias no se reporta regresión (ruido de medición)
+MIN_TIME_DELTA_S = 0.005
+MIN_MEMORY_DELTA_MB = 1
+
+
+def measure(fn, repeat, setup=None):
+    """Corre `fn(setup())` `repeat` veces y una más con tracemalloc. Devuelve (mediana s, pico MB)."""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    arg = setup() if setup else None
+    tracemalloc.start()
+    try:
+        fn(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statistics.median(times), peak / 2**20
+
+
+class Suite:
+    def __init__(self, repeat, stages_filter=None):
+        self.repeat = repeat
+        self.stages_filter = stages_filter
+        self.results = {}
+
+    def run(self, name, fn, setup=None, repeat=None):
+        if self.stages_filter and not any(part in name for part in self.stages_filter):
+            return
+        elapsed, peak_mb = measure(fn, repeat or self.repeat, setup)
+        self.results[name] = {'tiempo_s': round(elapsed, 6), 'memoria_mb': round(peak_mb, 3)}
+        print(f"  {name:<38} {elapsed * 1000:>10.1f} ms {peak_mb:>10.1f} MB", flush=True)
+
+
+def synthetic_quote(catalog, size):
+    """Cotización con `size` productos del catálogo (nombres de largo variable)."""
+    rows = catalog.iloc[:size]
+    items = {}
+    for i, row in enumerate(rows.itertuples()):
+        items[row.sku] = {
+            'nombre': row.nombre + (" edición coleccionista con accesorios" * (i % 3)),
+            'sku': row.sku,
+            'cantidad': 1 + i % 5,
+            'precio_unitario': row.precio_centavos / 100,
+            'valor_total': row.precio_centavos / 100 * (1 + i % 5),
+            'imagen_url': row.imagen_url,
+        }
+    subtotal = sum(item['valor_total'] for item in items.values())
+    return {
+        'fecha': '18/10/2026', 'numero_cotizacion': 'OV-0001', 'cliente_nombre': 'Colegio San José',
+        'cliente_nit': '900123456', 'cliente_ciudad': 'Bogotá', 'cliente_tel': '3000000000',
+        'cliente_email': 'compras@example.com', 'cliente_dir': 'Calle 1 # 2-3',
+        'forma_pago': 'Transferencia bancaria (pago anticipado)', 'vigencia': '5 DÍAS HÁBILES',
+        'items': items, 'subtotal': subtotal, 'flete_str': 'INCLUIDO', 'flete_val': 0,
+        'total_unidades': sum(item['cantidad'] for item in items.values()), 'total_cotizacion': subtotal,
+    }
+
+
+def bench_catalog(app, suite, products, image_url, workdir):
+    print("Catálogo")
+    with FakeWixServer(replicate_wix_products(products['raw'], products['count'], image_url)) as wix:
+        app.WIX_PRODUCTS_URL = wix.products_url
+        headers = {'Authorization': 'bench', 'wix-site-id': 'bench', 'Content-Type': 'application/json'}
+        suite.run('catalogo.descarga_wix', lambda _: app.download_wix_catalog(headers, app.WIX_MAX_WORKERS), repeat=1)
+        catalog = app.download_wix_catalog(headers, app.WIX_MAX_WORKERS)
+
+    snapshot_path = os.path.join(workdir, 'catalogo.arrow')
+    suite.run('catalogo.snapshot_guardar', lambda _: app.save_catalog_snapshot(catalog, snapshot_path))
+    app.save_catalog_snapshot(catalog, snapshot_path)
+    suite.run('catalogo.snapshot_cargar', lambda _: app.load_catalog_snapshot(snapshot_path))
+    suite.run('catalogo.indice_sku', lambda _: app.SkuIndex(catalog))
+    suite.run('catalogo.indice_busqueda', lambda _: app.ProductSearchIndex(catalog))
+    search_index = app.ProductSearchIndex(catalog)
+    suite.run('busqueda.consultas_x100', lambda _: [search_index.search(q) for _ in range(100 // len(SEARCH_QUERIES) + 1)
+                                                     for q in SEARCH_QUERIES])
+
+    shared = app.SharedCatalog(catalog, time.time(), 1)
+    suite.run('importacion.indice_nombres', lambda _: app.ProductNameMatcher(catalog))
+    with open(REQUEST_SAMPLE_PATH, 'rb') as f:
+        grid = app.read_request_grid(f.read(), REQUEST_SAMPLE_PATH)
+    header_row, columns = app.detect_request_columns(grid, shared.sku_index)
+    lines = app.build_request_lines(grid, header_row, columns)
+    lines = pd.concat([lines] * (REQUEST_LINES // len(lines) + 1), ignore_index=True).iloc[:REQUEST_LINES]
+    shared.name_matcher
+    suite.run(f'importacion.emparejar_{REQUEST_LINES}', lambda _: app.match_request_lines(lines, shared))
+    return catalog
+
+
+def bench_pdf(app, suite, catalog, assets_dir, workdir):
+    print("PDF")
+    try:
+        assets = pdf_cotizaciones.PdfAssets(
+            font_files={style: os.path.join(assets_dir, path) for style, path in pdf_cotizaciones.PDF_FONT_FILES.items()},
+            logo_path=os.path.join(assets_dir, pdf_cotizaciones.PDF_LOGO_PATH),
+        )
+    except FileNotFoundError as e:
+        print(f"  (se omite: {e}; usa --recursos-pdf)")
+        return
+
+    cache_dirs = iter(range(10**6))
+
+    def cold_cache():
+        return app.ImageCache(directory=os.path.join(workdir, f"imagenes_{next(cache_dirs)}"))
+
+    for size in QUOTE_SIZES:
+        quote = synthetic_quote(catalog, size)
+        suite.run(f'pdf.imagenes_frias_{size}', lambda cache: app.prefetch_quote_images(quote['items'], image_cache=cache),
+                  setup=cold_cache, repeat=1)
+        images = app.prefetch_quote_images(quote['items'], image_cache=cold_cache())
+
+        def layout(_):
+            pdf = pdf_cotizaciones.PDF('P', 'mm', 'A4', assets=assets)
+            pdf.add_page()
+            pdf.layout_table(quote['items'], pdf_cotizaciones.PDF_TABLE_COL_WIDTHS, pdf_cotizaciones.PDF_TABLE_ROWS_Y)
+        suite.run(f'pdf.medicion_{size}', layout)
+        suite.run(f'pdf.generar_{size}', lambda _: pdf_cotizaciones.generate_pdf_content(quote, images=images, assets=assets))
+
+
+def bench_tracking(app, suite):
+    print("Seguimiento")
+    fake_db = FakeFirestore()
+    quotes = []
+    for i in range(TRACKING_QUOTES):
+        items = {str(n): {'nombre': f"Producto {n}", 'sku': str(n), 'cantidad': 2, 'precio_unitario': 1000,
+                          'valor_total': 2000, 'imagen_url': ''} for n in range(1 + i % 20)}
+        quote = {
+            'tienda': 'Oviedo', 'fecha': f"{1 + i % 28:02d}/{1 + i % 12:02d}/2026",
+            'numero_cotizacion': f"OV-{i:04d}", 'cliente_nombre': f"Cliente {i % 300} Ñandú",
+            'estado': app.ESTADOS_COTIZACION[i % len(app.ESTADOS_COTIZACION)], 'comentarios': '',
+            'items': items, 'flete_val': 0,
+        }
+        quote.update(app.quote_derived_fields(quote))
+        quotes.append(quote)
+    fake_db.load('cotizaciones', quotes)
+
+    suite.run('seguimiento.pagina_100', lambda _: app.get_tracking_page(fake_db, 'Oviedo', 100))
+    suite.run('seguimiento.pagina_filtrada', lambda _: app.get_tracking_page(
+        fake_db, 'Oviedo', 100, estado=app.ESTADOS_COTIZACION[2], cliente='cliente nand'))
+
+    def mirror_load(_):
+        mirror = app.QuoteMirror(fake_db, 'Oviedo')
+        mirror.wait_ready()
+        mirror.close()
+    suite.run('seguimiento.espejo_carga', mirror_load)
+
+    rows, versions, _ = app.get_tracking_page(fake_db, 'Oviedo', 100)
+    original = pd.DataFrame(rows).set_index('id')
+    edited = pd.DataFrame(rows).sample(frac=1, random_state=1)
+    edited.loc[edited.index[:50], 'Estado'] = app.ESTADOS_COTIZACION[-1]
+    suite.run('seguimiento.diff_100', lambda _: app.diff_tracking_changes(original, edited))
+
+    changes = app.diff_tracking_changes(original, edited)
+    suite.run('seguimiento.guardar_50', lambda _: app.commit_quote_updates(fake_db, changes), repeat=1)
+
+
+def compare(results, baseline, tolerance):
+    """Líneas del reporte contra la línea base y lista de regresiones."""
+    lines, regressions = [], []
+    for name, current in results.items():
+        base = baseline.get('etapas', {}).get(name)
+        if not base:
+            lines.append(f"  {name:<38} (sin línea base)")
+            continue
+        time_ratio = current['tiempo_s'] / base['tiempo_s'] if base['tiempo_s'] else 1
+        memory_ratio = current['memoria_mb'] / base['memoria_mb'] if base['memoria_mb'] else 1
+        flags = []
+        if time_ratio > 1 + tolerance and current['tiempo_s'] - base['tiempo_s'] > MIN_TIME_DELTA_S:
+            flags.append('TIEMPO')
+        if memory_ratio > 1 + tolerance and current['memoria_mb'] - base['memoria_mb'] > MIN_MEMORY_DELTA_MB:
+            flags.append('MEMORIA')
+        if flags:
+            regressions.append(name)
+        lines.append(f"  {name:<38} tiempo x{time_ratio:.2f}  memoria x{memory_ratio:.2f}"
+                     + (f"  ⚠️ {'/'.join(flags)}" if flags else ""))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks offline de la app de cotizaciones.")
+    parser.add_argument('--productos', type=int, default=10000, help="Tamaño del catálogo replicado (ej. 10000, 100000)")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Corridas por etapa (se reporta la mediana)")
+    parser.add_argument('--recursos-pdf', default=ROOT_DIR, help="Carpeta con las fuentes Lato y el logo")
+    parser.add_argument('--etapas', nargs='*', help="Solo las etapas que contengan alguno de estos textos")
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="Empeoramiento tolerado (0.25 = 25%%)")
+    parser.add_argument('--guardar-baseline', action='store_true', help="Guarda estos resultados como línea base")
+    args = parser.parse_args(argv)
+
+    # Importada fuera de `streamlit run`, la app avisa en cada llamada a Streamlit
+    import streamlit.logger
+    streamlit.logger.set_log_level('error')
+    import app_cotizaciones as app
+    logging.getLogger(app.__name__).setLevel(logging.ERROR)
+
+    with open(RAW_PRODUCTS_PATH, encoding='utf-8') as f:
+        raw_products = json.load(f)
+
+    suite = Suite(args.repeticiones, args.etapas)
+    print(f"{'etapa':<40} {'mediana':>13} {'pico':>13}")
+    with tempfile.TemporaryDirectory() as workdir, FakeImageHost() as image_host:
+        catalog = bench_catalog(app, suite, {'raw': raw_products, 'count': args.productos}, image_host.url, workdir)
+        bench_pdf(app, suite, catalog, args.recursos_pdf, workdir)
+        bench_tracking(app, suite)
+
+    meta = {'productos': args.productos, 'python': platform.python_version(),
+            'fecha': time.strftime('%Y-%m-%d %H:%M')}
+    report = [f"Benchmarks {meta['fecha']} ({args.productos} productos)"]
+    report += [f"  {name:<38} {r['tiempo_s'] * 1000:>10.1f} ms {r['memoria_mb']:>10.1f} MB" for name, r in suite.results.items()]
+
+    regressions = []
+    if args.guardar_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'meta': meta, 'etapas': suite.results}, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+        print(f"Línea base guardada en {BASELINE_PATH}")
+    elif os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('meta', {}).get('productos') != args.productos:
+            print(f"⚠️ La línea base es de {baseline['meta'].get('productos')} productos; el catálogo no es comparable.")
+        lines, regressions = compare(suite.results, baseline, args.tolerancia)
+        report += ["", f"Contra la línea base ({baseline.get('meta', {}).get('fecha', '?')}):"] + lines
+        print("\n".join(report[-len(lines) - 1:]))
+
+    with open(OUTPUT_PATH, 'w', encoding='utf-8') as f:
+        f.write("\n".join(report) + "\n")
+    if regressions:
+        print(f"❌ Regresiones en: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
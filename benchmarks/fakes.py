@@ -0,0 +1,451 @@
+"""Dobles locales para correr los benchmarks sin red: Wix, host de imágenes y Firestore.
+
+Wix y el host de imágenes son servidores HTTP de verdad (en 127.0.0.1, en un
+hilo), así que el código de la app hace las mismas llamadas con `requests`.
+Firestore se reemplaza por un cliente en memoria con la parte de la API que
+usa la app (consultas, lotes, transacciones, precondiciones y listeners).
+"""
+import copy
+import itertools
+import json
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from google.api_core.exceptions import Aborted, FailedPrecondition, NotFound
+from PIL import Image
+
+
+# --- SERVIDORES HTTP ---
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _BackgroundServer:
+    """Servidor HTTP en un hilo; se usa como context manager."""
+    handler = None
+
+    def __enter__(self):
+        outer = self
+
+        class Handler(self.handler):
+            server_state = outer
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def replicate_wix_products(raw_products, count, image_base_url):
+    """Replica los productos crudos de ejemplo hasta `count`, con SKU, id e imagen únicos."""
+    products = []
+    for i in range(count):
+        product = copy.deepcopy(raw_products[i % len(raw_products)])
+        product['id'] = f"bench-{i:06d}"
+        product['sku'] = str(100000 + i)
+        product['name'] = f"{product.get('name', 'Producto')} {i}"
+        product['lastUpdated'] = f"2026-01-01T00:00:00.{i % 1000:03d}Z"
+        product.setdefault('media', {}).setdefault('mainMedia', {}).setdefault('image', {})
+        product['media']['mainMedia']['image']['url'] = f"{image_base_url}/{i}.jpg"
+        products.append(product)
+    return products
+
+
+class _WixHandler(_QuietHandler):
+    def do_POST(self):
+        state = self.server_state
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        query = payload.get('query', {})
+        paging = query.get('paging', {})
+        offset, limit = paging.get('offset', 0), paging.get('limit', 100)
+        encoded = state.encoded
+        if query.get('filter'):
+            since = json.loads(query['filter']).get('lastUpdated', {}).get('$gt', '')
+            encoded = [e for e, p in zip(state.encoded, state.products) if p.get('lastUpdated', '') > since]
+        state.requests += 1
+        body = b'{"products":[' + b','.join(encoded[offset:offset + limit]) + \
+            b'],"totalResults":' + str(len(encoded)).encode() + b'}'
+        self._send(200, body, 'application/json')
+
+
+class FakeWixServer(_BackgroundServer):
+    """API de productos de Wix (`/stores/v1/products/query`) sobre una lista en memoria."""
+    handler = _WixHandler
+
+    def __init__(self, products):
+        self.products = products
+        # Cada producto se serializa una sola vez: el servidor no debe pesar en la medición
+        self.encoded = [json.dumps(p, ensure_ascii=False).encode() for p in products]
+        self.requests = 0
+
+    @property
+    def products_url(self):
+        return f"{self.url}/stores/v1/products/query"
+
+
+class _ImageHandler(_QuietHandler):
+    def do_GET(self):
+        state = self.server_state
+        name = self.path.rsplit('/', 1)[-1].split('.')[0]
+        if not name.isdigit():
+            self._send(404, b'not found', 'text/plain')
+            return
+        state.requests += 1
+        self._send(200, state.images[int(name) % len(state.images)], 'image/jpeg')
+
+
+class FakeImageHost(_BackgroundServer):
+    """Sirve `/<n>.jpg` con fotos sintéticas del tamaño típico de Wix."""
+    handler = _ImageHandler
+
+    def __init__(self, variants=16, size=1000):
+        self.images = [self._make_image(seed, size) for seed in range(variants)]
+        self.requests = 0
+
+    @staticmethod
+    def _make_image(seed, size):
+        img = Image.radial_gradient('L').resize((size, size))
+        img = Image.merge('RGB', (img, img.rotate(seed * 20), Image.effect_noise((size, size), 40 + seed)))
+        out = BytesIO()
+        img.save(out, format='JPEG', quality=90)
+        return out.getvalue()
+
+
+# --- FIRESTORE EN MEMORIA ---
+class FakeSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class _ChangeType:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Change:
+    def __init__(self, name, document):
+        self.type = _ChangeType(name)
+        self.document = document
+
+
+_OPERATORS = {
+    '==': lambda value, target: value == target,
+    '>=': lambda value, target: value is not None and value >= target,
+    '<=': lambda value, target: value is not None and value <= target,
+    '>': lambda value, target: value is not None and value > target,
+    '<': lambda value, target: value is not None and value < target,
+    'array_contains': lambda value, target: target in (value or []),
+}
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=(), orders=(), limit=None, start_after=None, fields=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     start_after=self._start_after, fields=self._fields)
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(start_after=snapshot)
+
+    def select(self, fields):
+        return self._copy(fields=list(fields))
+
+    def _descending(self, direction):
+        return str(direction).upper().startswith('DESC')
+
+    def _matching(self):
+        docs = self._collection._docs
+        matches = [(doc_id, data) for doc_id, data in docs.items()
+                   if all(_OPERATORS[op](data.get(field), value) for field, op, value in self._filters)]
+        for field, _ in self._orders:
+            # Como en Firestore, ordenar por un campo excluye los documentos que no lo tienen
+            matches = [(doc_id, data) for doc_id, data in matches if field in data]
+        # Desempate implícito por id, en el sentido del último order_by
+        matches.sort(key=lambda match: match[0], reverse=bool(self._orders) and self._descending(self._orders[-1][1]))
+        for field, direction in reversed(self._orders):
+            matches.sort(key=lambda match: match[1][field], reverse=self._descending(direction))
+        return matches
+
+    def _cursor_key(self, snapshot):
+        """Valores del cursor como los arma Firestore: campos del order_by y luego el id."""
+        data = snapshot.to_dict() or {}
+        for field, _ in self._orders:
+            if field not in data:
+                raise ValueError(f"The order-by field '{field}' is not in the cursor data")
+        return [data[field] for field, _ in self._orders], snapshot.id
+
+    def _is_after(self, doc_id, data, cursor_values, cursor_id):
+        for (field, direction), cursor_value in zip(self._orders, cursor_values):
+            if data[field] != cursor_value:
+                return (data[field] < cursor_value) if self._descending(direction) else (data[field] > cursor_value)
+        if self._orders and self._descending(self._orders[-1][1]):
+            return doc_id < cursor_id
+        return doc_id > cursor_id
+
+    def stream(self):
+        matches = self._matching()
+        if self._start_after is not None:
+            cursor_values, cursor_id = self._cursor_key(self._start_after)
+            matches = [(doc_id, data) for doc_id, data in matches
+                       if self._is_after(doc_id, data, cursor_values, cursor_id)]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        client = self._collection._client
+        for doc_id, data in matches:
+            client.document_reads += 1
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield FakeSnapshot(self._collection.document(doc_id), data, self._collection._update_times[doc_id])
+
+    def get(self):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        watch = FakeWatch(self, callback)
+        self._collection._client._watches.append(watch)
+        watch.notify()
+        return watch
+
+
+class FakeWatch:
+    def __init__(self, query, callback):
+        self._query = query
+        self._callback = callback
+        self._seen = {}
+        self.is_active = True
+
+    def notify(self):
+        if not self.is_active:
+            return
+        docs = {snapshot.id: snapshot for snapshot in self._query.stream()}
+        changes = [_Change('ADDED' if doc_id not in self._seen else 'MODIFIED', snapshot)
+                   for doc_id, snapshot in docs.items()
+                   if self._seen.get(doc_id) != snapshot.update_time]
+        changes += [_Change('REMOVED', FakeSnapshot(self._query._collection.document(doc_id), None, None))
+                    for doc_id in self._seen if doc_id not in docs]
+        first = not self._seen and not changes
+        self._seen = {doc_id: snapshot.update_time for doc_id, snapshot in docs.items()}
+        if changes or first:
+            self._callback(list(docs.values()), changes, datetime.now(timezone.utc))
+
+    def unsubscribe(self):
+        self.is_active = False
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self, transaction=None):
+        with self._collection._client._lock:
+            self._collection._client.document_reads += 1
+            update_time = self._collection._update_times.get(self.id)
+            if transaction is not None:
+                transaction._reads.append((self, update_time))
+            return FakeSnapshot(self, copy.deepcopy(self._collection._docs.get(self.id)), update_time)
+
+    def _check(self, option):
+        if option is not None and self._collection._update_times.get(self.id) != option.last_update_time:
+            raise FailedPrecondition(f"El documento {self.id} cambió")
+
+    def set(self, data, merge=False):
+        current = self._collection._docs.get(self.id) if merge else None
+        self._collection._write(self.id, {**(current or {}), **copy.deepcopy(data)})
+
+    def update(self, data, option=None, notify=True):
+        if self.id not in self._collection._docs:
+            raise NotFound(f"No existe el documento {self.id}")
+        self._check(option)
+        self._collection._write(self.id, {**self._collection._docs[self.id], **copy.deepcopy(data)}, notify)
+
+    def delete(self):
+        self._collection._write(self.id, None)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(self)
+        self._client = client
+        self.name = name
+        self._docs = {}
+        self._update_times = {}
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self, doc_id or f"doc{next(self._client._ids):08d}")
+
+    def add(self, data):
+        reference = self.document()
+        reference.set(data)
+        return self._client._now(), reference
+
+    def _write(self, doc_id, data, notify=True):
+        self._client.document_writes += 1
+        if data is None:
+            self._docs.pop(doc_id, None)
+            self._update_times.pop(doc_id, None)
+        else:
+            self._docs[doc_id] = data
+            self._update_times[doc_id] = self._client._now()
+        if notify:
+            self._client._notify()
+
+
+class FakeWriteOption:
+    def __init__(self, last_update_time):
+        self.last_update_time = last_update_time
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def update(self, reference, data, option=None):
+        self._ops.append((reference, data, option))
+
+    def commit(self):
+        if len(self._ops) > 500:
+            raise ValueError("Un lote admite como máximo 500 escrituras")
+        # Atómico: se validan todas las precondiciones antes de escribir
+        for reference, _, option in self._ops:
+            if reference.id not in reference._collection._docs:
+                raise NotFound(f"No existe el documento {reference.id}")
+            reference._check(option)
+        self._client.batch_commits += 1
+        for reference, data, option in self._ops:
+            reference.update(data, notify=False)
+        self._client._notify()
+        return [self._client._now() for _ in self._ops]
+
+
+class FakeTransaction:
+    """Transacción optimista que acepta `firestore.transactional`.
+
+    Las escrituras quedan en espera hasta `_commit`, que falla con Aborted
+    (y el decorador reintenta) si otro cambió algún documento leído.
+    """
+    _read_only = False
+
+    def __init__(self, client, max_attempts):
+        self._client = client
+        self._max_attempts = max_attempts
+        self._id = None
+        self._reads = []
+        self._writes = []
+
+    def _clean_up(self):
+        self._id = None
+        self._reads = []
+        self._writes = []
+
+    def _begin(self, retry_id=None):
+        self._id = next(self._client._ids)
+
+    def _rollback(self):
+        self._clean_up()
+
+    def set(self, reference, data, merge=False):
+        self._writes.append((reference, data, merge))
+
+    def _commit(self):
+        try:
+            with self._client._lock:
+                for reference, update_time in self._reads:
+                    if reference._collection._update_times.get(reference.id) != update_time:
+                        self._client.transaction_aborts += 1
+                        raise Aborted(f"El documento {reference.id} cambió durante la transacción")
+                for reference, data, merge in self._writes:
+                    reference.set(data, merge=merge)
+        finally:
+            self._clean_up()
+
+
+class FakeFirestore:
+    """Cliente de Firestore en memoria, con contadores de lecturas y escrituras."""
+    def __init__(self):
+        self._collections = {}
+        self._watches = []
+        self._ids = itertools.count(1)
+        self._clock = itertools.count(1)
+        self._lock = threading.RLock()
+        self.document_reads = 0
+        self.transaction_aborts = 0
+        self.document_writes = 0
+        self.batch_commits = 0
+
+    def _now(self):
+        return datetime.fromtimestamp(1_700_000_000 + next(self._clock) / 1e6, timezone.utc)
+
+    def _notify(self):
+        for watch in self._watches:
+            watch.notify()
+
+    def collection(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=20):
+        # Más intentos que el cliente real (5): las pruebas fuerzan la contención
+        return FakeTransaction(self, max_attempts)
+
+    def write_option(self, last_update_time=None):
+        return FakeWriteOption(last_update_time)
+
+    def load(self, name, documents):
+        """Carga documentos sin pasar por los listeners (preparación de datos)."""
+        collection = self.collection(name)
+        for data in documents:
+            doc_id = f"doc{next(self._ids):08d}"
+            collection._docs[doc_id] = data
+            collection._update_times[doc_id] = self._now()
@@ -0,0 +1,136 @@
+"""Exportación masiva de cotizaciones a PDF.
+
+Se usa desde la pestaña de Seguimiento y también desde la línea de comandos:
+
+    python exportar_cotizaciones.py --tienda Oviedo --estado "✅ Aprobada" \\
+        --desde 01/10/2026 --hasta 31/10/2026 -o cotizaciones_octubre.zip
+
+Los PDF se generan en paralelo en un pool de procesos con
+`pdf_cotizaciones.generate_pdf_content` (los procesos no importan la app) y se
+escriben al ZIP a medida que van terminando. Las imágenes se resuelven en este
+proceso, que tiene la caché de imágenes.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+
+
+EXPORT_JOBS_PER_WORKER = 2  # PDF en cola por proceso: los mantiene ocupados sin cargar todas las imágenes a la vez
+
+
+def _init_app_logging():
+    # Al importar la app fuera de `streamlit run`, Streamlit avisa en cada llamada
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+
+def _render_quote_pdf(pdf_data, images):
+    """Trabajo de un proceso del pool. Importa solo el módulo del PDF (sin Streamlit ni Firebase)."""
+    from pdf_cotizaciones import generate_pdf_content
+    return generate_pdf_content(pdf_data, images=images)
+
+
+def export_quotes_zip(jobs, output, max_workers=None, on_progress=None, resolve_images=None):
+    """Genera los PDF de `jobs` en paralelo y los escribe en el ZIP `output` (ruta o archivo abierto).
+
+    `jobs` viene de `build_export_jobs`: [(id, datos del PDF, nombre del archivo)].
+    `resolve_images(items)` (`prefetch_quote_images` de la app) corre en este
+    proceso justo antes de mandar cada PDF al pool; sin él, los PDF salen sin
+    imágenes. `on_progress(hechos, total)` se llama desde este hilo cada vez
+    que termina un PDF. Devuelve (cantidad exportada, {nombre del archivo: error}).
+    """
+    failures = {}
+    exported = 0
+    if not jobs:
+        return exported, failures
+
+    max_workers = max_workers or os.cpu_count() or 1
+    pending_jobs = iter(jobs)
+    used_names = set()
+    futures = {}
+
+    def submit_next(pool):
+        for doc_id, pdf_data, file_name in pending_jobs:
+            if file_name in used_names:
+                file_name = f"{os.path.splitext(file_name)[0]}_{doc_id}.pdf"
+            used_names.add(file_name)
+            images = resolve_images(pdf_data['items']) if resolve_images else None
+            futures[pool.submit(_render_quote_pdf, pdf_data, images)] = file_name
+            return True
+        return False
+
+    # "spawn" y no "fork": el proceso de Streamlit tiene hilos y clientes gRPC de Firestore
+    context = multiprocessing.get_context('spawn')
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zf, \
+            ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        while len(futures) < max_workers * EXPORT_JOBS_PER_WORKER and submit_next(pool):
+            pass
+        done = 0
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_name = futures.pop(future)
+                try:
+                    zf.writestr(file_name, future.result())
+                    exported += 1
+                except Exception as e:
+                    failures[file_name] = str(e)
+                done += 1
+                if on_progress:
+                    on_progress(done, len(jobs))
+                submit_next(pool)
+    return exported, failures
+
+
+def _parse_fecha(value):
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Fecha inválida '{value}', usa DD/MM/AAAA")
+
+
+def main(argv=None):
+    _init_app_logging()
+    import app_cotizaciones as app
+
+    parser = argparse.ArgumentParser(description="Exporta a PDF (en un ZIP) las cotizaciones de una tienda.")
+    parser.add_argument('--tienda', required=True, choices=app.TIENDAS)
+    parser.add_argument('--estado', choices=app.ESTADOS_COTIZACION, help="Solo cotizaciones en este estado")
+    parser.add_argument('--desde', type=_parse_fecha, help="Fecha inicial DD/MM/AAAA (incluida)")
+    parser.add_argument('--hasta', type=_parse_fecha, help="Fecha final DD/MM/AAAA (incluida)")
+    parser.add_argument('-o', '--output', help="Archivo ZIP de salida")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos en paralelo (por defecto, uno por CPU)")
+    args = parser.parse_args(argv)
+
+    if app.db is None:
+        print("No hay conexión con Firebase (revisa .streamlit/secrets.toml o firebase_secrets.json).", file=sys.stderr)
+        return 1
+    app.get_pdf_assets()  # Falla aquí, y no en cada proceso, si faltan fuentes o logo
+
+    quotes = app.get_quotes_for_export(app.db, args.tienda, args.estado, args.desde, args.hasta)
+    if not quotes:
+        print("No hay cotizaciones con esos filtros.")
+        return 0
+
+    output = args.output or f"Cotizaciones_{args.tienda}_{date.today():%Y%m%d}.zip"
+
+    def on_progress(done, total):
+        print(f"\rGenerando PDFs: {done} de {total}", end='', flush=True)
+
+    jobs, failures = app.build_export_jobs(quotes)
+    exported, pdf_failures = export_quotes_zip(jobs, output, args.workers, on_progress,
+                                               resolve_images=app.prefetch_quote_images)
+    failures.update(pdf_failures)
+    print()
+    print(f"{exported} PDF exportados en {output}")
+    for file_name, error in failures.items():
+        print(f"  ❌ {file_name}: {error}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Migración de los documentos de `cotizaciones` guardados antes de los campos derivados.
+
+Completa los campos de `quote_derived_fields`: `fecha_orden` y
+`cliente_prefijos`, que usan las consultas paginadas del Seguimiento, y los
+totales (`subtotal`, `total`, `total_unidades`, `num_items`) que le permiten
+listar cotizaciones sin descargar los ítems. También saca de los ítems las
+imágenes en `imagen_base64`: las sube al almacén de imágenes y deja solo
+`imagen_ref`. Es idempotente: solo escribe los documentos cuyo valor cambia.
+
+    python migrar_cotizaciones.py --dry-run
+    python migrar_cotizaciones.py
+
+Los índices compuestos que necesitan esas consultas están en
+firestore.indexes.json (`firebase deploy --only firestore:indexes`).
+"""
+import argparse
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+
+def pending_updates(app, quotes, blob_store=None):
+    """[(id, campos a escribir)] de los documentos desactualizados, y cuántas imágenes se mueven.
+
+    Las imágenes se suben a `blob_store` aquí mismo; con None (--dry-run) solo se cuentan.
+    """
+    updates = []
+    images_moved = 0
+    for doc_id, data in quotes:
+        fields = app.quote_derived_fields(data)
+        changed = {key: value for key, value in fields.items() if data.get(key) != value}
+        if changed.get('fecha_orden') == app.FECHA_ORDEN_INVALIDA:
+            logger.warning("Cotización %s: fecha %r inválida, se guarda fecha_orden=%s",
+                           doc_id, data.get('fecha'), app.FECHA_ORDEN_INVALIDA)
+        items, moved = app.move_item_images_to_blob_store(data.get('items', {}) or {}, blob_store)
+        if moved:
+            changed['items'] = items
+            images_moved += moved
+        if changed:
+            updates.append((doc_id, changed))
+    return updates, images_moved
+
+
+def main(argv=None):
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    import app_cotizaciones as app
+
+    parser = argparse.ArgumentParser(description="Completa los campos derivados de las cotizaciones existentes.")
+    parser.add_argument('--tienda', choices=app.TIENDAS, help="Solo esta tienda (por defecto, todas)")
+    parser.add_argument('--dry-run', action='store_true', help="Solo cuenta lo que se actualizaría")
+    args = parser.parse_args(argv)
+
+    if app.db is None:
+        print("No hay conexión con Firebase (revisa .streamlit/secrets.toml o firebase_secrets.json).", file=sys.stderr)
+        return 1
+
+    query = app.db.collection('cotizaciones')
+    if args.tienda:
+        query = query.where('tienda', '==', args.tienda)
+    quotes = [(doc.id, doc.to_dict()) for doc in query.stream()]
+    updates, images_moved = pending_updates(app, quotes, None if args.dry_run else app.get_blob_store())
+    print(f"{len(quotes)} cotizaciones revisadas, {len(updates)} por actualizar ({images_moved} imágenes al almacén).")
+    if args.dry_run or not updates:
+        return 0
+
+    def on_progress(done, total):
+        print(f"\rActualizadas: {done} de {total}", end='', flush=True)
+
+    _, failures = app.commit_quote_updates(app.db, dict(updates), on_progress=on_progress)
+    print()
+    for doc_id, error in failures.items():
+        print(f"  ❌ {doc_id}: {error}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,421 @@
+"""PDF de una cotización: fuentes y logo (`PdfAssets`), la clase `PDF` y
+`generate_pdf_content`.
+
+No importa Streamlit ni Firebase ni la app: lo usan la app y cada proceso de
+`exportar_cotizaciones`, que así no cargan la interfaz ni abren conexiones.
+Las imágenes de los productos llegan ya resueltas.
+"""
+import copy
+import functools
+import os
+from io import BytesIO
+
+from fontTools import ttLib
+from fpdf import FPDF
+from fpdf.fonts import SubsetMap
+from PIL import Image
+
+from rendimiento import PerfRecorder
+
+_PERF_DISABLED = PerfRecorder()
+
+
+def format_currency(value):
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return "$0"
+    return f"${v:,.0f}".replace(",", ".")
+
+# --- RECURSOS DEL PDF (FUENTES Y LOGO) ---
+PDF_FONT_FAMILY = 'Lato'
+PDF_FONT_FILES = {'': 'Lato-Regular.ttf', 'B': 'Lato-Bold.ttf', 'I': 'Lato-Italic.ttf'}
+# Rango Unicode a incluir de las fuentes (ej. "U+0020-00FF, U+2010-2027"); None = fuente completa.
+# fpdf2 igual embebe solo los glifos usados en cada documento.
+PDF_FONT_UNICODE_RANGE = None
+PDF_LOGO_PATH = "logo_transparente.png"
+
+class PdfAssets:
+    """Fuentes y logo del PDF, leídos y procesados una sola vez por proceso.
+
+    Cada fuente se analiza una vez en una instancia "prototipo" de fpdf2;
+    los documentos reciben una copia (`copy.deepcopy`, que fpdf2 implementa)
+    con una tabla fontTools nueva (perezosa, desde los bytes en memoria) y su
+    propio subconjunto, ya que fpdf2 modifica la tabla al generar el
+    subconjunto de glifos.
+    """
+    def __init__(self, font_files=PDF_FONT_FILES, logo_path=PDF_LOGO_PATH, unicode_range=PDF_FONT_UNICODE_RANGE):
+        missing = [path for path in [*font_files.values(), logo_path] if not os.path.exists(path)]
+        if missing:
+            raise FileNotFoundError(f"Faltan recursos para generar el PDF: {', '.join(missing)}")
+
+        self.font_files = font_files
+        self.unicode_range = unicode_range
+        self.font_bytes = {}
+        self.fonts = {}
+        scratch = FPDF()
+        for style, path in font_files.items():
+            with open(path, 'rb') as f:
+                self.font_bytes[style] = f.read()
+            scratch.add_font(PDF_FONT_FAMILY, style, path, unicode_range=unicode_range)
+            self.fonts[style] = scratch.fonts[f"{PDF_FONT_FAMILY.lower()}{style}"]
+
+        self.logo = Image.open(logo_path)
+        self.logo.load()
+
+        # Ancho de cada palabra ya medida, por estilo, en milésimas de em
+        self._word_widths = {style: {} for style in font_files}
+
+    def word_width(self, word, style=''):
+        """Ancho de `word` en milésimas del tamaño de la fuente (caché por estilo)."""
+        widths = self._word_widths[style]
+        width = widths.get(word)
+        if width is None:
+            cw = self.fonts[style].cw
+            width = widths[word] = sum(cw[ord(ch)] for ch in word)
+        return width
+
+    def register_fonts(self, pdf):
+        """Deja las fuentes disponibles en `pdf` sin volver a analizar los archivos."""
+        for style, prototype in self.fonts.items():
+            fontkey = f"{PDF_FONT_FAMILY.lower()}{style}"
+            if fontkey in pdf.fonts:
+                continue
+            font = copy.deepcopy(prototype)
+            font.i = len(pdf.fonts) + 1
+            font.ttfont = ttLib.TTFont(BytesIO(self.font_bytes[style]), recalcTimestamp=False, lazy=True)
+            font.subset = SubsetMap(font)
+            pdf.fonts[fontkey] = font
+
+@functools.lru_cache(maxsize=None)
+def get_pdf_assets():
+    """Recursos del PDF compartidos por todo el proceso (sesiones de la app o un proceso de exportación)."""
+    return PdfAssets()
+
+# --- CLASE PDF PERSONALIZADA ---
+# Geometría de la página (mm), compartida por la medición y el dibujo
+PDF_HEADER_BOTTOM_Y = 35      # Fin del encabezado con los datos de la empresa
+PDF_TABLE_TOP_Y = 40          # Encabezado de la tabla en las páginas de continuación
+PDF_TABLE_HEADER_HEIGHT = 8
+PDF_TABLE_COL_WIDTHS = {'img': 30, 'name': 70, 'sku': 20, 'qty': 15, 'price': 25, 'total': 30}
+PDF_TABLE_ROWS_Y = PDF_TABLE_TOP_Y + PDF_TABLE_HEADER_HEIGHT
+PDF_ROW_LINE_HEIGHT = 5
+PDF_ROW_MIN_HEIGHT = 30
+PDF_TOTALS_TOP_GAP = 5
+PDF_TOTALS_LINE_HEIGHT = 8
+PDF_TOTALS_RULE_GAP = 2
+PDF_TOTALS_GRAND_HEIGHT = 10
+PDF_TOTALS_HEIGHT = PDF_TOTALS_TOP_GAP + 3 * PDF_TOTALS_LINE_HEIGHT + PDF_TOTALS_RULE_GAP + PDF_TOTALS_GRAND_HEIGHT
+
+class PDF(FPDF):
+    def __init__(self, *args, assets=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.color_primary = (4, 76, 125)
+        self.color_secondary = (240, 240, 240)
+        self.color_text = (50, 50, 50)
+        self.color_border = (220, 220, 220)
+        self.table_col_widths = None
+        self.is_table_page = False
+        self.assets = assets or get_pdf_assets()
+        self.assets.register_fonts(self)
+        self.current_font_family = PDF_FONT_FAMILY
+        self.total_pages = None  # Lo fija `layout_table` antes de dibujar la tabla
+
+    def header(self):
+        self.image(self.assets.logo, 10, 8, 45)
+
+        self.set_font(self.current_font_family, "B", 9)
+        self.set_text_color(*self.color_text)
+        info_x = 120
+        self.set_xy(info_x, 10)
+        self.cell(0, 5, "DIDACTICOS JUGANDO Y EDUCANDO SAS", 0, 1, 'R')
+        self.set_font(self.current_font_family, "", 9)
+        self.set_x(info_x)
+        self.cell(0, 5, "NIT: 901144615-6", 0, 1, 'R')
+        self.set_x(info_x)
+        self.cell(0, 5, "CEL: 3153357921", 0, 1, 'R')
+        self.set_x(info_x)
+        self.cell(0, 5, "jugandoyeducando@hotmail.com", 0, 1, 'R')
+        self.set_x(info_x)
+        self.cell(0, 5, "Avenida 19 # 114A - 22, Bogota", 0, 1, 'R')
+
+        if self.is_table_page and self.table_col_widths:
+            self.set_y(PDF_TABLE_TOP_Y)
+            self.draw_table_header(self.table_col_widths)
+
+    def draw_quote_number(self, numero):
+        self.set_font(self.current_font_family, '', 11)
+        self.set_text_color(50, 50, 50)
+        self.set_xy(150, 55)
+        self.cell(35, 6, "Cotización N°:", 0, 0, 'R')
+
+        y_numero = self.get_y()
+        self.set_font(self.current_font_family, 'B', 12)
+        self.set_text_color(4, 76, 125)
+        self.cell(25, 6, numero, 0, 1, 'L')
+
+        self.set_draw_color(4, 76, 125)
+        self.set_line_width(0.6)
+        y_line = y_numero + 10
+        self.line(10, y_line, 200, y_line)
+        self.ln(12)
+
+    def draw_client_info(self, data):
+        self.ln(5)
+        self.set_font(self.current_font_family, "B", 11)
+        self.set_text_color(*self.color_primary)
+        self.cell(0, 8, "Información del Cliente", 0, 1, 'L')
+        self.set_font(self.current_font_family, "", 10)
+        self.set_text_color(*self.color_text)
+        y_start = self.get_y()
+        self.set_xy(10, y_start)
+        self.cell(25, 6, "Cliente:", 0, 0, 'L')
+        self.set_font(self.current_font_family, "B", 10)
+        self.multi_cell(75, 6, data.get('cliente_nombre', ''), 0, 'L')
+        self.set_font(self.current_font_family, "", 10)
+        self.set_xy(10, self.get_y())
+        self.cell(25, 6, "NIT/CC:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('cliente_nit', ''), 0, 'L')
+        self.set_xy(10, self.get_y())
+        self.cell(25, 6, "Dirección:", 0, 0, 'L')
+        self.multi_cell(75, 6, f"{data.get('cliente_dir','')}, {data.get('cliente_ciudad','')}", 0, 'L')
+        y_left_end = self.get_y()
+        self.set_xy(110, y_start)
+        self.cell(25, 6, "Fecha:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('fecha', ''), 0, 'L')
+        self.set_xy(110, self.get_y())
+        self.cell(25, 6, "Teléfono:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('cliente_tel', ''), 0, 'L')
+        self.set_xy(110, self.get_y())
+        self.cell(25, 6, "Vigencia:", 0, 0, 'L')
+        self.multi_cell(75, 6, data.get('vigencia', ''), 0, 'L')
+        y_right_end = self.get_y()
+        self.set_y(max(y_left_end, y_right_end) + 5)
+
+    def text_width(self, text, style='', size=9):
+        """Ancho de `text` en mm, con los anchos de glifos en caché de `PdfAssets`."""
+        return self.assets.word_width(text, style) * size * 0.001 / self.k
+
+    def wrap_text(self, text, width, style='', size=9):
+        """Parte `text` en las líneas que caben en `width` mm (como `multi_cell`)."""
+        space_w = self.text_width(' ', style, size)
+        lines = []
+        current, current_w = [], 0
+        for word in str(text).split():
+            word_w = self.text_width(word, style, size)
+            while word_w > width:
+                # Palabra más ancha que la columna: se corta por caracteres
+                if current:
+                    lines.append(' '.join(current))
+                    current, current_w = [], 0
+                cut = 1
+                while cut < len(word) and self.text_width(word[:cut + 1], style, size) <= width:
+                    cut += 1
+                lines.append(word[:cut])
+                word = word[cut:]
+                word_w = self.text_width(word, style, size)
+            if not word:
+                continue
+            if current and current_w + space_w + word_w > width:
+                lines.append(' '.join(current))
+                current, current_w = [], 0
+            current_w += (space_w if current else 0) + word_w
+            current.append(word)
+        if current or not lines:
+            lines.append(' '.join(current))
+        return lines
+
+    def layout_table(self, items, col_widths, y_start):
+        """Primera pasada: mide todas las filas y decide los saltos de página.
+
+        `y_start` es donde empieza la primera fila (debajo del encabezado de la
+        tabla en la página actual). Devuelve las filas con su página, posición,
+        alto y líneas del nombre, la posición del bloque de totales y el total
+        de páginas del documento.
+        """
+        page, y = self.page_no(), y_start
+        name_width = col_widths['name'] - 2 * self.c_margin
+        rows = []
+        for key, item in items.items():
+            name_lines = self.wrap_text(item.get('nombre', ''), name_width)
+            height = max(PDF_ROW_MIN_HEIGHT, len(name_lines) * PDF_ROW_LINE_HEIGHT + 4)
+            if y + height > self.page_break_trigger and y > PDF_TABLE_ROWS_Y:
+                page, y = page + 1, PDF_TABLE_ROWS_Y
+            rows.append({'key': key, 'page': page, 'y': y, 'height': height, 'name_lines': name_lines})
+            y += height
+
+        # El bloque de totales no se parte: si no cabe, va completo en otra página
+        if y + PDF_TOTALS_HEIGHT > self.page_break_trigger:
+            page, y = page + 1, PDF_HEADER_BOTTOM_Y
+        return {'rows': rows, 'totals_page': page, 'totals_y': y, 'page_count': page}
+
+    def draw_table_header(self, col_widths):
+        self.set_font(self.current_font_family, "B", 9)
+        self.set_fill_color(*self.color_primary)
+        self.set_text_color(255, 255, 255)
+        self.set_draw_color(*self.color_primary)
+        self.set_line_width(0.3)
+        self.cell(col_widths['img'], PDF_TABLE_HEADER_HEIGHT, "IMAGEN", 'T', 0, 'C', 1)
+        self.cell(col_widths['name'], PDF_TABLE_HEADER_HEIGHT, "PRODUCTO", 'T', 0, 'C', 1)
+        self.cell(col_widths['sku'], PDF_TABLE_HEADER_HEIGHT, "CÓDIGO", 'T', 0, 'C', 1)
+        self.cell(col_widths['qty'], PDF_TABLE_HEADER_HEIGHT, "UNDS.", 'T', 0, 'C', 1)
+        self.cell(col_widths['price'], PDF_TABLE_HEADER_HEIGHT, "VLR. UNITARIO", 'T', 0, 'C', 1)
+        self.cell(col_widths['total'], PDF_TABLE_HEADER_HEIGHT, "VALOR TOTAL", 'T', 1, 'C', 1)
+
+    def draw_table_row(self, item, col_widths, row, fill=False, image_bytes=None):
+        """Segunda pasada: dibuja una fila en la posición que le dio `layout_table`."""
+        while self.page_no() < row['page']:
+            self.add_page()
+        row_height = row['height']
+        name_height = len(row['name_lines']) * PDF_ROW_LINE_HEIGHT
+        self.set_xy(self.l_margin, row['y'])
+
+        x_start = self.get_x()
+        y_start = self.get_y()
+
+        self.set_font(self.current_font_family, "", 9)
+        self.set_text_color(*self.color_text)
+        self.set_draw_color(*self.color_border)
+        self.set_fill_color(*self.color_secondary)
+
+        self.cell(col_widths['img'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['name'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['sku'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['qty'], row_height, "", 'B', 0, 'C', fill)
+        self.cell(col_widths['price'], row_height, "", 'B', 0, 'R', fill)
+        self.cell(col_widths['total'], row_height, "", 'B', 1, 'R', fill)
+
+        # Imagen (ya resuelta por `prefetch_quote_images`)
+        try:
+            image_source = BytesIO(image_bytes) if image_bytes else None
+            if image_source:
+                # Ajuste de imagen para mantener proporción
+                self.image(image_source, x=x_start + 2, y=y_start + 2, w=col_widths['img'] - 4, h=row_height - 4)
+            else:
+                raise Exception("No image")
+        except Exception:
+            v_offset_placeholder = (row_height - 4) / 2
+            self.set_xy(x_start, y_start + v_offset_placeholder)
+            self.cell(col_widths['img'], 4, "S/I", 0, 0, 'C')
+
+        # Nombre
+        name_y = y_start + (row_height - name_height) / 2
+        for line in row['name_lines']:
+            self.set_xy(x_start + col_widths['img'], name_y)
+            self.cell(col_widths['name'], PDF_ROW_LINE_HEIGHT, line, 0, 0, 'C')
+            name_y += PDF_ROW_LINE_HEIGHT
+
+        text_height = self.font_size
+        cell_v_offset = (row_height - text_height) / 2
+        
+        # SKU
+        self.set_xy(x_start + col_widths['img'] + col_widths['name'], y_start + cell_v_offset)
+        self.cell(col_widths['sku'], text_height, str(item.get('sku', '')), 0, 0, 'C')
+        
+        # Cantidad
+        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'])
+        self.cell(col_widths['qty'], text_height, str(item.get('cantidad', '')), 0, 0, 'C')
+        
+        # Precio
+        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'])
+        self.cell(col_widths['price'], text_height, format_currency(item.get('precio_unitario', 0)), 0, 0, 'R')
+        
+        # Total
+        self.set_x(x_start + col_widths['img'] + col_widths['name'] + col_widths['sku'] + col_widths['qty'] + col_widths['price'])
+        self.cell(col_widths['total'], text_height, format_currency(item.get('valor_total', 0)), 0, 0, 'R')
+
+        self.set_y(y_start + row_height)
+
+    def draw_totals(self, quote_data, page, y):
+        """Bloque de totales (alto `PDF_TOTALS_HEIGHT`), completo en la página que le tocó."""
+        while self.page_no() < page:
+            self.add_page()
+        total_label_x = 100
+        self.set_font(self.current_font_family, "", 10)
+        self.set_text_color(*self.color_text)
+        self.set_xy(total_label_x, y + PDF_TOTALS_TOP_GAP)
+        self.cell(70, PDF_TOTALS_LINE_HEIGHT, "SUBTOTAL", 0, 0, 'R')
+        self.set_font(self.current_font_family, "B", 10)
+        self.cell(30, PDF_TOTALS_LINE_HEIGHT, format_currency(quote_data['subtotal']), 0, 1, 'R')
+
+        self.set_font(self.current_font_family, "", 10)
+        self.set_x(total_label_x)
+        flete_label = "FLETE (INCLUIDO)" if str(quote_data.get('flete_str','')).upper() == 'INCLUIDO' else "FLETE"
+        self.cell(70, PDF_TOTALS_LINE_HEIGHT, flete_label, 0, 0, 'R')
+        self.set_font(self.current_font_family, "B", 10)
+        self.cell(30, PDF_TOTALS_LINE_HEIGHT, format_currency(quote_data.get('flete_val', 0)), 0, 1, 'R')
+
+        self.set_font(self.current_font_family, "", 10)
+        self.set_x(total_label_x)
+        self.cell(70, PDF_TOTALS_LINE_HEIGHT, "TOTAL UNIDADES", 0, 0, 'R')
+        self.set_font(self.current_font_family, "B", 10)
+        self.cell(30, PDF_TOTALS_LINE_HEIGHT, str(quote_data['total_unidades']), 0, 1, 'R')
+        self.set_x(total_label_x)
+        self.set_draw_color(*self.color_border)
+        self.line(total_label_x + 5, self.get_y(), 200, self.get_y())
+        self.ln(PDF_TOTALS_RULE_GAP)
+        self.set_font(self.current_font_family, "B", 11)
+        self.set_text_color(*self.color_primary)
+        self.set_x(total_label_x)
+        self.cell(70, PDF_TOTALS_GRAND_HEIGHT, "TOTAL COTIZACION INCLUIDO IVA", 0, 0, 'R')
+        self.set_font(self.current_font_family, "B", 12)
+        self.cell(30, PDF_TOTALS_GRAND_HEIGHT, format_currency(quote_data['total_cotizacion']), 0, 1, 'R')
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font(self.current_font_family, "I", 8)
+        self.set_text_color(150, 150, 150)
+        page_label = f"Página {self.page_no()}"
+        if self.total_pages:
+            page_label += f" de {self.total_pages}"
+        self.cell(0, 10, page_label, 0, 0, 'C')
+
+# --- GENERACIÓN DEL PDF ---
+def generate_pdf_content(quote_data, images=None, assets=None, perf_recorder=None):
+    """Genera el PDF de la cotización.
+
+    `images` ({clave: (bytes, estado)}) llega ya resuelto por
+    `prefetch_quote_images` de la app; los productos sin entrada salen sin
+    imagen. `assets` (fuentes y logo) por defecto es el `PdfAssets` del
+    proceso, y `perf_recorder` mide las etapas (por defecto no mide nada).
+    """
+    images = images or {}
+    perf_recorder = perf_recorder or _PERF_DISABLED
+
+    pdf = PDF('P', 'mm', 'A4', assets=assets)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    
+    pdf.set_font(pdf.current_font_family, "B", 22)
+    pdf.set_text_color(*pdf.color_primary)
+    pdf.set_y(45)
+    pdf.cell(130, 10, "COTIZACIÓN", 0, 0, 'L')
+    pdf.draw_quote_number(quote_data.get("numero_cotizacion", "S/N"))
+    pdf.draw_client_info(quote_data)
+    
+    col_widths = PDF_TABLE_COL_WIDTHS
+    
+    pdf.is_table_page = True
+    pdf.table_col_widths = col_widths
+    pdf.draw_table_header(col_widths)
+
+    # Primero se mide todo (saltos de página y total de páginas), luego se dibuja
+    with perf_recorder.span('pdf.medicion') as span:
+        layout = pdf.layout_table(quote_data['items'], col_widths, pdf.get_y())
+        span.add(filas=len(layout['rows']))
+    pdf.total_pages = layout['page_count']
+
+    with perf_recorder.span('pdf.dibujo') as span:
+        fill = True
+        for row in layout['rows']:
+            image_bytes, _ = images.get(row['key'], (None, 'sin_imagen'))
+            pdf.draw_table_row(quote_data['items'][row['key']], col_widths, row, fill, image_bytes=image_bytes)
+            fill = not fill
+
+        pdf.is_table_page = False
+        pdf.draw_totals(quote_data, layout['totals_page'], layout['totals_y'])
+        span.add(paginas=layout['page_count'])
+    with perf_recorder.span('pdf.salida') as span:
+        content = bytes(pdf.output())
+        span.add(bytes=len(content))
+    return content
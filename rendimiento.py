@@ -0,0 +1,171 @@
+"""Medición de tiempos de los caminos lentos: páginas de Wix, lecturas de
+Firestore, descargas de imágenes y armado del PDF.
+
+No importa Streamlit ni Firebase, así que sirve tanto en la app (que arma el
+medidor del proceso con `get_perf_recorder`) como en los procesos de
+`exportar_cotizaciones`. Un `PerfRecorder()` sin activar no mide nada.
+"""
+import contextlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+PERF_STAGE_WINDOW = 500       # Duraciones guardadas por etapa para calcular p50/p95
+PERF_SLOW_RERUN_MS = 2000     # Se puede sobreescribir con st.secrets["perf"]["slow_rerun_ms"]
+PERF_RECENT_RERUNS = 50
+
+# Una línea JSON por rerun cuando st.secrets["perf"]["log"] está activo
+perf_logger = logging.getLogger(__name__)
+
+def percentile(sorted_values, p):
+    """Percentil `p` (0 a 1) de una lista ya ordenada (None si está vacía)."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, **counts):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class PerfTrace:
+    """Totales por etapa de un rerun o de una sesión: {etapa: {'n', 'ms', contadores...}}."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, stage, elapsed_ms, counts=None):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {'n': 0, 'ms': 0.0})
+            totals['n'] += 1
+            totals['ms'] += elapsed_ms
+            for key, value in (counts or {}).items():
+                totals[key] = totals.get(key, 0) + value
+
+    def merge(self, stages):
+        with self._lock:
+            for stage, other in stages.items():
+                totals = self.stages.setdefault(stage, {'n': 0, 'ms': 0.0})
+                for key, value in other.items():
+                    totals[key] = totals.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: dict(totals) for stage, totals in self.stages.items()}
+
+class PerfSpan:
+    """Un tramo medido; `add(bytes=..., docs=...)` suma contadores al tramo."""
+    __slots__ = ('recorder', 'stage', 'trace', 'counts', 'start')
+
+    def __init__(self, recorder, stage, trace):
+        self.recorder = recorder
+        self.stage = stage
+        self.trace = trace
+        self.counts = {}
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def add(self, **counts):
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + value
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.counts['errores'] = self.counts.get('errores', 0) + 1
+        self.recorder.record(self.stage, (time.perf_counter() - self.start) * 1000, self.counts, self.trace)
+        return False
+
+class PerfRecorder:
+    """Mediciones del proceso: duraciones recientes por etapa y los reruns más lentos.
+
+    El rerun en curso se guarda por hilo; los hilos de trabajo (páginas de
+    Wix, imágenes) lo heredan con `bind`.
+    """
+    def __init__(self, enabled=False, slow_rerun_ms=PERF_SLOW_RERUN_MS, log=False):
+        self.enabled = enabled
+        self.slow_rerun_ms = slow_rerun_ms
+        self.log = log
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.durations = defaultdict(lambda: deque(maxlen=PERF_STAGE_WINDOW))
+        self.slow_reruns = deque(maxlen=PERF_RECENT_RERUNS)
+
+    def span(self, stage):
+        if not self.enabled:
+            return _NULL_SPAN
+        return PerfSpan(self, stage, getattr(self._local, 'trace', None))
+
+    def record(self, stage, elapsed_ms, counts=None, trace=None):
+        with self._lock:
+            self.durations[stage].append(elapsed_ms)
+        if trace is not None:
+            trace.add(stage, elapsed_ms, counts)
+
+    def bind(self, fn):
+        """Envuelve `fn` para que lo que mida en otro hilo cuente en el rerun actual."""
+        trace = getattr(self._local, 'trace', None) if self.enabled else None
+        if trace is None:
+            return fn
+        def run(*args, **kwargs):
+            self._local.trace = trace
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.trace = None
+        return run
+
+    @contextlib.contextmanager
+    def rerun(self, session_trace=None, label=None):
+        """Mide un rerun completo del script y lo suma a la sesión."""
+        if not self.enabled:
+            yield
+            return
+        trace = PerfTrace()
+        self._local.trace = trace
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.trace = None
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            trace.add('rerun', elapsed_ms)
+            self.record('rerun', elapsed_ms)
+            stages = trace.snapshot()
+            if session_trace is not None:
+                session_trace.merge(stages)
+            entry = {'fecha': datetime.now().isoformat(timespec='seconds'), 'contexto': label,
+                     'total_ms': round(elapsed_ms, 1),
+                     'etapas': {stage: {**totals, 'ms': round(totals['ms'], 1)} for stage, totals in stages.items()}}
+            if elapsed_ms >= self.slow_rerun_ms:
+                with self._lock:
+                    self.slow_reruns.append(entry)
+            if self.log:
+                perf_logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    def stage_summary(self):
+        """[{etapa, n, p50_ms, p95_ms}] con las duraciones recientes de cada etapa."""
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self.durations.items()}
+        return [
+            {'etapa': stage, 'n': len(values), 'p50_ms': percentile(values, 0.5), 'p95_ms': percentile(values, 0.95)}
+            for stage, values in sorted(durations.items())
+        ]
+
+    def export(self):
+        with self._lock:
+            slow_reruns = list(self.slow_reruns)
+        return {'etapas': self.stage_summary(), 'reruns_lentos': slow_reruns}
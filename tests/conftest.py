@@ -0,0 +1,11 @@
+"""Las pruebas importan la app como módulo y usan los dobles de benchmarks/fakes.py."""
+import logging
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'benchmarks'))
+
+# Fuera de `streamlit run`, Streamlit avisa en cada llamada
+logging.getLogger('streamlit').setLevel(logging.ERROR)
@@ -0,0 +1,124 @@
+import pytest
+
+import app_cotizaciones as app
+
+
+def _fake_wix(total, failing_offsets=()):
+    def fetch(headers, offset, limit=app.WIX_PAGE_LIMIT, **kwargs):
+        if offset in failing_offsets:
+            raise RuntimeError(f"Error comunicando con Wix (offset {offset}): 500")
+        count = max(0, min(limit, total - offset))
+        products = [{'id': f"p{offset + i}", 'sku': str(offset + i), 'name': f"Producto {offset + i}",
+                     'price': {'price': 1000}} for i in range(count)]
+        return {'products': products, 'totalResults': total}
+    return fetch
+
+
+def test_download_wix_catalog_reads_every_page(monkeypatch):
+    monkeypatch.setattr(app, 'fetch_wix_page', _fake_wix(1234))
+    df = app.download_wix_catalog({}, max_workers=4)
+    assert len(df) == 1234
+
+
+def test_download_wix_catalog_fails_when_a_page_fails(monkeypatch):
+    monkeypatch.setattr(app, 'fetch_wix_page', _fake_wix(1234, failing_offsets={500}))
+    with pytest.raises(RuntimeError):
+        app.download_wix_catalog({}, max_workers=4)
+
+
+def test_background_refresh_keeps_snapshot_when_download_is_incomplete(monkeypatch):
+    saved = []
+    monkeypatch.setattr(app, 'fetch_wix_page', _fake_wix(1234, failing_offsets={500}))
+    monkeypatch.setattr(app, 'save_catalog_snapshot', saved.append)
+    app._refresh_catalog_snapshot({}, max_workers=4)
+    assert saved == []
+
+
+def test_merge_catalog_changes_keeps_products_sharing_a_sku():
+    products = [{'id': f"p{i}", 'sku': str(i), 'name': f"Producto {i}", 'price': {'price': 1000}} for i in range(10)]
+    products[1]['sku'] = '0'
+    df = app.compact_catalog(app.pd.DataFrame([app.process_wix_product(p) for p in products]))
+    changed = dict(products[0], name="Producto 0 renombrado")
+    merged = app.merge_catalog_changes(df, [changed])
+    assert len(merged) == 10
+    assert set(merged.loc[merged['sku'] == '0', 'nombre']) == {"Producto 0 renombrado", "Producto 1"}
+
+
+def _catalog_df(count=3):
+    products = [{'id': f"p{i}", 'sku': str(i), 'name': f"Producto {i}", 'price': {'price': 1000}} for i in range(count)]
+    return app.compact_catalog(app.pd.DataFrame([app.process_wix_product(p) for p in products]))
+
+
+def test_failed_forced_refresh_falls_back_to_snapshot(monkeypatch):
+    store = app.CatalogStore()
+    snapshot = _catalog_df()
+    monkeypatch.setattr(app, 'get_catalog_store', lambda: store)
+    monkeypatch.setattr(app, 'load_catalog_snapshot', lambda: (snapshot, 1.0))
+    monkeypatch.setattr(app, 'fetch_and_process_wix_data', lambda: None)
+    catalog = app.load_shared_catalog(force_refresh=True)
+    assert catalog is not None and catalog.df is snapshot
+
+
+def test_stale_catalog_is_served_while_syncing_in_background(monkeypatch):
+    store = app.CatalogStore()
+    stale = store.publish(_catalog_df(), synced_at=0.0)
+    started = []
+    monkeypatch.setattr(app, 'get_catalog_store', lambda: store)
+    monkeypatch.setattr(app, 'get_catalog_snapshot_fetched_at', lambda: None)
+    monkeypatch.setattr(app, 'sync_catalog_in_background', lambda store, catalog: started.append(catalog))
+    assert app.load_shared_catalog() is stale
+    assert started == [stale]
+    # Ya marcado como sincronizado: el siguiente rerun no lanza otra sincronización
+    app.load_shared_catalog()
+    assert started == [stale]
+
+
+def test_background_sync_publishes_changes(monkeypatch):
+    store = app.CatalogStore()
+    df = _catalog_df()
+    df['last_updated'] = app.pd.Series(['2026-01-01T00:00:00Z'] * len(df), dtype=app.CATALOG_STRING_DTYPE)
+    catalog = store.publish(df, synced_at=0.0)
+    changed = {'id': 'p1', 'sku': '1', 'name': "Producto 1 nuevo", 'price': {'price': 2000},
+               'lastUpdated': '2026-02-01T00:00:00Z'}
+
+    def fetch(headers, offset, limit=app.WIX_PAGE_LIMIT, query_filter=None, **kwargs):
+        return {'products': [changed] if query_filter else [], 'totalResults': 3}
+
+    monkeypatch.setattr(app, 'fetch_wix_page', fetch)
+    monkeypatch.setattr(app, 'save_catalog_snapshot', lambda df: 5.0)
+    app._sync_catalog(store, catalog, {}, 1)
+    current = store.current()
+    assert current.version == catalog.version + 1 and current.synced_at == 5.0
+    assert "Producto 1 nuevo" in set(current.df['nombre'])
+
+
+def test_sku_index_lookup_many():
+    df = _catalog_df(5)
+    df['sku'] = app.pd.Series(['10', '11', '12', '11', ''], dtype=app.CATALOG_STRING_DTYPE)  # '11' duplicado en Wix
+    index = app.SkuIndex(df)
+    found, missing = index.lookup_many([' 12', '11', '99', '12', 10, '', '99'])
+    assert list(found.index) == [2, 1, 0]  # Sin repetir, en el orden pedido, primera fila del duplicado
+    assert list(found['sku']) == ['12', '11', '10']
+    assert missing == ['99', '', '99']
+
+
+def test_forced_refresh_downloads_outside_the_lock_and_keeps_catalog_on_failure(monkeypatch):
+    store = app.CatalogStore()
+    loaded = store.publish(_catalog_df(), synced_at=0.0)
+    lock_free = []
+
+    def failed_download():
+        lock_free.append(store.lock.acquire(blocking=False))
+        store.lock.release()
+        assert store.current() is loaded  # Las demás sesiones siguen con la versión vigente
+        return None
+
+    monkeypatch.setattr(app, 'get_catalog_store', lambda: store)
+    monkeypatch.setattr(app, 'fetch_and_process_wix_data', failed_download)
+    assert app.load_shared_catalog(force_refresh=True) is loaded
+    assert lock_free == [True]
+
+    fresh = _catalog_df(4)
+    monkeypatch.setattr(app, 'fetch_and_process_wix_data', lambda: fresh)
+    catalog = app.load_shared_catalog(force_refresh=True)
+    assert catalog.df is fresh and store.current() is catalog and catalog.version == loaded.version + 1
@@ -0,0 +1,11 @@
+import app_cotizaciones as app
+
+
+def test_build_export_jobs_reports_bad_quotes_and_keeps_the_rest():
+    quotes = [
+        ('a', {'numero_cotizacion': 'COT-1', 'cliente_nombre': 'Ana', 'items': {'1': {'valor_total': 1000, 'cantidad': 1}}}),
+        ('b', {'numero_cotizacion': 'COT-2', 'cliente_nombre': 'Luis', 'items': {'1': {'valor_total': 'mil', 'cantidad': 1}}}),
+    ]
+    jobs, failures = app.build_export_jobs(quotes)
+    assert [doc_id for doc_id, _, _ in jobs] == ['a']
+    assert list(failures) == ['Cotizacion_COT-2_Luis.pdf']
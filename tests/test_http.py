@@ -0,0 +1,99 @@
+import pytest
+import requests
+
+import app_cotizaciones as app
+
+URL = 'https://api.ejemplo.com/recurso'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _response(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return response
+
+
+def _client(outcomes, **kwargs):
+    """HttpClient cuya sesión devuelve (o lanza) `outcomes` en orden; anota las esperas y las llamadas."""
+    sleeps, calls = [], []
+    client = app.HttpClient(sleep=sleeps.append, **kwargs)
+    outcomes = iter(outcomes)
+
+    def request(method, url, **_):
+        calls.append(method)
+        outcome = next(outcomes)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    client.session.request = request
+    return client, calls, sleeps
+
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = app.CircuitBreaker(failures=2, cooldown=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == 'cerrado' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'abierto' and not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == 'semiabierto'
+    assert breaker.allow()        # Una sola llamada de prueba
+    assert not breaker.allow()
+    breaker.record_failure()      # Falla la prueba: otro enfriamiento completo
+    clock.now = 19
+    assert breaker.state == 'abierto' and not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'cerrado' and breaker.allow()
+
+
+def test_open_breaker_rejects_without_calling_the_host():
+    client, calls, _ = _client([requests.ConnectionError()] * 2, retries=1, breaker_failures=2)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.get(URL)
+    with pytest.raises(app.HostUnavailableError):
+        client.get(URL)
+    assert len(calls) == 2
+
+
+def test_retry_after_sets_the_wait():
+    client, calls, sleeps = _client([_response(429, {'Retry-After': '2'}), _response(200)])
+    assert client.get(URL).status_code == 200
+    assert sleeps == [2.0] and len(calls) == 2
+
+
+def test_retry_after_beyond_the_limit_returns_the_response():
+    client, calls, sleeps = _client([_response(503, {'Retry-After': '120'})], retry_after_max=30)
+    assert client.get(URL).status_code == 503
+    assert sleeps == [] and len(calls) == 1
+
+
+def test_non_idempotent_requests_are_not_retried():
+    client, calls, sleeps = _client([_response(503)])
+    assert client.post(URL).status_code == 503
+    assert len(calls) == 1 and sleeps == []
+
+    client, calls, sleeps = _client([requests.ConnectionError()])
+    with pytest.raises(requests.ConnectionError):
+        client.post(URL)
+    assert len(calls) == 1 and sleeps == []
+
+
+@pytest.mark.parametrize('retries, expected_calls', [(0, 1), (1, 1), (2, 2), (None, app.HTTP_RETRIES)])
+def test_retries_argument_overrides_the_default(retries, expected_calls):
+    client, calls, _ = _client([_response(503)] * app.HTTP_RETRIES, backoff=0)
+    assert client.get(URL, retries=retries).status_code == 503
+    assert len(calls) == expected_calls
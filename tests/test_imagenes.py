@@ -0,0 +1,43 @@
+import os
+
+import app_cotizaciones as app
+
+
+def _blob_bytes(cache_dir):
+    blobs_dir = os.path.join(cache_dir, 'blobs')
+    return sum(entry.stat().st_size for entry in os.scandir(blobs_dir))
+
+
+def test_blob_written_meanwhile_by_another_thread_is_counted_once(tmp_path, monkeypatch):
+    cache = app.ImageCache(directory=str(tmp_path))
+    content = b'x' * 100
+    cache.get_or_create('a', lambda: content)
+
+    # La URL 'b' ve el blob como ausente, pero otro hilo ya lo guardó
+    real_exists = os.path.exists
+    blob_checks = []
+
+    def exists(path):
+        if str(path).startswith(os.path.join(str(tmp_path), 'blobs')) and not blob_checks:
+            blob_checks.append(path)
+            return False
+        return real_exists(path)
+    monkeypatch.setattr(os.path, 'exists', exists)
+    cache.get_or_create('b', lambda: content)
+    monkeypatch.undo()
+
+    assert cache._disk_bytes == _blob_bytes(tmp_path) == 100
+    assert not [name for name in os.listdir(tmp_path / 'blobs') if name.endswith('.tmp')]
+
+
+def test_disk_eviction_removes_url_files_with_their_blob(tmp_path):
+    cache = app.ImageCache(directory=str(tmp_path), disk_limit=1000)
+    old, new = b'a' * 600, b'b' * 600
+    cache.get_or_create('url-1', lambda: old)
+    cache.get_or_create('url-2', lambda: old)  # Mismo contenido, un solo blob
+    blob = tmp_path / 'blobs' / os.listdir(tmp_path / 'blobs')[0]
+    os.utime(blob, (0, 0))
+    cache.get_or_create('url-3', lambda: new)
+
+    assert cache._disk_bytes == _blob_bytes(tmp_path) == 600
+    assert sorted(os.listdir(tmp_path / 'urls')) == [os.path.basename(cache._url_path('url-3'))]
@@ -0,0 +1,26 @@
+import app_cotizaciones as app
+
+
+def test_headerless_csv_keeps_quantities():
+    content = (
+        "Lápiz negro caja x 12;3;und\n"
+        "Cuaderno cuadriculado 100 hojas;10;und\n"
+        "Colores largos x 24;2;caja\n"
+        "Borrador de nata;15;und\n"
+    ).encode('utf-8')
+    grid = app.read_request_grid(content, 'solicitud.csv')
+    header_row, columns = app.detect_request_columns(grid)
+    assert header_row is None
+    lines = app.build_request_lines(grid, header_row, columns)
+    assert list(lines['cantidad']) == [3, 10, 2, 15]
+    assert lines['descripcion'].iloc[1] == "Cuaderno cuadriculado 100 hojas"
+
+
+def test_match_request_lines_resolves_skus_in_one_lookup():
+    products = [{'id': f"p{i}", 'sku': str(100 + i), 'name': f"Producto {i}", 'price': {'price': 1000}} for i in range(5)]
+    df = app.compact_catalog(app.pd.DataFrame([app.process_wix_product(p) for p in products]))
+    catalog = app.SharedCatalog(df, synced_at=0.0, version=1)
+    lines = app.pd.DataFrame({'fila': [1, 2, 3], 'descripcion': ['', '', ''], 'sku': ['103', '999', '103'], 'cantidad': [1, 2, 3]})
+    matched = app.match_request_lines(lines, catalog)
+    assert list(matched['estado']) == ['sku', 'sin_coincidencia', 'sku']
+    assert list(matched['posicion']) == [3, -1, 3]
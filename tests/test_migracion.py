@@ -0,0 +1,22 @@
+import logging
+
+import app_cotizaciones as app
+from migrar_cotizaciones import pending_updates
+
+
+def test_unparseable_fecha_gets_a_sentinel_and_stops_being_pending(caplog):
+    quotes = [
+        ('ok', {'fecha': '05/03/2026', 'cliente_nombre': 'Ana', 'items': {}}),
+        ('mala', {'fecha': '2026-13-45', 'cliente_nombre': 'Luis', 'items': {}}),
+    ]
+    with caplog.at_level(logging.WARNING, logger='migrar_cotizaciones'):
+        updates, _ = pending_updates(app, quotes)
+    fields = dict(updates)
+    assert fields['ok']['fecha_orden'] == '2026-03-05'
+    assert fields['mala']['fecha_orden'] == app.FECHA_ORDEN_INVALIDA
+    assert 'mala' in caplog.text
+
+    # Con los campos escritos ya no queda nada pendiente
+    migrated = [(doc_id, {**data, **fields[doc_id]}) for doc_id, data in quotes]
+    assert all(field in data for _, data in migrated for field in app.QUOTE_DERIVED_FIELDS)
+    assert pending_updates(app, migrated) == ([], 0)
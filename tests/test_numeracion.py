@@ -0,0 +1,33 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app_cotizaciones as app
+from fakes import FakeFirestore, FakeTransaction
+
+
+def test_concurrent_allocations_never_repeat_a_number(monkeypatch):
+    db = FakeFirestore()
+    # Contadores viejos, todos en un documento: cada tienda sigue desde el suyo
+    db.collection('counters').document('cotizaciones').set({'oviedo': 100, 'barranquilla': 7})
+
+    # Entre leer el contador y confirmar, los demás hilos alcanzan a leer el mismo valor
+    original_set = FakeTransaction.set
+    def slow_set(self, *args, **kwargs):
+        time.sleep(0.002)
+        return original_set(self, *args, **kwargs)
+    monkeypatch.setattr(FakeTransaction, 'set', slow_set)
+
+    start = threading.Barrier(6)
+    def allocate(tienda):
+        start.wait()
+        return [app.get_next_quote_number(db, tienda) for _ in range(5)]
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(allocate, ['Oviedo'] * 3 + ['Barranquilla'] * 3))
+
+    oviedo = sorted(number for numbers in results[:3] for number in numbers)
+    barranquilla = sorted(number for numbers in results[3:] for number in numbers)
+    assert oviedo == [f"OV-{n:04d}" for n in range(101, 116)]
+    assert barranquilla == [f"BQ-{n:04d}" for n in range(8, 23)]
+    assert db.transaction_aborts > 0
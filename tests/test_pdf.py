@@ -0,0 +1,106 @@
+import os
+from datetime import datetime, timezone
+
+from fpdf import FPDF
+from PIL import Image
+
+import app_cotizaciones as app
+import pdf_cotizaciones
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT_FILES = {
+    '': os.path.join(ROOT_DIR, 'public', 'fonts', 'Lato-Regular.ttf'),
+    'B': os.path.join(ROOT_DIR, 'public', 'fonts', 'Lato-Bold.ttf'),
+}
+
+
+def _render(register_fonts, text):
+    pdf = FPDF()
+    register_fonts(pdf)
+    pdf.set_creation_date(datetime(2026, 1, 1, tzinfo=timezone.utc))
+    pdf.add_page()
+    pdf.set_font(pdf_cotizaciones.PDF_FONT_FAMILY, '', 12)
+    pdf.cell(text=text)
+    pdf.set_font(pdf_cotizaciones.PDF_FONT_FAMILY, 'B', 12)
+    pdf.cell(text=text.upper())
+    return bytes(pdf.output())
+
+
+def test_shared_fonts_render_like_add_font(tmp_path):
+    logo_path = tmp_path / 'logo.png'
+    Image.new('RGB', (10, 10)).save(logo_path)
+    assets = pdf_cotizaciones.PdfAssets(font_files=FONT_FILES, logo_path=str(logo_path))
+
+    def add_fonts(pdf):
+        for style, path in FONT_FILES.items():
+            pdf.add_font(pdf_cotizaciones.PDF_FONT_FAMILY, style, path)
+
+    # El segundo documento comprueba que el primero no alteró el prototipo
+    for text in ("Cotización para el jardín", "Otro documento 123"):
+        assert _render(assets.register_fonts, text) == _render(add_fonts, text)
+
+
+def _layout(tmp_path, items, y_start):
+    logo_path = tmp_path / 'logo.png'
+    Image.new('RGB', (10, 10)).save(logo_path)
+    assets = pdf_cotizaciones.PdfAssets(font_files=FONT_FILES, logo_path=str(logo_path))
+    pdf = pdf_cotizaciones.PDF('P', 'mm', 'A4', assets=assets)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    return pdf, pdf.layout_table(items, pdf_cotizaciones.PDF_TABLE_COL_WIDTHS, y_start)
+
+
+def _items(count, long_every=None):
+    return {str(i): {'nombre': 'Rompecabezas de madera ' * (12 if long_every and i % long_every == 0 else 1)}
+            for i in range(count)}
+
+
+def test_layout_breaks_pages_between_rows(tmp_path):
+    pdf, layout = _layout(tmp_path, _items(40, long_every=5), y_start=100)
+    rows = layout['rows']
+    assert any(row['height'] > pdf_cotizaciones.PDF_ROW_MIN_HEIGHT for row in rows)  # Nombres de varias líneas
+    for previous, row in zip(rows, rows[1:]):
+        if row['page'] == previous['page']:
+            assert row['y'] == previous['y'] + previous['height']
+        else:
+            # La fila que no cabía empieza la página siguiente, debajo del encabezado de la tabla
+            assert row['page'] == previous['page'] + 1
+            assert row['y'] == pdf_cotizaciones.PDF_TABLE_ROWS_Y
+            assert previous['y'] + previous['height'] + row['height'] > pdf.page_break_trigger
+    assert all(row['y'] + row['height'] <= pdf.page_break_trigger for row in rows)
+    assert layout['page_count'] == layout['totals_page'] >= rows[-1]['page'] > 1
+
+
+def test_totals_move_to_a_new_page_only_when_they_do_not_fit(tmp_path):
+    row_height = pdf_cotizaciones.PDF_ROW_MIN_HEIGHT
+    pdf, _ = _layout(tmp_path, {}, y_start=100)
+    first_page = int((pdf.page_break_trigger - 100) // row_height)
+    per_page = int((pdf.page_break_trigger - pdf_cotizaciones.PDF_TABLE_ROWS_Y) // row_height)
+    free_on_full_page = pdf.page_break_trigger - pdf_cotizaciones.PDF_TABLE_ROWS_Y - per_page * row_height
+    assert free_on_full_page < pdf_cotizaciones.PDF_TOTALS_HEIGHT <= free_on_full_page + row_height
+
+    _, layout = _layout(tmp_path, _items(first_page + per_page - 1), y_start=100)
+    assert (layout['totals_page'], layout['page_count']) == (2, 2)
+    assert layout['totals_y'] == layout['rows'][-1]['y'] + row_height
+
+    _, layout = _layout(tmp_path, _items(first_page + per_page), y_start=100)
+    assert layout['rows'][-1]['page'] == 2
+    assert (layout['totals_page'], layout['totals_y'], layout['page_count']) == (3, pdf_cotizaciones.PDF_HEADER_BOTTOM_Y, 3)
+
+
+def test_pdf_cache_tracks_images(monkeypatch):
+    generated = []
+    monkeypatch.setattr(app, 'generate_pdf_content', lambda quote_data, images, **kwargs: generated.append(images) or b'%PDF')
+    cache = app.PdfCache()
+    quote = {'numero_cotizacion': 'COT-1', 'items': {'1': {'sku': '1', 'cantidad': 1}}}
+
+    app.get_quote_pdf(quote, {'1': (None, 'error')}, cache)
+    app.get_quote_pdf(quote, {'1': (None, 'error')}, cache)
+    assert len(generated) == 2  # Con una imagen fallida no se guarda
+
+    app.get_quote_pdf(quote, {'1': (b'foto', 'ok')}, cache)
+    app.get_quote_pdf(quote, {'1': (b'foto', 'ok')}, cache)
+    assert len(generated) == 3
+
+    app.get_quote_pdf(quote, {'1': (b'otra foto', 'ok')}, cache)
+    assert len(generated) == 4
@@ -0,0 +1,108 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import app_cotizaciones as app
+from fakes import FakeFirestore
+
+
+def _load_quotes(db, count, tienda='Oviedo'):
+    # Varias cotizaciones por día: los cortes de página caen en empates de `fecha_orden`
+    start = date(2026, 10, 1)
+    db.load('cotizaciones', [{
+        'tienda': tienda,
+        'numero_cotizacion': f"COT-{i:04d}",
+        'fecha': (start + timedelta(days=i // 4)).strftime('%d/%m/%Y'),
+        'fecha_orden': (start + timedelta(days=i // 4)).isoformat(),
+        'cliente_nombre': f"Cliente {i}",
+        'total': 1000 * i,
+        'estado': app.ESTADOS_COTIZACION[0],
+        'items': {'1': {'sku': '1', 'valor_total': 1000 * i}},
+    } for i in range(count)])
+
+
+def test_tracking_pages_through_projected_query():
+    db = FakeFirestore()
+    _load_quotes(db, 23)
+    seen, cursor, pages = [], None, 0
+    while True:
+        rows, versions, cursor = app.get_tracking_page(db, 'Oviedo', page_size=5, cursor=cursor)
+        seen += [row['N° Cotización'] for row in rows]
+        assert set(versions) == {row['id'] for row in rows}
+        pages += 1
+        if cursor is None:
+            break
+    assert pages == 5
+    assert len(seen) == len(set(seen)) == 23
+    days = [int(numero[4:]) // 4 for numero in seen]
+    assert days == sorted(days, reverse=True)
+
+
+def test_tracking_page_boundary_inside_a_day_has_no_duplicates_or_gaps():
+    db = FakeFirestore()
+    _load_quotes(db, 10)  # Días de 4 cotizaciones: páginas de 4 cortan un día a la mitad
+    pages, cursor = [], None
+    while True:
+        rows, _, next_cursor = app.get_tracking_page(db, 'Oviedo', page_size=4, cursor=cursor)
+        pages.append(rows)
+        if next_cursor is None:
+            break
+        # El cursor es la última fila mostrada y trae su `fecha_orden` para `start_after`
+        assert next_cursor.id == rows[-1]['id']
+        fecha_orden = datetime.strptime(rows[-1]['Fecha'], '%d/%m/%Y').date().isoformat()
+        assert next_cursor.to_dict()['fecha_orden'] == fecha_orden
+        cursor = next_cursor
+
+    assert [len(rows) for rows in pages] == [4, 4, 2]
+    assert pages[0][-1]['Fecha'] == pages[1][0]['Fecha']  # El corte cae en un empate
+    ids = [row['id'] for rows in pages for row in rows]
+    all_ids = [doc.id for doc in db.collection('cotizaciones').stream()]
+    assert len(ids) == len(set(ids)) and set(ids) == set(all_ids)
+
+
+def test_diff_matches_rows_by_id_and_treats_missing_comments_as_empty():
+    original = pd.DataFrame({
+        'id': ['a', 'b', 'c'],
+        'Estado': ['🔵 Creada', '✉️ Enviada', '🔵 Creada'],
+        'Comentarios': [None, np.nan, 'llamar'],
+    }).set_index('id')
+    # El editor devuelve las filas reordenadas y los comentarios vacíos como NaN o ''
+    edited = pd.DataFrame({
+        'id': ['c', 'a', 'b'],
+        'Estado': ['🔵 Creada', '✅ Aprobada', '✉️ Enviada'],
+        'Comentarios': ['llamar el lunes', np.nan, ''],
+    })
+    assert app.diff_tracking_changes(original, edited) == {
+        'a': {'estado': '✅ Aprobada'},
+        'c': {'comentarios': 'llamar el lunes'},
+    }
+
+
+def test_update_made_after_the_page_loaded_is_a_conflict():
+    db = FakeFirestore()
+    _load_quotes(db, 3)
+    rows, versions, _ = app.get_tracking_page(db, 'Oviedo', page_size=10)
+    ids = [row['id'] for row in rows]
+    db.collection('cotizaciones').document(ids[0]).update({'estado': '❌ Rechazada'})
+
+    saved, failures = app.commit_quote_updates(
+        db, {doc_id: {'estado': '✅ Aprobada'} for doc_id in ids}, versions=versions)
+    assert sorted(saved) == sorted(ids[1:])
+    assert failures == {ids[0]: app.QUOTE_CONFLICT_ERROR}
+    assert db.collection('cotizaciones').document(ids[0]).get().to_dict()['estado'] == '❌ Rechazada'
+
+
+def test_updates_beyond_one_batch_are_split():
+    db = FakeFirestore()
+    count = app.FIRESTORE_BATCH_SIZE + 1
+    _load_quotes(db, count)
+    ids = [doc.id for doc in db.collection('cotizaciones').stream()]
+    progress = []
+    saved, failures = app.commit_quote_updates(
+        db, {doc_id: {'comentarios': 'revisada'} for doc_id in ids},
+        on_progress=lambda done, total: progress.append((done, total)))
+    assert db.batch_commits == 2
+    assert progress == [(app.FIRESTORE_BATCH_SIZE, count), (count, count)]
+    assert len(saved) == count and not failures
+    assert all(doc.to_dict()['comentarios'] == 'revisada' for doc in db.collection('cotizaciones').stream())